@@ -0,0 +1,242 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Boot device backends.
+
+Render the boot device of each BMC into a file its node's boot loader
+reads over the network: a GRUB config snippet, an iPXE script or a GRUB
+environment block, written to ``[boot] output_dir``. Files are named after
+the node's MAC address (the ``boot_mac`` BMC setting) when it is known, the
+way GRUB and iPXE look them up, and after the BMC name otherwise.
+
+The files only set the ``pbmc_boot_device`` variable to ``default``,
+``network``, ``hd`` or ``optical``; the boot loader configuration acts on
+it. Files are written by the process' write-behind writer, so the boot
+devices changed within a ``[state] flush_interval`` are written in a single
+pass, and a file is only rewritten when its content changes.
+
+Each file is replaced atomically, so a node never reads a partial file, but
+a pass is not atomic across files: a node booting while a pass is renaming
+the files into place may see the new boot device while another one still
+sees the old one. The boot loaders read a file per node, so there is no
+single object to switch for all of them at once.
+"""
+
+import abc
+import os
+import threading
+
+import six
+
+from poorbmc import config as pbmc_config
+from poorbmc import exception
+from poorbmc import log
+from poorbmc import state
+from poorbmc import utils
+
+LOG = log.get_logger()
+
+CONF = pbmc_config.get_config()
+
+BACKEND_NONE = 'none'
+
+_HEADER = 'Generated by poorbmc for BMC %s, do not edit'
+
+# The size of a GRUB environment block
+GRUBENV_SIZE = 1024
+
+
+@six.add_metaclass(abc.ABCMeta)
+class BootBackend(object):
+    """Boot device backend base class.
+
+    :param output_dir: The directory the files are written to.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    @abc.abstractmethod
+    def filename(self, bmc_name, mac=None):
+        """Return the name of the boot file of a node.
+
+        :param bmc_name: The name of the BMC of the node.
+        :param mac: The MAC address the node boots from, if known.
+        """
+
+    @abc.abstractmethod
+    def render(self, bmc_name, device):
+        """Return the content of the boot file of a node.
+
+        :param bmc_name: The name of the BMC of the node.
+        :param device: The boot device, one of
+            :data:`poorbmc.pbmc.BOOT_DEVICES`.
+        :returns: The content of the file, as bytes.
+        """
+
+    def path(self, bmc_name, mac=None):
+        return os.path.join(self.output_dir, self.filename(bmc_name, mac))
+
+
+class GrubBackend(BootBackend):
+    """GRUB config snippet, loaded by GRUB's netboot config lookup.
+
+    ``grub.cfg-01-<mac>`` sets the boot device then sources
+    ``[boot] grub_include`` from the GRUB prefix directory.
+    """
+
+    def filename(self, bmc_name, mac=None):
+        if mac:
+            return 'grub.cfg-01-%s' % mac.lower().replace(':', '-')
+        return 'grub.cfg-%s' % bmc_name
+
+    def render(self, bmc_name, device):
+        lines = ['# ' + _HEADER % bmc_name,
+                 'set pbmc_bmc="%s"' % bmc_name,
+                 'set pbmc_boot_device="%s"' % device,
+                 'source "$prefix/%s"' % CONF['boot']['grub_include'],
+                 '']
+        return '\n'.join(lines).encode('utf-8')
+
+
+class IPXEBackend(BootBackend):
+    """iPXE script, e.g. chained with ``chain ${mac:hexhyp}.ipxe``.
+
+    ``<mac>.ipxe`` sets the boot device then chains
+    ``[boot] ipxe_chain``.
+    """
+
+    def filename(self, bmc_name, mac=None):
+        if mac:
+            return '%s.ipxe' % mac.lower().replace(':', '-')
+        return '%s.ipxe' % bmc_name
+
+    def render(self, bmc_name, device):
+        lines = ['#!ipxe',
+                 '# ' + _HEADER % bmc_name,
+                 'set pbmc_bmc %s' % bmc_name,
+                 'set pbmc_boot_device %s' % device,
+                 'chain %s' % CONF['boot']['ipxe_chain'],
+                 '']
+        return '\n'.join(lines).encode('utf-8')
+
+
+class GrubenvBackend(BootBackend):
+    """GRUB environment block, read with ``load_env -f``."""
+
+    def filename(self, bmc_name, mac=None):
+        if mac:
+            return 'grubenv-01-%s' % mac.lower().replace(':', '-')
+        return 'grubenv-%s' % bmc_name
+
+    def render(self, bmc_name, device):
+        data = ('# GRUB Environment Block\n'
+                'pbmc_bmc=%s\n'
+                'pbmc_boot_device=%s\n' % (bmc_name, device))
+        data = data.encode('utf-8')
+        if len(data) > GRUBENV_SIZE:
+            raise exception.PoorBMCError(
+                'The GRUB environment block of bmc %s is too large' %
+                bmc_name)
+        # The block has a fixed size, padded with '#'
+        return data + b'#' * (GRUBENV_SIZE - len(data))
+
+
+BACKENDS = {
+    'grub': GrubBackend,
+    'ipxe': IPXEBackend,
+    'grubenv': GrubenvBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the configured boot backend, or ``None``."""
+    global _backend
+    name = CONF['boot']['backend']
+    if name == BACKEND_NONE:
+        return None
+
+    with _backend_lock:
+        if _backend is None:
+            try:
+                backend_class = BACKENDS[name]
+            except KeyError:
+                raise exception.PoorBMCError(
+                    'Unknown boot backend %(name)s, expected one of '
+                    '%(backends)s' % {
+                        'name': name,
+                        'backends': ', '.join([BACKEND_NONE] +
+                                              sorted(BACKENDS))})
+            _backend = backend_class(CONF['boot']['output_dir'])
+    return _backend
+
+
+class BootFile(object):
+    """The boot file of a node, written behind boot device changes.
+
+    :param backend: A :class:`BootBackend`.
+    :param bmc_name: The name of the BMC of the node.
+    :param device: The current boot device.
+    :param mac: The MAC address the node boots from, if known.
+    :raises: PoorBMCError if the BMC name can not be written in a boot
+        file (BMCs created before the names were checked).
+    """
+
+    def __init__(self, backend, bmc_name, device, mac=None):
+        if not utils.BMC_NAME_RE.match(bmc_name):
+            raise exception.PoorBMCError(
+                'Can not write the boot file of bmc %r: its name contains '
+                'characters the boot loader would interpret' % bmc_name)
+        self.backend = backend
+        self.bmc_name = bmc_name
+        self.device = device
+        self.path = backend.path(bmc_name, mac)
+        self._lock = threading.Lock()
+        self._written = self._read()
+        # Bring the file up to date with the persisted boot device
+        state.get_writer().schedule(self)
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, device):
+        """Change the boot device, writing the file shortly after."""
+        with self._lock:
+            if device == self.device:
+                return
+            self.device = device
+        state.get_writer().schedule(self)
+
+    def render(self):
+        """Return the new content of the file, or ``None`` if unchanged."""
+        with self._lock:
+            data = self.backend.render(self.bmc_name, self.device)
+            if data == self._written:
+                return None
+        try:
+            os.makedirs(self.backend.output_dir)
+        except OSError:
+            pass
+        return data
+
+    def written(self, data):
+        """Record the content written to the file."""
+        with self._lock:
+            self._written = data
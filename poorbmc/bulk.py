@@ -0,0 +1,199 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Bulk BMC definitions.
+
+Read and write the settings of many BMCs at once, as accepted by
+``pbmc add``, from CSV, JSON or YAML files:
+
+* CSV files have a header row naming the settings (see :data:`FIELDS`),
+  then a row per BMC; empty cells are unset.
+* JSON and YAML files hold a list of objects, one per BMC, or an object
+  mapping the BMC names to their settings.
+
+Settings left out get the defaults of ``pbmc add``.
+"""
+
+import collections
+import contextlib
+import csv
+import json
+import os
+import sys
+
+import six
+
+from poorbmc import exception
+
+CSV = 'csv'
+JSON = 'json'
+YAML = 'yaml'
+FORMATS = (CSV, JSON, YAML)
+
+_EXTENSIONS = {
+    '.csv': CSV,
+    '.json': JSON,
+    '.yaml': YAML,
+    '.yml': YAML,
+}
+
+# The settings of a BMC, in the order they are exported
+FIELDS = ('bmc_name', 'username', 'password', 'address', 'port',
+          'snmp_address', 'snmp_outlet', 'snmp_community', 'snmp_port',
+          'snmp_driver', 'snmp_version', 'snmp_security',
+          'snmp_auth_protocol', 'snmp_auth_key', 'snmp_priv_protocol',
+          'snmp_priv_key', 'snmp_engine_id', 'boot_mac')
+
+# The defaults of "pbmc add"
+DEFAULTS = {
+    'username': 'admin',
+    'password': 'password',
+    'address': '::',
+    'port': '623',
+    'snmp_community': 'private',
+    'snmp_port': '161',
+}
+
+
+def guess_format(path, default=JSON):
+    """Return the format of a file from its extension."""
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower(), default)
+
+
+@contextlib.contextmanager
+def _open(path, mode):
+    if path == '-':
+        yield sys.stdin if 'r' in mode else sys.stdout
+        return
+    if six.PY2:
+        # The csv module of Python 2 works on bytes
+        f = open(path, mode + 'b')
+    else:
+        f = open(path, mode, newline='')
+    with f:
+        yield f
+
+
+def _import_yaml():
+    # PyYAML is optional, and only imported when used
+    try:
+        import yaml
+    except ImportError:
+        raise exception.PoorBMCError(
+            'The YAML format requires the PyYAML package')
+    return yaml
+
+
+def _normalize(bmc, where):
+    if not isinstance(bmc, dict):
+        raise exception.PoorBMCError(
+            'Invalid BMC definition %(where)s: expected a mapping of '
+            'settings, got %(bmc)r' % {'where': where, 'bmc': bmc})
+
+    # Surplus CSV cells are keyed by None
+    unknown = [six.text_type(key) for key in bmc if key not in FIELDS]
+    if unknown:
+        raise exception.PoorBMCError(
+            'Unknown BMC settings %(where)s: %(unknown)s' %
+            {'where': where, 'unknown': ', '.join(sorted(unknown))})
+
+    # Values are stored as text, whatever their type in the file
+    definition = dict(DEFAULTS)
+    for key, value in bmc.items():
+        if value is not None and value != '':
+            definition[key] = six.text_type(value)
+    return definition
+
+
+def _parse(data, fmt):
+    if fmt == CSV:
+        reader = csv.DictReader(six.StringIO(data))
+        return [(row, 'on line %d' % reader.line_num) for row in reader]
+
+    if fmt == YAML:
+        yaml = _import_yaml()
+        try:
+            bmcs = yaml.safe_load(data)
+        except yaml.YAMLError as e:
+            raise exception.PoorBMCError('Invalid YAML: %s' % e)
+    else:
+        try:
+            bmcs = json.loads(data)
+        except ValueError as e:
+            raise exception.PoorBMCError('Invalid JSON: %s' % e)
+
+    if bmcs is None:
+        return []
+    if isinstance(bmcs, dict):
+        entries = []
+        for bmc_name, bmc in sorted(bmcs.items()):
+            if isinstance(bmc, dict):
+                bmc = dict(bmc, bmc_name=bmc_name)
+            entries.append((bmc, 'of bmc %s' % bmc_name))
+        return entries
+    if isinstance(bmcs, list):
+        return [(bmc, 'at index %d' % i) for i, bmc in enumerate(bmcs)]
+    raise exception.PoorBMCError(
+        'Invalid BMC definitions: expected a list or a mapping')
+
+
+def load(path, fmt=None):
+    """Read BMC definitions from a file.
+
+    :param path: The path of the file, or ``-`` for the standard input.
+    :param fmt: One of :data:`FORMATS`; guessed from the file extension
+        by default.
+    :raises: PoorBMCError if the file is malformed.
+    :returns: A list of dicts of settings, with the defaults applied.
+    """
+    if fmt is None:
+        fmt = guess_format(path)
+    try:
+        with _open(path, 'r') as f:
+            data = f.read()
+    except (IOError, OSError) as e:
+        raise exception.PoorBMCError(
+            'Error reading %(path)s. Error: %(error)s' %
+            {'path': path, 'error': e})
+
+    return [_normalize(bmc, where) for bmc, where in _parse(data, fmt)]
+
+
+def dump(bmcs, path, fmt=None):
+    """Write BMC definitions to a file.
+
+    :param bmcs: A list of dicts of settings; unset settings are left out.
+    :param path: The path of the file, or ``-`` for the standard output.
+    :param fmt: One of :data:`FORMATS`; guessed from the file extension
+        by default.
+    """
+    if fmt is None:
+        fmt = guess_format(path)
+    if fmt == YAML:
+        yaml = _import_yaml()
+
+    bmcs = [collections.OrderedDict((key, bmc[key]) for key in FIELDS
+                                    if bmc.get(key) is not None)
+            for bmc in bmcs]
+
+    with _open(path, 'w') as f:
+        if fmt == CSV:
+            writer = csv.DictWriter(f, FIELDS, lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(bmcs)
+        elif fmt == YAML:
+            yaml.safe_dump([dict(bmc) for bmc in bmcs], f,
+                           default_flow_style=False)
+        else:
+            json.dump(bmcs, f, indent=2, separators=(',', ': '))
+            f.write('\n')
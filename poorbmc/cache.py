@@ -0,0 +1,129 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+from poorbmc import log
+from poorbmc import metrics
+from poorbmc import power
+from poorbmc import snmp
+
+LOG = log.get_logger()
+
+states = snmp.states
+
+# Results of PowerStateCache.get()
+HIT = 'hit'
+STALE = 'stale'
+MISS = 'miss'
+
+CACHE_READS = metrics.Counter(
+    'pbmc_power_cache_reads_total',
+    'Power state reads, by result: hit (fresh), stale (served while '
+    'refreshed in the background) or miss (answered "node busy" while '
+    'read from the PDU).',
+    ('bmc', 'result'))
+
+
+class PowerStateCache(object):
+    """Cache the power state of a single outlet.
+
+    A cached state younger than ``ttl`` seconds is returned as is. Up to
+    ``stale_ttl`` seconds it is still returned, but a refresh is started
+    in the background (stale-while-revalidate). Reads never wait for the
+    PDU: older states, or an empty cache, start a refresh in the background
+    and return None, so the caller answers "node busy" and the client
+    retries. A ``ttl`` of 0 makes every read start a refresh, and
+    ``states.ERROR`` is never cached.
+
+    :param refresh: Callable returning the current power state, as read
+        from the PDU.
+    :param ttl: Time (in seconds) a cached state is considered fresh.
+    :param stale_ttl: Time (in seconds) a cached state may be served while
+        it is refreshed in the background.
+    :param bmc_name: The name of the BMC of the outlet, in the metrics.
+    """
+
+    def __init__(self, refresh, ttl, stale_ttl, bmc_name=None):
+        self._refresh = refresh
+        self.bmc_name = bmc_name
+        self.ttl = ttl
+        self.stale_ttl = max(ttl, stale_ttl)
+        self._state = None
+        self._updated = 0
+        # Bumped by every set/invalidate, so a refresh started before a
+        # power command can not overwrite its result
+        self._generation = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _store(self, state, generation):
+        # Called with the lock held. Unknown states (e.g. an outlet
+        # reporting an unexpected value) are not worth keeping.
+        if generation == self._generation and state != states.ERROR:
+            self._state = state
+            self._updated = time.time()
+
+    def _refresh_background(self, generation):
+        try:
+            state = self._refresh()
+        except Exception as e:
+            LOG.warning('Background power state refresh failed, keeping '
+                        'the cached state. Error: %s', e)
+            with self._lock:
+                self._refreshing = False
+        else:
+            with self._lock:
+                self._refreshing = False
+                self._store(state, generation)
+
+    def get(self):
+        """Return the power state, from the cache if possible.
+
+        Runs on the IPMI loop of the process, so never reads from the
+        PDU: whenever the cached state is not fresh, a single refresh is
+        started on the refresh executor.
+
+        :returns: The cached power state, or None if there is none to
+            serve yet.
+        """
+        with self._lock:
+            age = time.time() - self._updated
+            if self._state is not None and age <= self.ttl:
+                CACHE_READS.inc(self.bmc_name, HIT)
+                return self._state
+
+            if self._state is not None and age <= self.stale_ttl:
+                CACHE_READS.inc(self.bmc_name, STALE)
+                state = self._state
+            else:
+                CACHE_READS.inc(self.bmc_name, MISS)
+                state = None
+            if not self._refreshing:
+                self._refreshing = True
+                power.get_refresh_executor().submit(
+                    self._refresh_background, self._generation)
+            return state
+
+    def set(self, state):
+        """Update the cache, e.g. after a successful power command."""
+        with self._lock:
+            self._generation += 1
+            self._state = None
+            self._store(state, self._generation)
+
+    def invalidate(self):
+        """Drop the cached state so the next read goes to the PDU."""
+        with self._lock:
+            self._generation += 1
+            self._state = None
@@ -18,6 +18,9 @@ from cliff.commandmanager import CommandManager
 from cliff.lister import Lister
 
 import poorbmc
+from poorbmc import bulk
+from poorbmc import exception
+from poorbmc import manager
 from poorbmc.manager import PoorBMCManager
 
 
@@ -25,6 +28,9 @@ class AddCommand(Command):
     """Create a new BMC for a virtual machine instance"""
 
     def get_parser(self, prog_name):
+        # Not imported at the top, to keep the other commands fast
+        from poorbmc import snmp
+
         parser = super(AddCommand, self).get_parser(prog_name)
 
         parser.add_argument('bmc_name',
@@ -58,6 +64,45 @@ class AddCommand(Command):
                             type=int,
                             default=161,
                             dest='snmp_port')
+        parser.add_argument('--snmp_driver',
+                            dest='snmp_driver',
+                            choices=sorted(snmp.DRIVER_CLASSES),
+                            help=('The PDU driver; defaults to "%s"' %
+                                  snmp.DEFAULT_DRIVER))
+        parser.add_argument('--snmp_version',
+                            dest='snmp_version',
+                            choices=(snmp.SNMP_V1, snmp.SNMP_V2C,
+                                     snmp.SNMP_V3),
+                            help=('The SNMP version; defaults to "%s"' %
+                                  snmp.SNMP_V1))
+        parser.add_argument('--snmp_security',
+                            dest='snmp_security',
+                            help='The SNMPv3 USM username')
+        parser.add_argument('--snmp_auth_protocol',
+                            dest='snmp_auth_protocol',
+                            choices=sorted(snmp.snmp_auth_protocols),
+                            help=('The SNMPv3 authentication protocol; '
+                                  'defaults to "%s"' %
+                                  snmp.DEFAULT_AUTH_PROTOCOL))
+        parser.add_argument('--snmp_auth_key',
+                            dest='snmp_auth_key',
+                            help='The SNMPv3 authentication pass phrase')
+        parser.add_argument('--snmp_priv_protocol',
+                            dest='snmp_priv_protocol',
+                            choices=sorted(snmp.snmp_priv_protocols),
+                            help=('The SNMPv3 privacy protocol; defaults to '
+                                  '"%s"' % snmp.DEFAULT_PRIV_PROTOCOL))
+        parser.add_argument('--snmp_priv_key',
+                            dest='snmp_priv_key',
+                            help='The SNMPv3 privacy pass phrase')
+        parser.add_argument('--snmp_engine_id',
+                            dest='snmp_engine_id',
+                            help=('The SNMPv3 engine ID of the PDU in '
+                                  'hexadecimal, if known'))
+        parser.add_argument('--boot_mac',
+                            dest='boot_mac',
+                            help=('The MAC address the node boots from, '
+                                  'used to name its boot file'))
         return parser
 
     def take_action(self, args):
@@ -68,7 +113,16 @@ class AddCommand(Command):
                              snmp_address=args.snmp_address,
                              snmp_outlet=args.snmp_outlet,
                              snmp_community=args.snmp_community,
-                             snmp_port=str(args.snmp_port))
+                             snmp_port=str(args.snmp_port),
+                             snmp_driver=args.snmp_driver,
+                             snmp_version=args.snmp_version,
+                             snmp_security=args.snmp_security,
+                             snmp_auth_protocol=args.snmp_auth_protocol,
+                             snmp_auth_key=args.snmp_auth_key,
+                             snmp_priv_protocol=args.snmp_priv_protocol,
+                             snmp_priv_key=args.snmp_priv_key,
+                             snmp_engine_id=args.snmp_engine_id,
+                             boot_mac=args.boot_mac)
 
 
 class DeleteCommand(Command):
@@ -87,35 +141,177 @@ class DeleteCommand(Command):
             self.app.manager.delete(bmc)
 
 
-class StartCommand(Command):
-    """Start a virtual BMC for a virtual machine instance"""
+class BulkCommand(Lister):
+    """Base class of the commands acting on many BMCs at once"""
 
     def get_parser(self, prog_name):
-        parser = super(StartCommand, self).get_parser(prog_name)
+        parser = super(BulkCommand, self).get_parser(prog_name)
 
-        parser.add_argument('bmc_name',
-                            help='The name of the bmc')
+        self.add_arguments(parser)
+        parser.add_argument('bmc_names', nargs='*',
+                            help=('A list of bmc names or shell-style '
+                                  'patterns, e.g. "node1*"'))
+        parser.add_argument('--all',
+                            action='store_true',
+                            default=False,
+                            help='Act on every bmc')
 
         return parser
 
+    def add_arguments(self, parser):
+        """Add the arguments of the command, before the bmc names."""
+
+    def get_bmc_names(self, args):
+        if args.all:
+            return self.app.manager.match(['*'])
+        if not args.bmc_names:
+            raise exception.PoorBMCError(
+                'No bmc names given, use --all to act on every bmc')
+        return self.app.manager.match(args.bmc_names)
+
+    def format_results(self, results):
+        """Return the rows of a dict mapping BMC names to their result.
+
+        The command exits with an error if any result is an exception.
+        """
+        self.failed = any(isinstance(result, Exception)
+                          for result in results.values())
+        header = ('BMC name', 'Result')
+        rows = [(bmc_name, str(result))
+                for bmc_name, result in results.items()]
+
+        return header, sorted(rows)
+
+    def run(self, parsed_args):
+        self.failed = False
+        ret = super(BulkCommand, self).run(parsed_args)
+        return 1 if self.failed else ret
+
+
+class StartCommand(BulkCommand):
+    """Start virtual BMCs for virtual machine instances"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout',
+                            type=float,
+                            default=manager.START_TIMEOUT,
+                            help=('Seconds to wait for the bmcs to be '
+                                  'ready; defaults to %d' %
+                                  manager.START_TIMEOUT))
+
+    def take_action(self, args):
+        results = self.app.manager.start_many(self.get_bmc_names(args),
+                                              timeout=args.timeout)
+        return self.format_results(results)
+
+
+class StopCommand(BulkCommand):
+    """Stop virtual BMCs for virtual machine instances"""
+
     def take_action(self, args):
-        self.app.manager.start(args.bmc_name)
+        results = self.app.manager.stop_many(self.get_bmc_names(args))
+        return self.format_results(results)
 
 
-class StopCommand(Command):
-    """Stop a virtual BMC for a virtual machine instance"""
+class ServeCommand(Command):
+    """Serve every configured BMC from a single process"""
 
     def get_parser(self, prog_name):
-        parser = super(StopCommand, self).get_parser(prog_name)
+        parser = super(ServeCommand, self).get_parser(prog_name)
 
-        parser.add_argument('bmc_names', nargs='+',
-                            help='A list of bmc names')
+        parser.add_argument('--foreground',
+                            action='store_true',
+                            default=False,
+                            help='Do not detach from the terminal')
+
+        return parser
+
+    def take_action(self, args):
+        self.app.manager.serve(foreground=args.foreground)
+
+
+class PowerCommand(BulkCommand):
+    """Power on, off or reset many BMCs at once"""
+
+    def add_arguments(self, parser):
+        from poorbmc import scheduler
+
+        parser.add_argument('action',
+                            choices=scheduler.ACTIONS,
+                            help='The power action')
+        parser.add_argument('--interval',
+                            type=float,
+                            default=None,
+                            help=('Seconds between two power on commands '
+                                  'sent to the same PDU; defaults to the '
+                                  'configured stagger_interval'))
+
+    def take_action(self, args):
+        results = self.app.manager.power(args.action,
+                                         self.get_bmc_names(args),
+                                         interval=args.interval)
+        return self.format_results(results)
+
+
+class ImportCommand(Lister):
+    """Create many BMCs from a CSV, JSON or YAML file"""
+
+    def get_parser(self, prog_name):
+        parser = super(ImportCommand, self).get_parser(prog_name)
+
+        parser.add_argument('file',
+                            help=('The file of BMC definitions, or - for '
+                                  'the standard input'))
+        parser.add_argument('--file_format',
+                            dest='file_format',
+                            choices=bulk.FORMATS,
+                            help=('The format of the file; guessed from '
+                                  'its extension by default, or json'))
+        parser.add_argument('--skip_existing',
+                            dest='skip_existing',
+                            action='store_true',
+                            default=False,
+                            help=('Skip the BMCs that exist already '
+                                  'instead of failing'))
+
+        return parser
+
+    def take_action(self, args):
+        bmcs = bulk.load(args.file, args.file_format)
+        results = self.app.manager.add_many(
+            bmcs, skip_existing=args.skip_existing)
+
+        header = ('BMC name', 'Result')
+        rows = [(bmc_name, 'added' if added else 'exists')
+                for bmc_name, added in results.items()]
+
+        return header, sorted(rows)
+
+
+class ExportCommand(Command):
+    """Write the definitions of BMCs to a CSV, JSON or YAML file"""
+
+    def get_parser(self, prog_name):
+        parser = super(ExportCommand, self).get_parser(prog_name)
+
+        parser.add_argument('bmc_names', nargs='*',
+                            help='A list of bmc names; defaults to all')
+        parser.add_argument('--file',
+                            dest='file',
+                            default='-',
+                            help=('The file to write, passwords included; '
+                                  'defaults to the standard output'))
+        parser.add_argument('--file_format',
+                            dest='file_format',
+                            choices=bulk.FORMATS,
+                            help=('The format of the file; guessed from '
+                                  'its extension by default, or json'))
 
         return parser
 
     def take_action(self, args):
-        for bmc_name in args.bmc_names:
-            self.app.manager.stop(bmc_name)
+        bmcs = self.app.manager.export(args.bmc_names or None)
+        bulk.dump(bmcs, args.file, args.file_format)
 
 
 class ListCommand(Lister):
@@ -45,6 +45,122 @@ class PoorBMCConfig(object):
             # Maximum time (in seconds) to wait for the data to come across
             'session_timeout': 1
         },
+        'power': {
+            # Time (in seconds) a power state read from the PDU is served
+            # from cache; 0 refreshes it on every read
+            'cache_ttl': 2,
+            # Time (in seconds) a cached power state may still be served
+            # while it is refreshed in the background; older states are
+            # answered with "node busy" until the refresh completes
+            'cache_stale_ttl': 30,
+            # Number of threads waiting for outlets to switch after a
+            # power command, shared by all the BMCs of a process
+            'workers': 16,
+            # Number of threads sending the power commands to the PDUs,
+            # and refreshing the cached power states, per process
+            'send_workers': 4,
+            'refresh_workers': 4,
+            # Time (in seconds) between two power on commands sent to the
+            # same PDU, over IPMI or by "pbmc power"
+            'stagger_interval': 1.0,
+            # Time (in seconds) a stopping BMC daemon or "pbmc serve" waits
+            # for the power commands in flight to be confirmed
+            'drain_timeout': 70
+        },
+        'pdu': {
+            # Maximum number of SNMP requests outstanding at once on a PDU
+            'max_concurrency': 2,
+            # Maximum number of SNMP requests started per second on a PDU,
+            # in bursts of up to "burst" requests; 0 means unlimited.
+            'rate': 0,
+            'burst': 1,
+            # Maximum time (in seconds) an SNMP request may take, retries
+            # included, before it fails with a timeout.
+            # All of them can be overridden for a single PDU in a
+            # [pdu:<address>] section.
+            'request_timeout': 6.0
+        },
+        'traps': {
+            # Listen for SNMP traps/informs from the PDUs in "pbmc serve",
+            # to confirm power commands as soon as an outlet switches
+            'enabled': 'false',
+            'address': '0.0.0.0',
+            'port': 162
+        },
+        'state': {
+            # Time (in seconds) changes to the runtime state of the BMCs
+            # (e.g. the boot device) are collected before being written to
+            # disk in a single batch
+            'flush_interval': 1.0
+        },
+        'boot': {
+            # How the boot device of the BMCs is handed to their nodes:
+            # "none" only keeps it, "grub", "ipxe" and "grubenv" write it
+            # to a GRUB config snippet, iPXE script or GRUB environment
+            # block per node in output_dir, to be served over TFTP/HTTP
+            'backend': 'none',
+            'output_dir': '/var/lib/tftpboot/pbmc',
+            # File sourced by the GRUB snippets, relative to $prefix
+            'grub_include': 'pbmc.cfg',
+            # Script chained by the iPXE scripts
+            'ipxe_chain': 'pbmc.ipxe'
+        },
+        'serve': {
+            # How often (in seconds) "pbmc serve" rescans config_dir for
+            # added, removed or modified BMCs
+            'rescan_interval': 10,
+            # How often (in seconds) every hosted BMC is sent an IPMI Get
+            # Channel Authentication Capabilities request, how long (in
+            # seconds) it has to answer, and how many unanswered requests
+            # in a row get its listener restarted. Probes sent while the
+            # IPMI loop of the server is busy are not counted.
+            'probe_interval': 10,
+            'probe_timeout': 1.0,
+            'probe_failures': 3,
+            # Bounds (in seconds) of the exponential backoff between two
+            # restarts of a BMC listener that failed
+            'restart_backoff_min': 1.0,
+            'restart_backoff_max': 300
+        },
+        'metrics': {
+            # Serve the IPMI and SNMP metrics of "pbmc serve" over HTTP,
+            # in the Prometheus text format, at /metrics
+            'enabled': 'false',
+            'address': '127.0.0.1',
+            'port': 9623
+        },
+        'simulated': {
+            # Behaviour of the PDUs of the BMCs using the "simulated"
+            # driver, which keeps the outlets in memory instead of talking
+            # to a PDU. Can be overridden for a single PDU address in a
+            # [simulated:<address>] section.
+            # Seconds each request takes
+            'latency': 0,
+            # Seconds an outlet takes to switch, and stays off when power
+            # cycled
+            'switch_delay': 1.0,
+            'reboot_time': 5.0,
+            # Fraction of the requests failing, and comma separated
+            # outlets ignoring commands
+            'failure_rate': 0,
+            'stuck_outlets': '',
+            # Power state of the outlets when the process starts
+            'initial_state': 'off'
+        },
+        'trace': {
+            # Where the spans timing the IPMI request handling, the SNMP
+            # requests and the outlet polls go: "none", "file" (appended
+            # as JSON lines to "file") or "otlp" (exported to an
+            # OpenTelemetry collector at otlp_endpoint, requires the
+            # opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http
+            # packages)
+            'exporter': 'none',
+            'file': os.path.join(os.path.expanduser('~'), '.pbmc',
+                                 'trace.jsonl'),
+            'otlp_endpoint': 'http://127.0.0.1:4318/v1/traces',
+            # Fraction of the IPMI requests and power commands traced
+            'sample_rate': 1.0
+        },
     }
 
     def initialize(self):
@@ -73,6 +189,72 @@ class PoorBMCConfig(object):
         self._conf_dict['ipmi']['session_timeout'] = int(
             self._conf_dict['ipmi']['session_timeout'])
 
+        self._conf_dict['power']['cache_ttl'] = float(
+            self._conf_dict['power']['cache_ttl'])
+
+        self._conf_dict['power']['cache_stale_ttl'] = float(
+            self._conf_dict['power']['cache_stale_ttl'])
+
+        for key in ('workers', 'send_workers', 'refresh_workers'):
+            self._conf_dict['power'][key] = int(
+                self._conf_dict['power'][key])
+
+        self._conf_dict['power']['stagger_interval'] = float(
+            self._conf_dict['power']['stagger_interval'])
+
+        self._conf_dict['power']['drain_timeout'] = float(
+            self._conf_dict['power']['drain_timeout'])
+
+        self._conf_dict['state']['flush_interval'] = float(
+            self._conf_dict['state']['flush_interval'])
+
+        self._conf_dict['serve']['rescan_interval'] = int(
+            self._conf_dict['serve']['rescan_interval'])
+
+        for key, convert in (('probe_interval', float),
+                             ('probe_timeout', float),
+                             ('probe_failures', int),
+                             ('restart_backoff_min', float),
+                             ('restart_backoff_max', float)):
+            self._conf_dict['serve'][key] = convert(
+                self._conf_dict['serve'][key])
+
+        self._conf_dict['traps']['enabled'] = utils.str2bool(
+            self._conf_dict['traps']['enabled'])
+
+        self._conf_dict['traps']['port'] = int(
+            self._conf_dict['traps']['port'])
+
+        self._conf_dict['metrics']['enabled'] = utils.str2bool(
+            self._conf_dict['metrics']['enabled'])
+
+        self._conf_dict['metrics']['port'] = int(
+            self._conf_dict['metrics']['port'])
+
+        self._conf_dict['trace']['sample_rate'] = float(
+            self._conf_dict['trace']['sample_rate'])
+
+        for section in self._conf_dict:
+            if section == 'pdu' or section.startswith('pdu:'):
+                limits = self._conf_dict[section]
+                for key, convert in (('max_concurrency', int),
+                                     ('rate', float),
+                                     ('burst', int),
+                                     ('request_timeout', float)):
+                    if key in limits:
+                        limits[key] = convert(limits[key])
+            if section == 'simulated' or section.startswith('simulated:'):
+                settings = self._conf_dict[section]
+                for key in ('latency', 'switch_delay', 'reboot_time',
+                            'failure_rate'):
+                    if key in settings:
+                        settings[key] = float(settings[key])
+                if 'stuck_outlets' in settings:
+                    settings['stuck_outlets'] = set(
+                        int(outlet) for outlet in
+                        str(settings['stuck_outlets']).split(',')
+                        if outlet.strip())
+
     def __getitem__(self, key):
         return self._conf_dict[key]
 
@@ -24,13 +24,30 @@ class PoorBMCError(Exception):
 
 
 class SNMPFailure(PoorBMCError):
-    _msg_fmt = "SNMP operation '%(operation)s' failed: %(error)s"
+    message = "SNMP operation '%(operation)s' failed: %(error)s"
+
+
+class SNMPTimeout(SNMPFailure):
+    message = "SNMP operation '%(operation)s' timed out: %(error)s"
+
+
+class InvalidSNMPSecurity(PoorBMCError):
+    message = 'Invalid SNMP security settings: %(error)s'
+
+
+class SNMPDriverNotFound(PoorBMCError):
+    message = ('No SNMP driver named %(driver)s, expected one of '
+               '%(drivers)s')
 
 
 class BMCAlreadyExists(PoorBMCError):
     message = 'BMC %(bmc)s already exists'
 
 
+class InvalidBMCSettings(PoorBMCError):
+    message = 'Invalid settings for bmc %(bmc)s: %(error)s'
+
+
 class BMCNotFound(PoorBMCError):
     message = 'No bmc with matching name %(bmc)s was found'
 
@@ -0,0 +1,171 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Index of the BMC configurations.
+
+A SQLite database in ``<config_dir>/.index`` holding the parsed config and
+the PID of every BMC, so listing them is a single query instead of a
+config parse and a PID file read per BMC. The BMC config files remain the
+source of truth: every entry records the mtime of the config it was parsed
+from, and the index records the mtime of the config directory it was
+last reconciled with, so the manager can tell when it is out of date.
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+
+INDEX_DIR = '.index'
+INDEX_FILE = 'index.db'
+
+# Time (in seconds) to wait for a concurrent writer
+_LOCK_TIMEOUT = 10
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS bmcs ('
+    '  name TEXT PRIMARY KEY,'
+    '  config TEXT NOT NULL,'
+    '  config_mtime REAL NOT NULL,'
+    '  pid INTEGER)',
+    'CREATE TABLE IF NOT EXISTS meta ('
+    '  key TEXT PRIMARY KEY,'
+    '  value TEXT NOT NULL)',
+)
+
+
+class BMCIndex(object):
+    """The index of the BMCs configured in a directory.
+
+    :param config_dir: The config directory of the BMCs.
+    :raises: sqlite3.Error from every method if the index can not be used.
+    """
+
+    def __init__(self, config_dir):
+        self.path = os.path.join(config_dir, INDEX_DIR, INDEX_FILE)
+        self._conn = None
+        self._pid = None
+        self._depth = 0
+
+    def _connect(self):
+        # SQLite connections must not be shared with forked children
+        if self._conn is None or self._pid != os.getpid():
+            index_dir = os.path.dirname(self.path)
+            if not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            # Transactions are handled by transaction()
+            conn = sqlite3.connect(self.path, timeout=_LOCK_TIMEOUT,
+                                   isolation_level=None)
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+            self._pid = os.getpid()
+            self._depth = 0
+        return self._conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Group the reads and changes made in the block atomically.
+
+        Transactions may be nested, only the outermost one commits.
+        """
+        conn = self._connect()
+        self._depth += 1
+        try:
+            if self._depth > 1:
+                yield
+                return
+
+            # Take the write lock right away, so the reads made in the
+            # block are consistent with the changes
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            self._depth -= 1
+
+    def get_all(self):
+        """Return every indexed BMC.
+
+        :returns: A list of ``(name, config, config_mtime, pid)`` tuples.
+        """
+        rows = self._connect().execute(
+            'SELECT name, config, config_mtime, pid FROM bmcs '
+            'ORDER BY name')
+        return [(name, json.loads(config), config_mtime, pid)
+                for name, config, config_mtime, pid in rows]
+
+    def get(self, name):
+        """Return an indexed BMC, or ``None``.
+
+        :returns: A ``(name, config, config_mtime, pid)`` tuple.
+        """
+        row = self._connect().execute(
+            'SELECT name, config, config_mtime, pid FROM bmcs '
+            'WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        name, config, config_mtime, pid = row
+        return name, json.loads(config), config_mtime, pid
+
+    def config_mtimes(self):
+        """Return a dict mapping the indexed BMCs to their config mtime."""
+        return dict(self._connect().execute(
+            'SELECT name, config_mtime FROM bmcs'))
+
+    def put(self, name, config, config_mtime, pid=None):
+        with self.transaction():
+            self._conn.execute(
+                'INSERT OR REPLACE INTO bmcs '
+                '(name, config, config_mtime, pid) VALUES (?, ?, ?, ?)',
+                (name, json.dumps(config, sort_keys=True), config_mtime,
+                 pid))
+
+    def set_pid(self, name, pid):
+        with self.transaction():
+            self._conn.execute('UPDATE bmcs SET pid = ? WHERE name = ?',
+                               (pid, name))
+
+    def delete(self, name):
+        with self.transaction():
+            self._conn.execute('DELETE FROM bmcs WHERE name = ?', (name,))
+
+    def dir_mtime(self):
+        """The mtime of the config directory the index is up to date with.
+        """
+        row = self._connect().execute(
+            "SELECT value FROM meta WHERE key = 'dir_mtime'").fetchone()
+        return None if row is None else float(row[0])
+
+    def set_dir_mtime(self, mtime):
+        with self.transaction():
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) "
+                               "VALUES ('dir_mtime', ?)", (repr(mtime),))
+
+    def touch(self, before, after):
+        """Record a change of the config directory made through the index.
+
+        The index is only considered up to date with the new mtime of the
+        directory if it was up to date before the change; otherwise
+        changes made behind its back would be missed.
+
+        :param before: The mtime of the directory before the change.
+        :param after: The mtime of the directory after the change.
+        """
+        with self.transaction():
+            if self.dir_mtime() == before:
+                self.set_dir_mtime(after)
@@ -11,27 +11,97 @@
 #    under the License.
 
 import errno
+import fnmatch
 import os
+import re
+import select
 import shutil
 import signal
+import sqlite3
+import sys
+import time
 
 import six
 from six.moves import configparser
 
 from poorbmc import config as pbmc_config
 from poorbmc import exception
+from poorbmc import index
 from poorbmc import log
-from poorbmc.pbmc import PoorBMC
+from poorbmc import state
+from poorbmc import supervisor
 from poorbmc import utils
 
+# The IPMI and SNMP stacks (poorbmc.pbmc, poorbmc.scheduler, poorbmc.server
+# and poorbmc.snmp) take several hundred milliseconds to import, so they are
+# only imported by the methods using them: read-only commands like
+# "pbmc list" never need them.
+
 LOG = log.get_logger()
 
 # BMC status
 RUNNING = 'running'
 DOWN = 'down'
+# Hosted by "pbmc serve" but not answering IPMI requests
+UNRESPONSIVE = 'unresponsive'
 
 DEFAULT_SECTION = 'PoorBMC'
 
+# MAC addresses, as six colon or dash separated hex octets
+MAC_RE = re.compile(
+    r'^[0-9a-f]{2}([:-])[0-9a-f]{2}(\1[0-9a-f]{2}){4}\Z', re.IGNORECASE)
+
+# Optional SNMP settings of a BMC, only written to its config when set
+OPTIONAL_SNMP_SETTINGS = ('snmp_driver', 'snmp_version', 'snmp_security',
+                          'snmp_auth_protocol', 'snmp_auth_key',
+                          'snmp_priv_protocol', 'snmp_priv_key',
+                          'snmp_engine_id')
+
+# PID file of the "pbmc serve" process, relative to config_dir
+SERVE_PIDFILE = 'serve.pid'
+
+# Control socket of the "pbmc serve" process, relative to config_dir
+SERVE_SOCKET = 'serve.sock'
+
+# Time (in seconds) a BMC is given to exit after SIGTERM, on top of
+# [power] drain_timeout, before it is killed
+STOP_TIMEOUT = 5
+
+# Time (in seconds) "pbmc serve" is given to report the status of its BMCs
+STATUS_TIMEOUT = 5
+
+# Time (in seconds) start_many() waits for the BMCs to be ready
+START_TIMEOUT = 30
+
+# Time (in seconds) "pbmc serve" is given to send the SETs of a power
+# action, on top of the time its outlets take to switch
+POWER_TIMEOUT = 30
+
+# Results of start_many() and stop_many()
+STARTED = 'started'
+ALREADY_RUNNING = 'already running'
+STOPPED = 'stopped'
+NOT_RUNNING = 'not running'
+
+# Reported by a daemon once its IPMI socket is bound
+_READY = b'ready'
+
+
+def _report(fd, data):
+    try:
+        os.write(fd, data)
+    except OSError:
+        # Nobody is waiting any more
+        pass
+    finally:
+        os.close(fd)
+
+
+def _exit_on_sigterm(signum, frame):
+    # Unwind the IPMI loop so the pending state changes are written
+    sys.exit(0)
+
+
 CONF = pbmc_config.get_config()
 
 
@@ -40,6 +110,8 @@ class PoorBMCManager(object):
     def __init__(self):
         super(PoorBMCManager, self).__init__()
         self.config_dir = CONF['default']['config_dir']
+        self.control_path = os.path.join(self.config_dir, SERVE_SOCKET)
+        self.index = index.BMCIndex(self.config_dir)
 
     def _parse_config(self, bmc_name):
         config_path = os.path.join(self.config_dir, bmc_name, 'config')
@@ -52,7 +124,7 @@ class PoorBMCManager(object):
         bmc = {}
         for item in ('username', 'password', 'address', 'bmc_name',
                      'snmp_address', 'snmp_outlet', 'snmp_community',
-                     'snmp_port'):
+                     'snmp_port', 'boot_mac') + OPTIONAL_SNMP_SETTINGS:
             try:
                 value = config.get(DEFAULT_SECTION, item)
             except configparser.NoOptionError:
@@ -65,19 +137,145 @@ class PoorBMCManager(object):
 
         return bmc
 
-    def _show(self, bmc_name):
-        running = False
+    def _bmc_names(self):
         try:
-            pidfile_path = os.path.join(self.config_dir, bmc_name, 'pid')
-            with open(pidfile_path, 'r') as f:
-                pid = int(f.read())
+            # Dot directories (e.g. the index) are not BMCs
+            return [bmc for bmc in os.listdir(self.config_dir)
+                    if not bmc.startswith('.') and
+                    os.path.isdir(os.path.join(self.config_dir, bmc))]
+        except OSError:
+            return []
 
-            running = utils.is_pid_running(pid)
-        except (IOError, ValueError):
-            pass
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _config_mtime(self, bmc_name):
+        return self._mtime(os.path.join(self.config_dir, bmc_name, 'config'))
+
+    def _update_index(self, func, *args):
+        """Apply a change to the index, which is only an optimization."""
+        try:
+            func(*args)
+        except (sqlite3.Error, OSError) as e:
+            LOG.warning('Error updating the BMC index %(path)s, it will be '
+                        'rebuilt. Error: %(error)s',
+                        {'path': self.index.path, 'error': e})
 
+    def _index_bmc(self, bmc_name, config_mtime):
         bmc_config = self._parse_config(bmc_name)
-        bmc_config['status'] = RUNNING if running else DOWN
+        pid = self._read_pid(os.path.join(self.config_dir, bmc_name, 'pid'))
+        self.index.put(bmc_name, bmc_config, config_mtime, pid)
+        return bmc_config, pid
+
+    def _sync_index(self):
+        """Reconcile the index with BMCs added or deleted behind its back.
+
+        Only the mtime of the config directory is checked when nothing
+        was added or deleted; otherwise the configs that changed are parsed
+        again.
+        """
+        dir_mtime = self._mtime(self.config_dir)
+        if dir_mtime is None or self.index.dir_mtime() == dir_mtime:
+            return
+
+        with self.index.transaction():
+            indexed = self.index.config_mtimes()
+            bmc_names = set(self._bmc_names())
+            for bmc_name in set(indexed) - bmc_names:
+                self.index.delete(bmc_name)
+            for bmc_name in bmc_names:
+                config_mtime = self._config_mtime(bmc_name)
+                if (config_mtime is not None and
+                        indexed.get(bmc_name) != config_mtime):
+                    self._index_bmc(bmc_name, config_mtime)
+            self.index.set_dir_mtime(dir_mtime)
+
+    def _read_pid(self, pidfile_path):
+        try:
+            with open(pidfile_path, 'r') as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return None
+
+    def _write_pid(self, bmc_name, pid):
+        pidfile_path = os.path.join(self.config_dir, bmc_name, 'pid')
+        with open(pidfile_path, 'w') as f:
+            f.write(str(pid))
+        self._update_index(self.index.set_pid, bmc_name, pid)
+
+    def _lock_pid(self, bmc_name, pid):
+        """Write the PID file of a BMC daemon, locked while it runs."""
+        pidfile_path = os.path.join(self.config_dir, bmc_name, 'pid')
+        fd = utils.lock_pidfile(pidfile_path, pid)
+        self._update_index(self.index.set_pid, bmc_name, pid)
+        return fd
+
+    def _remove_pid(self, bmc_name):
+        try:
+            os.remove(os.path.join(self.config_dir, bmc_name, 'pid'))
+        except OSError:
+            pass
+        self._update_index(self.index.set_pid, bmc_name, None)
+
+    def _serve_pid(self):
+        pidfile_path = os.path.join(self.config_dir, SERVE_PIDFILE)
+        if utils.is_pidfile_locked(pidfile_path):
+            return self._read_pid(pidfile_path)
+
+    def _served(self):
+        """Ask "pbmc serve", if it runs, for the status of its BMCs.
+
+        :returns: A ``(pid, bmcs)`` tuple, where ``bmcs`` maps the names of
+            the BMCs to their status, or is ``None`` if the server does
+            not answer. Both are ``None`` if it is not running.
+        """
+        serve_pid = self._serve_pid()
+        if serve_pid is None:
+            return None, None
+        try:
+            status = supervisor.control(self.control_path, 'status',
+                                        timeout=STATUS_TIMEOUT)
+        except exception.PoorBMCError as e:
+            LOG.warning('Error getting the status of the BMCs hosted by '
+                        'pbmc serve. Error: %s', e)
+            return serve_pid, None
+        if status is None:
+            return serve_pid, None
+        return serve_pid, status['bmcs']
+
+    def _is_running(self, bmc_name, pid):
+        """Whether the daemon of a BMC, started by :meth:`start`, runs."""
+        return pid is not None and utils.is_pidfile_locked(
+            os.path.join(self.config_dir, bmc_name, 'pid'))
+
+    def _show(self, bmc_name, bmc_config=None, pid=None,
+              served=(None, None)):
+        """Return the config and status of a BMC.
+
+        :param served: The result of :meth:`_served`.
+        """
+        if bmc_config is None:
+            pid = self._read_pid(
+                os.path.join(self.config_dir, bmc_name, 'pid'))
+            bmc_config = self._parse_config(bmc_name)
+
+        serve_pid, served_bmcs = served
+        if served_bmcs is not None and bmc_name in served_bmcs:
+            bmc_config.update(served_bmcs[bmc_name])
+            if (bmc_config['status'] == DOWN and pid != serve_pid and
+                    self._is_running(bmc_name, pid)):
+                # Served by a daemon of its own instead
+                bmc_config['status'] = RUNNING
+        elif serve_pid is not None and pid == serve_pid:
+            # The server does not even answer its control socket
+            bmc_config['status'] = UNRESPONSIVE
+        elif self._is_running(bmc_name, pid):
+            bmc_config['status'] = RUNNING
+        else:
+            bmc_config['status'] = DOWN
 
         # mask the passwords if requested
         if not CONF['default']['show_passwords']:
@@ -85,9 +283,68 @@ class PoorBMCManager(object):
 
         return bmc_config
 
-    def add(self, username, password, port, address, bmc_name,
-            snmp_address, snmp_outlet, snmp_community, snmp_port):
-
+    def _validate(self, bmc):
+        """Check the settings of a BMC before creating it.
+
+        ``boot_mac`` is normalized to lower case, colon separated octets.
+
+        :param bmc: A dict of the arguments of :meth:`add`.
+        :raises: InvalidBMCSettings, SNMPDriverNotFound or
+            InvalidSNMPSecurity.
+        """
+        bmc_name = bmc.get('bmc_name')
+        if not bmc_name or not utils.BMC_NAME_RE.match(bmc_name):
+            raise exception.InvalidBMCSettings(
+                bmc=bmc_name,
+                error='invalid bmc name, expected letters, digits and '
+                      '"_.:@+-" only, not starting with "." or "-"')
+
+        for item in ('snmp_address', 'snmp_outlet'):
+            if not bmc.get(item):
+                raise exception.InvalidBMCSettings(
+                    bmc=bmc_name, error='%s is required' % item)
+
+        for item, low, high in (('port', 1, 65535),
+                                ('snmp_port', 1, 65535),
+                                ('snmp_outlet', 1, None)):
+            try:
+                value = int(bmc[item])
+            except (TypeError, ValueError):
+                value = None
+            if value is None or value < low or (high and value > high):
+                raise exception.InvalidBMCSettings(
+                    bmc=bmc_name,
+                    error='%(item)s must be an integer %(range)s, got '
+                          '%(value)r' % {
+                              'item': item,
+                              'range': ('between %d and %d' % (low, high)
+                                        if high else '>= %d' % low),
+                              'value': bmc[item]})
+
+        # The boot files are named after it
+        boot_mac = bmc.get('boot_mac')
+        if boot_mac is not None:
+            if not MAC_RE.match(boot_mac):
+                raise exception.InvalidBMCSettings(
+                    bmc=bmc_name,
+                    error='boot_mac must be a MAC address like '
+                          '52:54:00:12:34:56, got %r' % boot_mac)
+            bmc['boot_mac'] = boot_mac.lower().replace('-', ':')
+
+        from poorbmc import snmp
+
+        if bmc.get('snmp_driver') is not None:
+            snmp.get_driver_class(bmc['snmp_driver'])
+        snmp.validate_security(bmc.get('snmp_version') or snmp.SNMP_V1,
+                               bmc.get('snmp_security'),
+                               bmc.get('snmp_auth_protocol'),
+                               bmc.get('snmp_auth_key'),
+                               bmc.get('snmp_priv_protocol'),
+                               bmc.get('snmp_priv_key'),
+                               bmc.get('snmp_engine_id'))
+
+    def _create(self, bmc):
+        bmc_name = bmc['bmc_name']
         bmc_path = os.path.join(self.config_dir, bmc_name)
         try:
             os.makedirs(bmc_path)
@@ -102,28 +359,180 @@ class PoorBMCManager(object):
         with open(config_path, 'w') as f:
             config = configparser.ConfigParser()
             config.add_section(DEFAULT_SECTION)
-            config.set(DEFAULT_SECTION, 'username', username)
-            config.set(DEFAULT_SECTION, 'password', password)
-            config.set(DEFAULT_SECTION, 'port', six.text_type(port))
-            config.set(DEFAULT_SECTION, 'address', address)
-            config.set(DEFAULT_SECTION, 'bmc_name', bmc_name)
-            config.set(DEFAULT_SECTION, 'snmp_address', snmp_address)
-            config.set(DEFAULT_SECTION, 'snmp_outlet', snmp_outlet)
-            config.set(DEFAULT_SECTION, 'snmp_community', snmp_community)
-            config.set(DEFAULT_SECTION, 'snmp_port', snmp_port)
+            for item in ('username', 'password', 'port', 'address',
+                         'bmc_name', 'snmp_address', 'snmp_outlet',
+                         'snmp_community', 'snmp_port'):
+                config.set(DEFAULT_SECTION, item,
+                           six.text_type(bmc[item]))
+            for item in OPTIONAL_SNMP_SETTINGS + ('boot_mac',):
+                if bmc.get(item) is not None:
+                    config.set(DEFAULT_SECTION, item, bmc[item])
 
             config.write(f)
 
+    def add(self, username, password, port, address, bmc_name,
+            snmp_address, snmp_outlet, snmp_community, snmp_port,
+            snmp_driver=None, snmp_version=None, snmp_security=None,
+            snmp_auth_protocol=None, snmp_auth_key=None,
+            snmp_priv_protocol=None, snmp_priv_key=None,
+            snmp_engine_id=None, boot_mac=None):
+        bmc = {
+            'username': username,
+            'password': password,
+            'port': port,
+            'address': address,
+            'bmc_name': bmc_name,
+            'snmp_address': snmp_address,
+            'snmp_outlet': snmp_outlet,
+            'snmp_community': snmp_community,
+            'snmp_port': snmp_port,
+            'snmp_driver': snmp_driver,
+            'snmp_version': snmp_version,
+            'snmp_security': snmp_security,
+            'snmp_auth_protocol': snmp_auth_protocol,
+            'snmp_auth_key': snmp_auth_key,
+            'snmp_priv_protocol': snmp_priv_protocol,
+            'snmp_priv_key': snmp_priv_key,
+            'snmp_engine_id': snmp_engine_id,
+            'boot_mac': boot_mac,
+        }
+        # Fail before creating anything
+        self._validate(bmc)
+
+        dir_mtime = self._mtime(self.config_dir)
+        self._create(bmc)
+        self._update_index(self._index_added, [bmc_name], dir_mtime)
+
+    def add_many(self, bmcs, skip_existing=False):
+        """Create many BMCs in a single pass.
+
+        Every BMC is validated before any is created: besides the checks
+        of :meth:`add`, two BMCs may not listen on the same address and
+        port nor control the same PDU outlet, whether they are both in
+        ``bmcs`` or one of them exists already. The index is then updated
+        once for all of them.
+
+        :param bmcs: A list of dicts of the arguments of :meth:`add`.
+        :param skip_existing: Skip the BMCs that exist already instead of
+            failing.
+        :raises: InvalidBMCSettings, SNMPDriverNotFound,
+            InvalidSNMPSecurity or BMCAlreadyExists if any BMC is invalid.
+        :returns: A dict mapping each BMC name to ``True`` if it was
+            created, ``False`` if it was skipped.
+        """
+        existing = dict((bmc_name, bmc_config)
+                        for bmc_name, bmc_config, _ in self._configs())
+
+        def endpoints(bmc):
+            # The IPMI endpoint and the outlet controlled by a BMC
+            return ('port %d of address %s' % (int(bmc['port']),
+                                               bmc['address']),
+                    'outlet %d of PDU %s port %d' % (
+                        int(bmc['snmp_outlet']), bmc['snmp_address'],
+                        int(bmc['snmp_port'])))
+
+        owners = {}
+        for bmc_name, bmc_config in existing.items():
+            try:
+                for endpoint in endpoints(bmc_config):
+                    owners[endpoint] = bmc_name
+            except (KeyError, TypeError, ValueError):
+                # Broken configs fail to start anyway
+                pass
+
+        results = {}
+        new_bmcs = []
+        for bmc in bmcs:
+            bmc_name = bmc.get('bmc_name')
+            if bmc_name in results:
+                raise exception.InvalidBMCSettings(
+                    bmc=bmc_name, error='defined more than once')
+            if (bmc_name in existing or bmc_name and
+                    os.path.exists(os.path.join(self.config_dir, bmc_name))):
+                if not skip_existing:
+                    raise exception.BMCAlreadyExists(bmc=bmc_name)
+                results[bmc_name] = False
+                continue
+
+            self._validate(bmc)
+            for endpoint in endpoints(bmc):
+                owner = owners.setdefault(endpoint, bmc_name)
+                if owner != bmc_name:
+                    raise exception.InvalidBMCSettings(
+                        bmc=bmc_name,
+                        error='%(endpoint)s is used by bmc %(owner)s' %
+                              {'endpoint': endpoint, 'owner': owner})
+            results[bmc_name] = True
+            new_bmcs.append(bmc)
+
+        if new_bmcs:
+            dir_mtime = self._mtime(self.config_dir)
+            for bmc in new_bmcs:
+                self._create(bmc)
+            self._update_index(self._index_added,
+                               [bmc['bmc_name'] for bmc in new_bmcs],
+                               dir_mtime)
+
+        return results
+
+    def _index_added(self, bmc_names, dir_mtime):
+        with self.index.transaction():
+            for bmc_name in bmc_names:
+                self._index_bmc(bmc_name, self._config_mtime(bmc_name))
+            self.index.touch(dir_mtime, self._mtime(self.config_dir))
+
     def delete(self, bmc_name):
         bmc_path = os.path.join(self.config_dir, bmc_name)
         if not os.path.exists(bmc_path):
             raise exception.BMCNotFound(bmc=bmc_name)
+        dir_mtime = self._mtime(self.config_dir)
         shutil.rmtree(bmc_path)
+        self._update_index(self._index_deleted, bmc_name, dir_mtime)
+
+    def _index_deleted(self, bmc_name, dir_mtime):
+        with self.index.transaction():
+            self.index.delete(bmc_name)
+            self.index.touch(dir_mtime, self._mtime(self.config_dir))
+
+    def match(self, patterns):
+        """Return the names of the BMCs matching shell-style patterns.
+
+        :param patterns: A list of BMC names or patterns, e.g. ``node1*``.
+        :raises: BMCNotFound if a pattern matches no BMC.
+        :returns: The sorted list of the matching BMC names.
+        """
+        bmc_names = self._bmc_names()
+        matched = set()
+        for pattern in patterns:
+            names = fnmatch.filter(bmc_names, pattern)
+            if not names:
+                raise exception.BMCNotFound(bmc=pattern)
+            matched.update(names)
+        return sorted(matched)
+
+    def _running_pid(self, bmc_name):
+        pid = self._read_pid(os.path.join(self.config_dir, bmc_name, 'pid'))
+        if self._is_running(bmc_name, pid):
+            return pid
 
     def start(self, bmc_name):
+        self._start(bmc_name)
+
+    def _start(self, bmc_name, ready_fd=None):
+        """Start a BMC in a daemon.
+
+        :param ready_fd: A pipe the daemon reports to once its IPMI socket
+            is bound: it writes :data:`_READY`, or the error message, and
+            closes it.
+        """
         bmc_path = os.path.join(self.config_dir, bmc_name)
         if not os.path.exists(bmc_path):
             raise exception.BMCNotFound(bmc=bmc_name)
+        if self._running_pid(bmc_name) is not None:
+            raise exception.PoorBMCError(
+                'Error starting the bmc %s: it is already running' % bmc_name)
+
+        from poorbmc.pbmc import PoorBMC
 
         bmc_config = self._parse_config(bmc_name)
 
@@ -141,55 +550,437 @@ class PoorBMCManager(object):
         with utils.detach_process() as pid_num:
             try:
                 pbmc = PoorBMC(**bmc_config)
+                # Save the PID number, locked until the daemon exits; this
+                # fails if another daemon of the BMC won the race
+                self._lock_pid(bmc_name, pid_num)
             except Exception as e:
                 msg = ('Error starting a Poor BMC for bmc %(bmc_name)s. '
                        'Error: %(error)s' % {'bmc_name': bmc_name,
                                              'error': e})
                 LOG.error(msg)
+                if ready_fd is not None:
+                    _report(ready_fd, msg.encode('utf-8'))
                 raise exception.PoorBMCError(msg)
 
-            # Save the PID number
-            pidfile_path = os.path.join(bmc_path, 'pid')
-            with open(pidfile_path, 'w') as f:
-                f.write(str(pid_num))
+            if ready_fd is not None:
+                _report(ready_fd, _READY)
 
             LOG.info('Poor BMC %s started', bmc_name)
-            pbmc.listen(timeout=CONF['ipmi']['session_timeout'])
+            signal.signal(signal.SIGTERM, _exit_on_sigterm)
+            try:
+                pbmc.listen(timeout=CONF['ipmi']['session_timeout'])
+            finally:
+                # Stop taking IPMI requests, then let the outlet finish
+                # switching before exiting
+                pbmc.close()
+                from poorbmc import power
+                power.drain(CONF['power']['drain_timeout'])
+                state.flush()
+                self._remove_pid(bmc_name)
+
+    def start_many(self, bmc_names, timeout=START_TIMEOUT):
+        """Start many BMCs concurrently.
+
+        A daemon is forked for every BMC right away, then they are all
+        waited for at once until their IPMI socket is bound (or they fail
+        to start), rather than one after the other. The forks themselves
+        are sequential: forking is cheap, and forking from threads is not
+        safe.
+
+        :param bmc_names: The names of the BMCs.
+        :param timeout: Time (in seconds) to wait for the daemons to be
+            ready.
+        :returns: A dict mapping each BMC name to :data:`STARTED`,
+            :data:`ALREADY_RUNNING` or to the exception raised.
+        """
+        results = {}
+        valid = []
+        for bmc_name in bmc_names:
+            # Report what can be checked here rather than by the daemon
+            try:
+                self._parse_config(bmc_name)
+            except (exception.PoorBMCError, configparser.Error) as e:
+                results[bmc_name] = e
+                continue
+            valid.append(bmc_name)
+
+        if self._serve_pid() is not None:
+            # "pbmc serve" hosts every BMC, have it start them
+            results.update(self._control_many('start', valid, timeout))
+            return results
+
+        # Import the IPMI stack once, rather than in every daemon
+        from poorbmc import pbmc  # noqa
+
+        pipes = {}
+        for bmc_name in valid:
+            if self._running_pid(bmc_name) is not None:
+                results[bmc_name] = ALREADY_RUNNING
+            else:
+                pipes[self._fork_daemon(bmc_name, pipes)] = (bmc_name, b'')
+
+        results.update(self._wait_ready(pipes, timeout))
+        return results
+
+    def _fork_daemon(self, bmc_name, pipes):
+        """Fork the daemon of a BMC for :meth:`start_many`.
+
+        :param pipes: The pipes of the daemons forked before, which the new
+            one closes.
+        :returns: The pipe the daemon reports to once it is ready.
+        """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # The read ends are of no use to the daemons, and they
+            # must not hold the output of the command open (they only
+            # log to stderr)
+            os.close(read_fd)
+            for fd in pipes:
+                os.close(fd)
+            devnull = os.open(os.devnull, os.O_RDWR)
+            os.dup2(devnull, 0)
+            os.dup2(devnull, 1)
+            os.close(devnull)
+            status = 1
+            try:
+                self._start(bmc_name, ready_fd=write_fd)
+                status = 0
+            except SystemExit as e:
+                # The daemon exiting on SIGTERM
+                status = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                pass
+            finally:
+                # Never return to the caller of start_many()
+                os._exit(status)
+
+        os.close(write_fd)
+        # The child exits as soon as it has forked the daemon
+        os.waitpid(pid, 0)
+        return read_fd
+
+    def _wait_ready(self, pipes, timeout):
+        """Wait for the daemons forked by :meth:`start_many` to be ready.
+
+        :param pipes: A dict mapping the pipes the daemons report to to a
+            ``(bmc_name, b'')`` tuple.
+        :returns: A dict mapping each BMC name to :data:`STARTED` or to the
+            exception raised.
+        """
+        results = {}
+        deadline = time.time() + timeout
+        while pipes:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            readable = select.select(list(pipes), [], [], remaining)[0]
+            for fd in readable:
+                bmc_name, data = pipes[fd]
+                chunk = os.read(fd, 4096)
+                if chunk:
+                    pipes[fd] = (bmc_name, data + chunk)
+                    continue
+
+                # The daemon has reported or exited
+                del pipes[fd]
+                os.close(fd)
+                if data == _READY:
+                    results[bmc_name] = STARTED
+                else:
+                    results[bmc_name] = exception.PoorBMCError(
+                        data.decode('utf-8', 'replace') or
+                        'Error starting a Poor BMC for bmc %s: the daemon '
+                        'exited' % bmc_name)
+
+        for fd, (bmc_name, data) in pipes.items():
+            os.close(fd)
+            results[bmc_name] = exception.PoorBMCError(
+                'Error starting a Poor BMC for bmc %(bmc_name)s: not '
+                'ready after %(timeout)s seconds' %
+                {'bmc_name': bmc_name, 'timeout': timeout})
+
+        return results
+
+    def _control_many(self, command, bmc_names, timeout, **kwargs):
+        """Have "pbmc serve" run a command on BMCs.
+
+        :param kwargs: The other arguments of the command.
+        :returns: A dict mapping each BMC name to the result of the
+            command or to the exception raised.
+        """
+        if not bmc_names:
+            return {}
+        try:
+            results = supervisor.control(self.control_path, command,
+                                         timeout=timeout, bmcs=bmc_names,
+                                         **kwargs)
+            if results is None:
+                raise exception.PoorBMCError('pbmc serve is not running')
+        except exception.PoorBMCError as e:
+            return dict((bmc_name, e) for bmc_name in bmc_names)
 
-    def stop(self, bmc_name):
+        return dict((bmc_name, exception.PoorBMCError(result['error'])
+                     if isinstance(result, dict) else result)
+                    for bmc_name, result in results.items())
+
+    def _signal_stop(self, bmc_name):
+        """Ask a BMC to exit.
+
+        It keeps its PID file, locked, until it has exited.
+
+        :returns: The PID of the BMC, or ``None`` if it was not running.
+        """
         LOG.debug('Stopping Poor BMC %s', bmc_name)
         bmc_path = os.path.join(self.config_dir, bmc_name)
         if not os.path.exists(bmc_path):
             raise exception.BMCNotFound(bmc=bmc_name)
 
         pidfile_path = os.path.join(bmc_path, 'pid')
-        pid = None
-        try:
-            with open(pidfile_path, 'r') as f:
-                pid = int(f.read())
-        except (IOError, ValueError):
+        pid = self._read_pid(pidfile_path)
+        if pid is None:
             raise exception.PoorBMCError(
                 'Error stopping the bmc %s: PID file not '
                 'found' % bmc_name)
-        else:
-            os.remove(pidfile_path)
 
+        if pid == self._serve_pid():
+            raise exception.PoorBMCError(
+                'Error stopping the bmc %s: it is hosted by "pbmc serve", '
+                'which does not answer, stop the server instead' % bmc_name)
+
+        if not self._is_running(bmc_name, pid):
+            self._remove_pid(bmc_name)
+            return None
+
+        # Give the BMC a chance to finish its power commands and write its
+        # state before killing it
         try:
-            os.kill(pid, signal.SIGKILL)
+            os.kill(pid, signal.SIGTERM)
         except OSError:
-            pass
+            return None
+        return pid
+
+    def _wait_stopped(self, pids):
+        """Wait for BMCs to exit, killing them after the drain timeout.
+
+        :param pids: A dict mapping BMC names to their PID.
+        """
+        deadline = (time.time() + CONF['power']['drain_timeout'] +
+                    STOP_TIMEOUT)
+        while True:
+            pids = dict((bmc_name, pid) for bmc_name, pid in pids.items()
+                        if self._is_running(bmc_name, pid))
+            if not pids:
+                break
+            if time.time() >= deadline:
+                for bmc_name, pid in sorted(pids.items()):
+                    LOG.warning('Poor BMC %s did not exit after SIGTERM, '
+                                'killing it', bmc_name)
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                    self._remove_pid(bmc_name)
+                break
+            time.sleep(0.1)
 
-    def list(self):
-        bmcs = []
+    def stop(self, bmc_name):
+        _, served_bmcs = self._served()
+        if served_bmcs is not None and bmc_name in served_bmcs:
+            result = self._control_many('stop', [bmc_name],
+                                        STATUS_TIMEOUT)[bmc_name]
+            if isinstance(result, Exception):
+                raise result
+            return
+
+        pid = self._signal_stop(bmc_name)
+        if pid is not None:
+            self._wait_stopped({bmc_name: pid})
+
+    def stop_many(self, bmc_names):
+        """Stop many BMCs concurrently.
+
+        Every BMC is sent SIGTERM first, then they are all waited for at
+        once.
+
+        :param bmc_names: The names of the BMCs.
+        :returns: A dict mapping each BMC name to :data:`STOPPED`,
+            :data:`NOT_RUNNING` or to the exception raised.
+        """
+        results = {}
+        _, served_bmcs = self._served()
+        if served_bmcs is not None:
+            # Stopping a BMC hosted by "pbmc serve" only closes its
+            # listener, the server finishes its power commands
+            served = [bmc_name for bmc_name in bmc_names
+                      if bmc_name in served_bmcs]
+            results.update(self._control_many('stop', served,
+                                              STATUS_TIMEOUT))
+            bmc_names = [bmc_name for bmc_name in bmc_names
+                         if bmc_name not in results]
+
+        pids = {}
+        for bmc_name in bmc_names:
+            if (os.path.exists(os.path.join(self.config_dir, bmc_name)) and
+                    self._running_pid(bmc_name) is None):
+                # Clean up a stale PID file
+                self._remove_pid(bmc_name)
+                results[bmc_name] = NOT_RUNNING
+                continue
+            try:
+                pid = self._signal_stop(bmc_name)
+            except exception.PoorBMCError as e:
+                results[bmc_name] = e
+                continue
+            results[bmc_name] = STOPPED
+            if pid is not None:
+                pids[bmc_name] = pid
+
+        self._wait_stopped(pids)
+        return results
+
+    def serve(self, foreground=False):
+        """Host every configured BMC in a single process.
+
+        :param foreground: Do not detach from the controlling terminal.
+        """
+        serve_pid = self._serve_pid()
+        if serve_pid is not None:
+            raise exception.PoorBMCError(
+                'pbmc serve is already running with PID %d' % serve_pid)
+
+        if foreground:
+            self._serve(os.getpid())
+        else:
+            with utils.detach_process() as pid_num:
+                self._serve(pid_num)
+
+    def _serve(self, pid_num):
+        from poorbmc.server import PoorBMCServer
+
+        pidfile_path = os.path.join(self.config_dir, SERVE_PIDFILE)
+        utils.lock_pidfile(pidfile_path, pid_num)
+
+        LOG.info('Poor BMC server started')
         try:
-            for bmc in os.listdir(self.config_dir):
-                if os.path.isdir(os.path.join(self.config_dir, bmc)):
-                    bmcs.append(self._show(bmc))
-        except OSError as e:
-            if e.errno == errno.EEXIST:
-                return bmcs
+            PoorBMCServer(self).serve(
+                timeout=CONF['ipmi']['session_timeout'],
+                rescan_interval=CONF['serve']['rescan_interval'])
+        finally:
+            os.remove(pidfile_path)
+            LOG.info('Poor BMC server stopped')
+
+    def power(self, action, bmc_names, interval=None):
+        """Run a power action on many BMCs at once.
+
+        The BMCs hosted by "pbmc serve" are switched by the server, as if
+        they got an IPMI power command, so their power state cache and the
+        power commands they have in flight are accounted for. The PDUs of
+        the others are talked to directly, so it works whether or not
+        they are running.
+
+        :param action: One of :data:`poorbmc.scheduler.ACTIONS`.
+        :param bmc_names: The names of the BMCs.
+        :param interval: Time (in seconds) between two power on commands
+            sent to the same PDU; defaults to [power] stagger_interval.
+        :returns: A dict mapping each BMC name to the power state reached
+            or to the exception raised.
+        """
+        from poorbmc import pbmc
+        from poorbmc import scheduler
+        from poorbmc import snmp
+
+        if interval is None:
+            interval = CONF['power']['stagger_interval']
+
+        results = {}
+        if bmc_names and self._serve_pid() is not None:
+            # Resets wait for the outlets to switch off, then on again
+            timeout = (POWER_TIMEOUT + interval * len(bmc_names) +
+                       2 * snmp.power_timeout)
+            results = self._control_many('power', bmc_names, timeout,
+                                         action=action, interval=interval)
+
+        drivers = {}
+        for bmc_name in bmc_names:
+            if bmc_name in results:
+                continue
+            bmc_config = self._parse_config(bmc_name)
+            snmp_config = dict((k, v) for k, v in bmc_config.items()
+                               if k.startswith('snmp_'))
+            drivers[bmc_name] = pbmc.get_driver(**snmp_config)
+
+        results.update(scheduler.PowerScheduler(interval).run(action,
+                                                              drivers))
+        return results
+
+    def _configs(self):
+        """Return the config and PID of every BMC.
+
+        :returns: A list of ``(bmc_name, config, pid)`` tuples.
+        """
+        try:
+            self._sync_index()
+            bmcs = []
+            for bmc_name, bmc_config, config_mtime, pid in (
+                    self.index.get_all()):
+                # A stat is much cheaper than parsing the config again
+                current_mtime = self._config_mtime(bmc_name)
+                if current_mtime is None:
+                    continue
+                if current_mtime != config_mtime:
+                    bmc_config, pid = self._index_bmc(bmc_name,
+                                                      current_mtime)
+                bmcs.append((bmc_name, bmc_config, pid))
+        except (sqlite3.Error, OSError) as e:
+            LOG.warning('Error reading the BMC index %(path)s, reading the '
+                        'BMC configs instead. Error: %(error)s',
+                        {'path': self.index.path, 'error': e})
+            return [(bmc_name, self._parse_config(bmc_name),
+                     self._read_pid(os.path.join(self.config_dir, bmc_name,
+                                                 'pid')))
+                    for bmc_name in self._bmc_names()]
 
         return bmcs
 
+    def list(self):
+        served = self._served()
+        return [self._show(bmc_name, bmc_config, pid, served)
+                for bmc_name, bmc_config, pid in self._configs()]
+
+    def export(self, bmc_names=None):
+        """Return the settings of BMCs, as accepted by :meth:`add_many`.
+
+        Passwords and keys are never masked, so the BMCs can be created
+        again from the result.
+
+        :param bmc_names: The names of the BMCs; defaults to every BMC.
+        :raises: BMCNotFound if a BMC does not exist.
+        """
+        bmcs = dict((bmc_name, bmc_config)
+                    for bmc_name, bmc_config, _ in self._configs())
+        if bmc_names is None:
+            bmc_names = sorted(bmcs)
+        for bmc_name in bmc_names:
+            if bmc_name not in bmcs:
+                raise exception.BMCNotFound(bmc=bmc_name)
+        return [bmcs[bmc_name] for bmc_name in bmc_names]
+
     def show(self, bmc_name):
-        return self._show(bmc_name)
+        config_mtime = self._config_mtime(bmc_name)
+        if config_mtime is None:
+            raise exception.BMCNotFound(bmc=bmc_name)
+
+        served = self._served()
+        try:
+            entry = self.index.get(bmc_name)
+            if entry is not None and entry[2] == config_mtime:
+                return self._show(bmc_name, entry[1], entry[3], served)
+            bmc_config, pid = self._index_bmc(bmc_name, config_mtime)
+        except (sqlite3.Error, OSError) as e:
+            LOG.warning('Error reading the BMC index %(path)s, reading the '
+                        'BMC config instead. Error: %(error)s',
+                        {'path': self.index.path, 'error': e})
+            return self._show(bmc_name, served=served)
+
+        return self._show(bmc_name, bmc_config, pid, served)
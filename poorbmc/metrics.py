@@ -0,0 +1,252 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Process metrics.
+
+Counters, gauges and histograms kept in memory and exposed in the
+Prometheus text format (which OpenMetrics scrapers accept) by a small HTTP
+server, when enabled in the ``[metrics]`` section. Recording a sample only
+takes a lock and a dict update, so it is always done; gauges that describe
+the current state of the process (e.g. the PDU queues) are computed by a
+callback when they are scraped instead.
+"""
+
+import math
+import socket
+import threading
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from poorbmc import log
+
+LOG = log.get_logger()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Buckets (in seconds) of the SNMP request latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Buckets (in seconds) of the outlet switching time histograms
+WAIT_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+# Every metric of the process, in the order they are exposed
+_registry = []
+_registry_lock = threading.Lock()
+
+_server = None
+
+
+def _escape(value):
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in zip(names, values))
+
+
+class _Metric(object):
+    """Metric base class.
+
+    :param name: The name of the metric.
+    :param documentation: Its description.
+    :param labels: The names of its labels; samples are recorded with a
+        value for each of them, in order.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def samples(self):
+        """Yield the ``(name, label names, label values, value)`` samples."""
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield self.name, self.labels, label_values, value
+
+    def expose(self):
+        """Return the metric in the Prometheus text format."""
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        for name, label_names, label_values, value in self.samples():
+            lines.append('%s%s %s' % (
+                name, _format_labels(label_names, label_values),
+                _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. a number of requests."""
+
+    type = 'counter'
+
+    def inc(self, *label_values):
+        self.add(1, *label_values)
+
+    def add(self, amount, *label_values):
+        with self._lock:
+            self._values[label_values] = (
+                self._values.get(label_values, 0) + amount)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down.
+
+    :param collect: If set, a callable returning the current samples as a
+        list of ``(label values, value)`` tuples, called whenever the
+        metric is scraped.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        super(Gauge, self).__init__(name, documentation, labels)
+        self.collect = collect
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def samples(self):
+        if self.collect is None:
+            for sample in super(Gauge, self).samples():
+                yield sample
+            return
+        try:
+            values = sorted(self.collect())
+        except Exception as e:
+            LOG.warning('Error collecting the metric %(name)s. '
+                        'Error: %(error)s', {'name': self.name, 'error': e})
+            return
+        for label_values, value in values:
+            yield self.name, self.labels, tuple(label_values), value
+
+
+class Histogram(_Metric):
+    """The distribution of observed values, e.g. request latencies.
+
+    :param buckets: The upper bounds of the buckets, in increasing order.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                # Bucket counts (non cumulative), sum
+                data = self._values[label_values] = [
+                    [0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[0][i] += 1
+                    break
+            data[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((label_values, (list(counts), total))
+                            for label_values, (counts, total)
+                            in self._values.items())
+        label_names = self.labels + ('le',)
+        for label_values, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (self.name + '_bucket', label_names,
+                       label_values + (_format_value(float(bound)),),
+                       cumulative)
+            yield self.name + '_sum', self.labels, label_values, total
+            yield self.name + '_count', self.labels, label_values, cumulative
+
+
+def expose():
+    """Return every metric of the process in the Prometheus text format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return '\n'.join(metric.expose() for metric in metrics) + '\n'
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOG.debug('Metrics request from %(client)s: %(request)s',
+                  {'client': self.client_address[0],
+                   'request': format % args})
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _HTTPServerV6(_HTTPServer):
+    address_family = socket.AF_INET6
+
+
+def start_server(address, port):
+    """Serve the metrics of the process over HTTP from a thread."""
+    global _server
+    if _server is None:
+        server_class = _HTTPServerV6 if ':' in address else _HTTPServer
+        server = server_class((address, port), _Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        _server = server
+        LOG.info('Serving metrics on http://%(address)s:%(port)s/metrics',
+                 {'address': address, 'port': port})
+    return _server
+
+
+def stop_server():
+    global _server
+    if _server is not None:
+        server, _server = _server, None
+        server.shutdown()
+        server.server_close()
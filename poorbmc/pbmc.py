@@ -10,17 +10,31 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+import os
+import time
+
 import pyghmi.ipmi.bmc as bmc
+import pyghmi.ipmi.private.session as ipmisession
 
+from poorbmc import boot
+from poorbmc import cache
+from poorbmc import config as pbmc_config
+from poorbmc import exception
 from poorbmc import log
+from poorbmc import metrics
+from poorbmc import power
+from poorbmc import state
+from poorbmc import trace
 
 from poorbmc import snmp
 
-snmp_driver = snmp.SNMPDriverAPCMasterSwitch
 states = snmp.states
 
 LOG = log.get_logger()
 
+CONF = pbmc_config.get_config()
+
 # Power states
 POWEROFF = 0
 POWERON = 1
@@ -34,6 +48,13 @@ IPMI_COMMAND_NODE_BUSY = 0xC0
 # Invalid data field in request
 IPMI_INVALID_DATA = 0xcc
 
+# The power state reported while a power command is in flight
+IN_FLIGHT_POWER_STATES = {
+    power.POWERING_ON: POWERON,
+    power.POWERING_OFF: POWEROFF,
+    power.RESETTING: POWERON,
+}
+
 BOOT_DEVICES = [
     'default',
     'network',
@@ -41,66 +62,214 @@ BOOT_DEVICES = [
     'optical'
 ]
 
+IPMI_COMMANDS = metrics.Counter(
+    'pbmc_ipmi_commands_total', 'IPMI commands handled.',
+    ('bmc', 'command'))
+IPMI_BUSY = metrics.Counter(
+    'pbmc_ipmi_busy_total',
+    'IPMI commands answered with "node busy", e.g. after an SNMP error.',
+    ('bmc', 'command'))
+IPMI_REQUEST_SECONDS = metrics.Histogram(
+    'pbmc_ipmi_request_seconds',
+    'Time spent handling IPMI commands, SNMP requests included.',
+    ('bmc', 'command'))
+
+
+def ipmi_command(func):
+    """Account for and trace the calls of an IPMI command handler."""
+    command = func.__name__
+    span_name = 'ipmi.' + command
+
+    @functools.wraps(func)
+    def wrapper(self, *args):
+        IPMI_COMMANDS.inc(self.bmc_name, command)
+        start = time.time()
+        with trace.span(span_name, bmc=self.bmc_name) as span:
+            try:
+                result = func(self, *args)
+            finally:
+                IPMI_REQUEST_SECONDS.observe(time.time() - start,
+                                             self.bmc_name, command)
+            if result == IPMI_COMMAND_NODE_BUSY:
+                IPMI_BUSY.inc(self.bmc_name, command)
+                span.set_attribute('busy', True)
+        return result
+    return wrapper
+
+
+# The private pyghmi internals used to host many BMCs in a process and to
+# unregister them, as pyghmi has no public API for either
+PYGHMI_INTERNALS = ('iosockets', 'myself', 'Session.bmc_handlers',
+                    'Session._assignsocket')
+
+
+def check_pyghmi():
+    """Check that pyghmi still has the internals Poor BMC relies on.
+
+    :raises: PoorBMCError naming the missing ones otherwise.
+    """
+    missing = []
+    for name in PYGHMI_INTERNALS:
+        obj = ipmisession
+        for attr in name.split('.'):
+            if not hasattr(obj, attr):
+                missing.append(name)
+                break
+            obj = getattr(obj, attr)
+    if missing:
+        raise exception.PoorBMCError(
+            'This pyghmi version is not supported, pyghmi.ipmi.private.'
+            'session lacks %s; see requirements.txt for the supported '
+            'versions' % ', '.join(missing))
+
+
+def get_driver(snmp_address, snmp_outlet, snmp_community, snmp_port,
+               snmp_driver=None, snmp_version=None, snmp_security=None,
+               snmp_auth_protocol=None, snmp_auth_key=None,
+               snmp_priv_protocol=None, snmp_priv_key=None,
+               snmp_engine_id=None):
+    """Return the SNMP driver controlling the outlet of a BMC.
+
+    :param snmp_driver: The name of the driver, one of
+        :data:`poorbmc.snmp.DRIVER_CLASSES`; defaults to
+        :data:`poorbmc.snmp.DEFAULT_DRIVER`.
+    :param snmp_version: The SNMP version, defaults to
+        :data:`poorbmc.snmp.SNMP_V1`. The other ``snmp_*`` parameters are
+        the SNMPv3 settings described in
+        :data:`poorbmc.snmp.OPTIONAL_PROPERTIES`.
+    :raises: SNMPDriverNotFound if there is no such driver.
+    :raises: InvalidSNMPSecurity if the SNMPv3 settings are not usable.
+    """
+    driver_class = snmp.get_driver_class(snmp_driver or snmp.DEFAULT_DRIVER)
+    return driver_class({
+        'address': snmp_address,
+        'outlet': int(snmp_outlet),
+        'community': snmp_community,
+        'port': int(snmp_port),
+        'version': snmp_version or snmp.SNMP_V1,
+        'security': snmp_security,
+        'auth_protocol': snmp_auth_protocol,
+        'auth_key': snmp_auth_key,
+        'priv_protocol': snmp_priv_protocol,
+        'priv_key': snmp_priv_key,
+        'engine_id': snmp_engine_id,
+    })
+
 
 class PoorBMC(bmc.Bmc):
 
     def __init__(self, username, password, port, address, bmc_name,
-                 snmp_address, snmp_outlet, snmp_community, snmp_port):
+                 snmp_address, snmp_outlet, snmp_community, snmp_port,
+                 snmp_driver=None, snmp_version=None, snmp_security=None,
+                 snmp_auth_protocol=None, snmp_auth_key=None,
+                 snmp_priv_protocol=None, snmp_priv_key=None,
+                 snmp_engine_id=None, boot_mac=None):
         super(PoorBMC, self).__init__(
             {username: password},
             port=port,
             address=address
         )
         self.bmc_name = bmc_name
-        self.snmp = snmp_driver({
-            'address': snmp_address,
-            'outlet': snmp_outlet,
-            'community': snmp_community,
-            'port': snmp_port,
-            'version': 1
-        })
-        self.current_boot_device = 'default'
+        self.snmp = get_driver(snmp_address, snmp_outlet, snmp_community,
+                               snmp_port, snmp_driver, snmp_version,
+                               snmp_security, snmp_auth_protocol,
+                               snmp_auth_key, snmp_priv_protocol,
+                               snmp_priv_key, snmp_engine_id)
+        self.power_state_cache = cache.PowerStateCache(
+            self.snmp.power_state,
+            ttl=CONF['power']['cache_ttl'],
+            stale_ttl=CONF['power']['cache_stale_ttl'],
+            bmc_name=bmc_name)
+        self.power = power.OutletPowerControl(
+            self.snmp, on_result=self._update_power_state_cache)
+        self.state = state.StateStore(
+            os.path.join(CONF['default']['config_dir'], bmc_name, 'state'))
+        self.boot_file = None
+        backend = boot.get_backend()
+        if backend is not None:
+            self.boot_file = boot.BootFile(backend, bmc_name,
+                                           self.current_boot_device,
+                                           mac=boot_mac)
+
+    @property
+    def current_boot_device(self):
+        return self.state.get('boot_device', 'default')
+
+    def _update_power_state_cache(self, state):
+        if state in (states.POWER_ON, states.POWER_OFF):
+            self.power_state_cache.set(state)
+        else:
+            self.power_state_cache.invalidate()
+
+    def close(self):
+        """Stop answering IPMI requests and release the server socket.
+
+        pyghmi has no public API to unregister a BMC, so drop it from the
+        shared session tables before closing the socket; the other BMCs
+        hosted by the same process keep running.
+        """
+        LOG.debug('Closing bmc %s', self.bmc_name)
+        check_pyghmi()
+        ipmisession.Session.bmc_handlers.pop(self.serversocket, None)
+        try:
+            ipmisession.iosockets.remove(self.serversocket)
+        except ValueError:
+            pass
+        self.serversocket.close()
+        # A new instance of this BMC must load its latest state
+        state.flush()
 
+    def handle_raw_request(self, request, session):
+        # The request was authenticated and decrypted by pyghmi; the span
+        # covers the handler and sending the response
+        with trace.span('ipmi.request', bmc=self.bmc_name,
+                        netfn=request['netfn'], command=request['command']):
+            return super(PoorBMC, self).handle_raw_request(request, session)
+
+    @ipmi_command
     def get_boot_device(self):
         LOG.debug('Get boot device called for %s', self.bmc_name)
         return self.current_boot_device
 
+    @ipmi_command
     def set_boot_device(self, bootdevice):
         LOG.debug('Set boot device called for %(bmc)s with boot '
                   'device "%(bootdev)s"', {'bmc': self.bmc_name,
                                            'bootdev': bootdevice})
         if bootdevice in BOOT_DEVICES:
-            self.current_boot_device = bootdevice
+            self.state.set('boot_device', bootdevice)
+            if self.boot_file is not None:
+                self.boot_file.set(bootdevice)
         else:
             return IPMI_INVALID_DATA
 
+    @ipmi_command
     def get_power_state(self):
         LOG.debug('Get power state called for bmc %s', self.bmc_name)
-        try:
-            state = self.snmp.power_state()
-            if state == states.POWER_ON:
-                return POWERON
-            elif state == states.POWER_OFF:
-                return POWEROFF
-            else:
-                return IPMI_COMMAND_NODE_BUSY
-        except Exception as e:
-            LOG.error('Error getting the power state of bmc %(bmc)s. '
-                      'Error: %(error)s', {'bmc': self.bmc_name,
-                                           'error': e})
-            # Command failed, but let client to retry
-            return IPMI_COMMAND_NODE_BUSY
+        in_flight = self.power.in_flight
+        if in_flight is not None:
+            return IN_FLIGHT_POWER_STATES[in_flight]
 
-        return POWEROFF
+        # Never read from the PDU here: all the BMCs of "pbmc serve" share
+        # this loop, so a slow PDU would stall them all
+        state = self.power_state_cache.get()
+        if state == states.POWER_ON:
+            return POWERON
+        elif state == states.POWER_OFF:
+            return POWEROFF
+        # Not read yet, let the client retry
+        return IPMI_COMMAND_NODE_BUSY
 
+    @ipmi_command
     def pulse_diag(self):
         LOG.debug('Power diag called for bmc %s', self.bmc_name)
         return IPMI_COMMAND_NODE_BUSY
 
+    @ipmi_command
     def power_off(self):
         LOG.debug('Power off called for bmc %s', self.bmc_name)
         try:
-            self.snmp.power_off()
+            self.power.power_off()
         except Exception as e:
             LOG.error('Error powering off the bmc %(bmc)s. '
                       'Error: %(error)s' % {'bmc': self.bmc_name,
@@ -108,10 +277,11 @@ class PoorBMC(bmc.Bmc):
             # Command failed, but let client to retry
             return IPMI_COMMAND_NODE_BUSY
 
+    @ipmi_command
     def power_on(self):
         LOG.debug('Power on called for bmc %s', self.bmc_name)
         try:
-            self.snmp.power_on()
+            self.power.power_on()
         except Exception as e:
             LOG.error('Error powering on the bmc %(bmc)s. '
                       'Error: %(error)s' % {'bmc': self.bmc_name,
@@ -119,14 +289,16 @@ class PoorBMC(bmc.Bmc):
             # Command failed, but let client to retry
             return IPMI_COMMAND_NODE_BUSY
 
+    @ipmi_command
     def power_shutdown(self):
         LOG.debug('Soft power off called for bmc %s', self.bmc_name)
         return IPMI_COMMAND_NODE_BUSY
 
+    @ipmi_command
     def power_reset(self):
         LOG.debug('Power reset called for bmc %s', self.bmc_name)
         try:
-            self.snmp.power_reset()
+            self.power.power_reset()
         except Exception as e:
             LOG.error('Error reseting the bmc %(bmc)s. '
                       'Error: %(error)s' % {'bmc': self.bmc_name,
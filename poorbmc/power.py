@@ -0,0 +1,324 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import functools
+import heapq
+import itertools
+import threading
+import time
+
+from concurrent import futures
+
+from poorbmc import config as pbmc_config
+from poorbmc import exception
+from poorbmc import log
+from poorbmc import snmp
+from poorbmc import trace
+
+LOG = log.get_logger()
+
+CONF = pbmc_config.get_config()
+
+states = snmp.states
+
+# Outlet power operations
+IDLE = 'idle'
+POWERING_ON = 'powering on'
+POWERING_OFF = 'powering off'
+RESETTING = 'resetting'
+
+_executors = {}
+_executor_lock = threading.Lock()
+
+# The power commands in flight, until confirmed
+_pending = set()
+
+
+def _get_executor(name, workers):
+    with _executor_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = futures.ThreadPoolExecutor(
+                max_workers=workers)
+    return executor
+
+
+def get_executor():
+    """Return the executor waiting for outlets to switch.
+
+    It is shared by every outlet of the process; its workers are held
+    for as long as an outlet takes to switch, which can be minutes.
+    """
+    return _get_executor('confirm', CONF['power']['workers'])
+
+
+def get_send_executor():
+    """Return the executor sending the power commands to the PDUs."""
+    return _get_executor('send', CONF['power']['send_workers'])
+
+
+def get_refresh_executor():
+    """Return the executor refreshing the cached power states."""
+    return _get_executor('refresh', CONF['power']['refresh_workers'])
+
+
+class _Timer(object):
+    """Run functions once they are due, from a single thread.
+
+    Power commands waiting for their stagger slot are kept here rather
+    than sleeping in an executor worker; the functions run on the timer
+    thread, so they must return quickly, e.g. by submitting the actual
+    work to an executor.
+    """
+
+    def __init__(self):
+        self._calls = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_at(self, when, func, *args):
+        """Call ``func(*args)`` at ``when``, a :func:`time.time` value."""
+        with self._cond:
+            heapq.heappush(self._calls,
+                           (when, next(self._counter), func, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='pbmc-power-timer')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._calls:
+                        self._cond.wait()
+                        continue
+                    delay = self._calls[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                _, _, func, args = heapq.heappop(self._calls)
+            try:
+                func(*args)
+            except Exception:
+                LOG.exception('Error running a scheduled power command')
+
+
+_timer = _Timer()
+
+
+def _track(future):
+    with _executor_lock:
+        _pending.add(future)
+    future.add_done_callback(_discard)
+
+
+def _discard(future):
+    with _executor_lock:
+        _pending.discard(future)
+
+
+def _send_at(when, fn, *args):
+    """Run ``fn(*args)`` on the send executor at ``when``."""
+    if when <= time.time():
+        get_send_executor().submit(fn, *args)
+    else:
+        _timer.call_at(when, get_send_executor().submit, fn, *args)
+
+
+def drain(timeout):
+    """Wait for the power commands in flight to be confirmed.
+
+    Called before a process hosting BMCs exits, once they stopped
+    accepting IPMI requests, so a stop does not abandon an outlet halfway
+    through a power on or reset.
+
+    :param timeout: Maximum time (in seconds) to wait.
+    :returns: The number of power commands still in flight.
+    """
+    with _executor_lock:
+        pending = list(_pending)
+    if not pending:
+        return 0
+
+    LOG.info('Waiting up to %(timeout)s seconds for %(count)d power '
+             'commands in flight', {'timeout': timeout,
+                                    'count': len(pending)})
+    not_done = futures.wait(pending, timeout=timeout).not_done
+    if not_done:
+        LOG.warning('%d power commands were not confirmed before exiting',
+                    len(not_done))
+    return len(not_done)
+
+
+# A step of a power operation: send a command, then wait for the outlet
+# to reach a state. ``staggered`` steps take a slot in the stagger of the
+# PDU; the result of a step other than ``expected`` fails the operation,
+# and the next step starts ``pause`` seconds after the previous one.
+_Step = collections.namedtuple('_Step',
+                               'send confirm staggered expected pause')
+
+
+class OutletPowerControl(object):
+    """Per-outlet power state machine.
+
+    Power commands return right away: their SNMP SET is sent from the send
+    executor, as soon as possible or, for commands switching the outlet
+    on, once their slot in the stagger of the PDU comes (see
+    :class:`poorbmc.snmp._Stagger`), and waiting for the outlet to switch
+    happens on the shared executor. SNMP failures are therefore only
+    reported through ``on_result`` and the returned future. While an
+    operation is in flight the outlet is in one of the POWERING_ON,
+    POWERING_OFF or RESETTING operations and further power commands are
+    refused.
+
+    :param driver: The :class:`poorbmc.snmp.SNMPDriverBase` of the outlet.
+    :param on_result: Called with the power state reached (one of
+        :class:`poorbmc.snmp.states`) when an operation completes, or
+        ``None`` if it failed.
+    """
+
+    def __init__(self, driver, on_result=None):
+        self.driver = driver
+        self.on_result = on_result
+        self.operation = IDLE
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        """The operation in progress, or ``None``."""
+        operation = self.operation
+        return None if operation == IDLE else operation
+
+    def _complete(self, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            LOG.error('Error completing %(operation)s on PDU %(addr)s '
+                      'outlet %(outlet)s. Error: %(error)s',
+                      {'operation': self.operation,
+                       'addr': self.driver.snmp_info['address'],
+                       'outlet': self.driver.snmp_info['outlet'],
+                       'error': e})
+            result = None
+
+        if self.on_result is not None:
+            self.on_result(result)
+        with self._lock:
+            self.operation = IDLE
+
+    def _start(self, operation, steps, interval):
+        with self._lock:
+            if self.operation != IDLE:
+                raise exception.PoorBMCError(
+                    'Can not start %(new)s, %(current)s is in progress' %
+                    {'new': operation, 'current': self.operation})
+            self.operation = operation
+
+        future = futures.Future()
+        _track(future)
+        future.add_done_callback(self._complete)
+        # The steps run on the executors, link them to the IPMI request
+        # that started them
+        self._schedule(future, operation, steps, interval,
+                       trace.current_span(), time.time())
+        return future
+
+    def _schedule(self, future, operation, steps, interval, parent,
+                  earliest):
+        when = earliest
+        if steps[0].staggered:
+            when = self.driver.stagger.reserve(interval, earliest)
+        _send_at(when, self._send, future, operation, steps, interval,
+                 parent, when)
+
+    def _send(self, future, operation, steps, interval, parent, when):
+        with trace.span('power.send', parent=parent,
+                        operation=operation) as span:
+            span.set_attribute('late_seconds', time.time() - when)
+            try:
+                steps[0].send()
+            except Exception as e:
+                future.set_exception(e)
+                return
+        get_executor().submit(self._confirm, future, operation, steps,
+                              interval, parent)
+
+    def _confirm(self, future, operation, steps, interval, parent):
+        step = steps[0]
+        with trace.span('power.confirm', parent=parent,
+                        operation=operation) as span:
+            try:
+                result = step.confirm()
+            except Exception as e:
+                future.set_exception(e)
+                return
+            span.set_attribute('state', result)
+
+        if step.expected is not None and result != step.expected:
+            future.set_result(states.ERROR)
+        elif len(steps) > 1:
+            self._schedule(future, operation, steps[1:], interval, parent,
+                           time.time() + step.pause)
+        else:
+            future.set_result(result)
+
+    def power_on(self, interval=None):
+        """Switch the outlet on without waiting for it to happen.
+
+        :param interval: Time (in seconds) between two power on requests
+            sent to the PDU; defaults to [power] stagger_interval.
+        :raises: PoorBMCError if another operation is in progress.
+        :returns: A future of the power state reached.
+        """
+        return self._start(POWERING_ON, [
+            _Step(self.driver.send_power_on, self.driver.confirm_power_on,
+                  True, None, 0)], interval)
+
+    def power_off(self, interval=None):
+        """Switch the outlet off without waiting for it to happen.
+
+        :param interval: Unused, power off commands are not staggered.
+        :raises: PoorBMCError if another operation is in progress.
+        :returns: A future of the power state reached.
+        """
+        return self._start(POWERING_OFF, [
+            _Step(self.driver.send_power_off, self.driver.confirm_power_off,
+                  False, None, 0)], None)
+
+    def power_reset(self, interval=None):
+        """Power cycle the outlet without waiting for it to happen.
+
+        Outlets without a native reboot are switched off, then on again
+        ``reboot_delay`` seconds later, in a slot of the stagger.
+
+        :param interval: Time (in seconds) between two power on requests
+            sent to the PDU; defaults to [power] stagger_interval.
+        :raises: PoorBMCError if another operation is in progress.
+        :returns: A future of the power state reached.
+        """
+        driver = self.driver
+        if driver.native_reboot:
+            steps = [_Step(driver.send_power_reset,
+                           functools.partial(driver.confirm_power_reset,
+                                             interval),
+                           True, None, 0)]
+        else:
+            steps = [_Step(driver.send_power_off, driver.confirm_power_off,
+                           False, states.POWER_OFF, snmp.reboot_delay),
+                     _Step(driver.send_power_on, driver.confirm_power_on,
+                           True, states.POWER_ON, 0)]
+        return self._start(RESETTING, steps, interval)
@@ -0,0 +1,132 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import functools
+import threading
+
+from poorbmc import exception
+from poorbmc import log
+from poorbmc import power
+from poorbmc import snmp
+
+LOG = log.get_logger()
+
+states = snmp.states
+
+# Bulk power actions
+POWER_ON = 'on'
+POWER_OFF = 'off'
+POWER_RESET = 'reset'
+ACTIONS = (POWER_ON, POWER_OFF, POWER_RESET)
+
+
+def unconfirmed_error(action, name):
+    """Return the error of an outlet that did not reach the expected state.
+
+    :param action: One of ``ACTIONS``.
+    :param name: The name of the outlet, e.g. the BMC name.
+    :returns: A :class:`poorbmc.exception.PoorBMCError`.
+    """
+    return exception.PoorBMCError(
+        'Power %(action)s of %(name)s was not confirmed: the outlet did '
+        'not reach the expected state' % {'action': action, 'name': name})
+
+
+class PowerScheduler(object):
+    """Run a power action on many outlets, PDU by PDU.
+
+    The SETs switching the outlets of a given PDU on take their slot in
+    the stagger of the PDU (see :class:`poorbmc.snmp._Stagger`), which
+    spreads them ``interval`` seconds apart and is shared with the IPMI
+    power commands of the process, so a rack coming up does not trip a
+    breaker or overload the PDU; distinct PDUs are handled in parallel.
+    Outlets are then confirmed concurrently on the shared power executor.
+
+    :param interval: Time (in seconds) between two power on SETs sent to
+        the same PDU.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def _send(self, action, driver):
+        if action == POWER_ON:
+            driver.stagger.wait(self.interval)
+            driver.send_power_on()
+            return driver.confirm_power_on
+        elif action == POWER_OFF:
+            driver.send_power_off()
+            return driver.confirm_power_off
+        else:
+            if driver.native_reboot:
+                driver.stagger.wait(self.interval)
+            driver.send_power_reset()
+            return functools.partial(driver.confirm_power_reset,
+                                     self.interval)
+
+    def _run_pdu(self, action, outlets, futures, errors):
+        for name, driver in outlets:
+            LOG.debug('Bulk power %(action)s: sending to %(name)s',
+                      {'action': action, 'name': name})
+            try:
+                confirm = self._send(action, driver)
+            except Exception as e:
+                errors[name] = e
+            else:
+                futures[name] = power.get_executor().submit(confirm)
+
+    def run(self, action, drivers):
+        """Run a power action on many outlets and wait for completion.
+
+        :param action: One of ``ACTIONS``.
+        :param drivers: A dict mapping names (e.g. BMC names) to the
+            :class:`poorbmc.snmp.SNMPDriverBase` of their outlet.
+        :returns: A dict mapping each name to the power state reached (one
+            of :class:`poorbmc.snmp.states`) or to the exception raised,
+            which is a :class:`poorbmc.exception.PoorBMCError` for the
+            outlets that never reached the expected state.
+        """
+        if action not in ACTIONS:
+            raise exception.PoorBMCError(
+                'Unknown power action %(action)s, expected one of '
+                '%(actions)s' % {'action': action,
+                                 'actions': ', '.join(ACTIONS)})
+
+        by_pdu = collections.OrderedDict()
+        for name in sorted(drivers):
+            snmp_info = drivers[name].snmp_info
+            pdu = (snmp_info['address'], snmp_info['port'])
+            by_pdu.setdefault(pdu, []).append((name, drivers[name]))
+
+        futures = {}
+        errors = {}
+        threads = []
+        for outlets in by_pdu.values():
+            thread = threading.Thread(target=self._run_pdu,
+                                      args=(action, outlets, futures,
+                                            errors))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        results = dict(errors)
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = e
+            else:
+                if results[name] == states.ERROR:
+                    results[name] = unconfirmed_error(action, name)
+        return results
@@ -0,0 +1,423 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import os
+import signal
+import threading
+import time
+
+import pyghmi.ipmi.private.session as ipmisession
+
+from poorbmc import config as pbmc_config
+from poorbmc import exception
+from poorbmc import log
+from poorbmc import manager as pbmc_manager
+from poorbmc import metrics
+from poorbmc.pbmc import check_pyghmi
+from poorbmc.pbmc import PoorBMC
+from poorbmc import power
+from poorbmc import scheduler
+from poorbmc import state
+from poorbmc import supervisor
+from poorbmc import traps
+
+LOG = log.get_logger()
+
+CONF = pbmc_config.get_config()
+
+# Time (in seconds) a control request waits for the IPMI loop to run it
+CALL_TIMEOUT = 30
+
+
+class _Call(object):
+    """A function to run on the IPMI loop, and its outcome."""
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PoorBMCServer(object):
+    """Host every configured Poor BMC in a single process.
+
+    pyghmi services all the IPMI sockets of a process from one
+    ``Session.wait_for_rsp`` event loop, so instead of forking a daemon
+    per BMC we instantiate them all here and drive that loop once. The
+    config directory is rescanned periodically (and on SIGHUP) so BMCs
+    can be added, removed or reconfigured while the server is running.
+
+    The server also supervises the BMCs: every BMC is regularly sent an
+    IPMI request, and a listener that stops answering, or fails to start,
+    is restarted with an exponential backoff. ``pbmc`` starts, stops and
+    queries the BMCs through a control socket; its requests, like the
+    probe results, are run on the IPMI loop, which owns all the state.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.bmcs = {}
+        self._mtimes = {}
+        self._endpoints = {}
+        self._running = False
+        self._rescan = True
+        # BMCs stopped through the control socket, not started by sync()
+        self._stopped = set()
+        # Listeners waiting to be restarted: bmc_name -> (retry time,
+        # error, config mtime)
+        self._failed = {}
+        # Failures in a row, reset once the BMC answers a probe
+        self._attempts = collections.defaultdict(int)
+        self._restarts = collections.defaultdict(int)
+        # Probes unanswered in a row by the hosted BMCs
+        self._unanswered = {}
+        self._calls = collections.deque()
+        self._probing = threading.Event()
+        # When the IPMI loop last started an iteration
+        self._heartbeat = 0
+
+    def _config_mtime(self, bmc_name):
+        config_path = os.path.join(self.manager.config_dir, bmc_name,
+                                   'config')
+        try:
+            return os.stat(config_path).st_mtime
+        except OSError:
+            return None
+
+    def add(self, bmc_name):
+        """Start hosting a BMC.
+
+        :returns: ``None``, or the exception raised if it failed to start.
+        """
+        restarted = self._failed.pop(bmc_name, None) is not None
+        try:
+            bmc_config = self.manager._parse_config(bmc_name)
+            pbmc = PoorBMC(**bmc_config)
+        except Exception as e:
+            LOG.error('Error starting a Poor BMC for bmc %(bmc_name)s. '
+                      'Error: %(error)s', {'bmc_name': bmc_name, 'error': e})
+            self._fail(bmc_name, e)
+            return e
+
+        if restarted:
+            self._restarts[bmc_name] += 1
+        self.bmcs[bmc_name] = pbmc
+        self._mtimes[bmc_name] = self._config_mtime(bmc_name)
+        self._endpoints[bmc_name] = (bmc_config['address'],
+                                     bmc_config['port'])
+        self.manager._write_pid(bmc_name, os.getpid())
+        LOG.info('Poor BMC %s started', bmc_name)
+
+    def remove(self, bmc_name):
+        pbmc = self.bmcs.pop(bmc_name)
+        self._mtimes.pop(bmc_name, None)
+        self._endpoints.pop(bmc_name, None)
+        self._unanswered.pop(bmc_name, None)
+        pbmc.close()
+        self.manager._remove_pid(bmc_name)
+        LOG.info('Poor BMC %s stopped', bmc_name)
+
+    def _fail(self, bmc_name, error):
+        """Schedule the restart of a BMC listener that failed."""
+        self._attempts[bmc_name] += 1
+        backoff = min(CONF['serve']['restart_backoff_min'] *
+                      2 ** (self._attempts[bmc_name] - 1),
+                      CONF['serve']['restart_backoff_max'])
+        self._failed[bmc_name] = (time.time() + backoff, str(error),
+                                  self._config_mtime(bmc_name))
+        LOG.warning('Restarting Poor BMC %(bmc_name)s in %(backoff)s '
+                    'seconds', {'bmc_name': bmc_name, 'backoff': backoff})
+
+    def _forget(self, bmc_name):
+        self._failed.pop(bmc_name, None)
+        self._attempts.pop(bmc_name, None)
+
+    def sync(self):
+        """Reconcile the hosted BMCs with the config directory."""
+        configured = set(self.manager._bmc_names())
+
+        for bmc_name in list(self.bmcs):
+            if (bmc_name not in configured or
+                    self._mtimes[bmc_name] != self._config_mtime(bmc_name)):
+                self.remove(bmc_name)
+
+        # A new config may fix a BMC that failed, try it right away
+        for bmc_name, (_, _, mtime) in list(self._failed.items()):
+            if (bmc_name not in configured or
+                    mtime != self._config_mtime(bmc_name)):
+                self._forget(bmc_name)
+        self._stopped &= configured
+
+        now = time.time()
+        for bmc_name in sorted(configured - set(self.bmcs) - self._stopped):
+            failed = self._failed.get(bmc_name)
+            if failed is None or failed[0] <= now:
+                self.add(bmc_name)
+
+    def _restart_due(self, now):
+        return any(failed[0] <= now for failed in self._failed.values())
+
+    def _probed(self, bmcs, answered):
+        """Account for the results of a probe of the hosted BMCs."""
+        for bmc_name, pbmc in bmcs.items():
+            if self.bmcs.get(bmc_name) is not pbmc:
+                # Removed or restarted since
+                continue
+            if self._endpoints[bmc_name] in answered:
+                self._unanswered.pop(bmc_name, None)
+                self._attempts.pop(bmc_name, None)
+                continue
+
+            unanswered = self._unanswered.get(bmc_name, 0) + 1
+            self._unanswered[bmc_name] = unanswered
+            if unanswered >= CONF['serve']['probe_failures']:
+                LOG.error('Poor BMC %(bmc_name)s did not answer %(count)d '
+                          'IPMI requests in a row, restarting it',
+                          {'bmc_name': bmc_name, 'count': unanswered})
+                self.remove(bmc_name)
+                self._fail(bmc_name, 'not answering IPMI requests')
+
+    def _probe_forever(self):
+        while not self._probing.wait(CONF['serve']['probe_interval']):
+            bmcs = self.bmcs.copy()
+            endpoints = [endpoint for endpoint in
+                         (self._endpoints.get(bmc_name) for bmc_name in bmcs)
+                         if endpoint is not None]
+            sent = time.time()
+            answered = supervisor.probe(endpoints,
+                                        CONF['serve']['probe_timeout'])
+            # All the BMCs share the IPMI loop: while it is stuck none of
+            # them answers, and restarting their listeners would not help,
+            # so the probe only tells about them if the loop went on.
+            if not answered and self._heartbeat < sent:
+                LOG.warning('The IPMI loop has been busy for %.1f seconds, '
+                            'not checking the Poor BMCs',
+                            time.time() - self._heartbeat)
+                continue
+            try:
+                self._call(self._probed, bmcs, answered)
+            except exception.PoorBMCError as e:
+                LOG.warning('Error handling the probe results. Error: %s',
+                            e)
+
+    def _wake(self):
+        # Break into the select() of the pyghmi IO thread, as pyghmi does
+        sock = ipmisession.iosockets[0]
+        sock.sendto(b'\x01', (ipmisession.myself, sock.getsockname()[1]))
+
+    def _call(self, func, *args):
+        """Run a function on the IPMI loop, from another thread.
+
+        :raises: PoorBMCError if the server is stopping or the loop does not
+            run the function within CALL_TIMEOUT.
+        :returns: The result of the function.
+        """
+        call = _Call(func, args)
+        self._calls.append(call)
+        self._wake()
+        deadline = time.time() + CALL_TIMEOUT
+        while not call.done.wait(0.5):
+            if not self._running:
+                raise exception.PoorBMCError('pbmc serve is stopping')
+            if time.time() >= deadline:
+                raise exception.PoorBMCError(
+                    'pbmc serve is not answering, its IPMI loop has been '
+                    'busy for %d seconds' % CALL_TIMEOUT)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _run_calls(self):
+        while self._calls:
+            call = self._calls.popleft()
+            try:
+                call.result = call.func(*call.args)
+            except Exception as e:
+                call.error = e
+            call.done.set()
+
+    def status(self):
+        """Return the status of the configured BMCs."""
+        now = time.time()
+        bmcs = {}
+        for bmc_name in self.manager._bmc_names():
+            info = {'restarts': self._restarts.get(bmc_name, 0)}
+            if bmc_name in self.bmcs:
+                info['status'] = (pbmc_manager.UNRESPONSIVE
+                                  if self._unanswered.get(bmc_name)
+                                  else pbmc_manager.RUNNING)
+            else:
+                info['status'] = pbmc_manager.DOWN
+                failed = self._failed.get(bmc_name)
+                if failed is not None and bmc_name not in self._stopped:
+                    info['error'] = failed[1]
+                    info['restart_in'] = round(max(failed[0] - now, 0), 1)
+            bmcs[bmc_name] = info
+        return {'pid': os.getpid(), 'bmcs': bmcs}
+
+    def start_bmcs(self, bmc_names):
+        """Start hosting BMCs, even if they failed or were stopped."""
+        configured = set(self.manager._bmc_names())
+        results = {}
+        for bmc_name in bmc_names:
+            if bmc_name not in configured:
+                results[bmc_name] = {
+                    'error': str(exception.BMCNotFound(bmc=bmc_name))}
+                continue
+            self._stopped.discard(bmc_name)
+            if bmc_name in self.bmcs:
+                results[bmc_name] = pbmc_manager.ALREADY_RUNNING
+                continue
+            self._forget(bmc_name)
+            error = self.add(bmc_name)
+            results[bmc_name] = (pbmc_manager.STARTED if error is None
+                                 else {'error': str(error)})
+        return results
+
+    def stop_bmcs(self, bmc_names):
+        """Stop hosting BMCs until they are started again.
+
+        The power commands they have in flight still complete.
+        """
+        results = {}
+        for bmc_name in bmc_names:
+            self._stopped.add(bmc_name)
+            self._forget(bmc_name)
+            if bmc_name in self.bmcs:
+                self.remove(bmc_name)
+                results[bmc_name] = pbmc_manager.STOPPED
+            else:
+                results[bmc_name] = pbmc_manager.NOT_RUNNING
+        return results
+
+    def power_bmcs(self, action, bmc_names, interval):
+        """Start a power action on hosted BMCs, as an IPMI command would.
+
+        BMCs that are not hosted are left out, for the caller to handle.
+
+        :returns: A tuple of a dict mapping the names of the BMCs to the
+            future of the power state they reach, and of a dict mapping the
+            names of those that could not start it to an error.
+        """
+        futures = {}
+        errors = {}
+        for bmc_name in bmc_names:
+            pbmc = self.bmcs.get(bmc_name)
+            if pbmc is None:
+                continue
+            try:
+                futures[bmc_name] = getattr(
+                    pbmc.power, 'power_' + action)(interval)
+            except Exception as e:
+                errors[bmc_name] = {'error': str(e)}
+        return futures, errors
+
+    def _power(self, action, bmc_names, interval):
+        if action not in scheduler.ACTIONS:
+            raise exception.PoorBMCError(
+                'Unknown power action %(action)s, expected one of '
+                '%(actions)s' % {'action': action,
+                                 'actions': ', '.join(scheduler.ACTIONS)})
+        # Only the SETs run on the IPMI loop, the confirmations are waited
+        # for on the control connection
+        futures, results = self._call(self.power_bmcs, action, bmc_names,
+                                      interval)
+        for bmc_name, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                results[bmc_name] = {'error': str(e)}
+                continue
+            if result == scheduler.states.ERROR:
+                result = {'error': str(scheduler.unconfirmed_error(
+                    action, bmc_name))}
+            results[bmc_name] = result
+        return results
+
+    def _handle_control(self, request):
+        command = request.get('command')
+        if command == 'power':
+            return self._power(request.get('action'),
+                               request.get('bmcs', []),
+                               request.get('interval'))
+        if command == 'status':
+            return self._call(self.status)
+        if command == 'start':
+            return self._call(self.start_bmcs, request.get('bmcs', []))
+        if command == 'stop':
+            return self._call(self.stop_bmcs, request.get('bmcs', []))
+        raise exception.PoorBMCError('Unknown command %r' % command)
+
+    def _handle_sighup(self, signum, frame):
+        self._rescan = True
+
+    def _handle_sigterm(self, signum, frame):
+        self._running = False
+
+    def stop(self):
+        for bmc_name in list(self.bmcs):
+            self.remove(bmc_name)
+
+    def serve(self, timeout, rescan_interval):
+        signal.signal(signal.SIGHUP, self._handle_sighup)
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+
+        # Fail now rather than once BMCs are running
+        check_pyghmi()
+
+        # Claim the first pyghmi socket for ourselves: pyghmi uses
+        # iosockets[0] to wake up its IO thread, so it must never belong
+        # to a BMC that may be removed later on.
+        ipmisession.Session._assignsocket()
+
+        if CONF['traps']['enabled']:
+            traps.start_listener(CONF['traps']['address'],
+                                 CONF['traps']['port'])
+        if CONF['metrics']['enabled']:
+            metrics.start_server(CONF['metrics']['address'],
+                                 CONF['metrics']['port'])
+
+        self._running = True
+        control = supervisor.ControlServer(self.manager.control_path,
+                                           self._handle_control).start()
+        prober = threading.Thread(target=self._probe_forever,
+                                  name='pbmc-probe')
+        prober.daemon = True
+        prober.start()
+
+        next_rescan = 0
+        try:
+            while self._running:
+                self._heartbeat = time.time()
+                self._run_calls()
+                now = time.time()
+                if self._rescan or now >= next_rescan:
+                    self._rescan = False
+                    next_rescan = now + rescan_interval
+                    self.sync()
+                elif self._restart_due(now):
+                    self.sync()
+                ipmisession.Session.wait_for_rsp(timeout)
+        finally:
+            self._running = False
+            self._probing.set()
+            control.stop()
+            # Stop taking IPMI requests, then let the outlets switching
+            # finish before exiting
+            self.stop()
+            power.drain(CONF['power']['drain_timeout'])
+            traps.stop_listener()
+            metrics.stop_server()
+            state.flush()
@@ -24,15 +24,22 @@ models.
 """
 
 import abc
+import collections
+import contextlib
+import random
+import threading
 import time
 
 from oslo_log import log as logging
-from oslo_service import loopingcall
 from oslo_utils import importutils
 import six
 
 
+from poorbmc import config as pbmc_config
 from poorbmc import exception
+from poorbmc import metrics
+from poorbmc import trace
+from poorbmc import traps
 
 
 def _(arg):
@@ -41,8 +48,20 @@ def _(arg):
 
 reboot_delay = 10
 power_timeout = 60
+# Time to wait for an outlet to start a native power cycle (i.e. to stop
+# reporting power on) before just waiting for it to be on again.
+reboot_start_timeout = 10
 udp_transport_timeout = 1.0
 udp_transport_retries = 5
+# Bounds of the per-PDU adaptive timeout; udp_transport_timeout is only the
+# initial value, used until RTTs have been measured.
+udp_transport_timeout_min = 0.2
+udp_transport_timeout_max = 10.0
+# Power state reads of the outlets of a PDU are batched into multi-varbind
+# GETs of up to status_batch_size objects, and a batch is reused for
+# status_batch_window seconds.
+status_batch_size = 24
+status_batch_window = 1.0
 
 
 ##############
@@ -68,22 +87,57 @@ class states(object):
 
 pysnmp = importutils.try_import('pysnmp')
 if pysnmp:
+    from pysnmp.entity import config as snmp_config
     from pysnmp.entity.rfc3413.oneliner import cmdgen
     from pysnmp import error as snmp_error
+    from pysnmp.proto import errind
     from pysnmp.proto import rfc1902
+    from pysnmp.proto.secmod.rfc3414 import service as usm_service
+
+    snmp_auth_protocols = {
+        'none': cmdgen.usmNoAuthProtocol,
+        'md5': cmdgen.usmHMACMD5AuthProtocol,
+        'sha': cmdgen.usmHMACSHAAuthProtocol,
+        'sha224': cmdgen.usmHMAC128SHA224AuthProtocol,
+        'sha256': cmdgen.usmHMAC192SHA256AuthProtocol,
+        'sha384': cmdgen.usmHMAC256SHA384AuthProtocol,
+        'sha512': cmdgen.usmHMAC384SHA512AuthProtocol,
+    }
+    snmp_priv_protocols = {
+        'none': cmdgen.usmNoPrivProtocol,
+        'des': cmdgen.usmDESPrivProtocol,
+        '3des': cmdgen.usm3DESEDEPrivProtocol,
+        'aes': cmdgen.usmAesCfb128Protocol,
+        'aes192': cmdgen.usmAesCfb192Protocol,
+        'aes256': cmdgen.usmAesCfb256Protocol,
+    }
 else:
+    snmp_config = None
     cmdgen = None
     snmp_error = None
+    errind = None
     rfc1902 = None
+    usm_service = None
+    snmp_auth_protocols = {}
+    snmp_priv_protocols = {}
 
 LOG = logging.getLogger(__name__)
 
+CONF = pbmc_config.get_config()
+
 
 SNMP_V1 = '1'
 SNMP_V2C = '2c'
 SNMP_V3 = '3'
 SNMP_PORT = 161
 
+# Protocols used when SNMPv3 keys are given without a protocol
+DEFAULT_AUTH_PROTOCOL = 'sha'
+DEFAULT_PRIV_PROTOCOL = 'aes'
+
+# Minimum length of the SNMPv3 pass phrases (RFC 3414, section 11.2)
+USM_MIN_KEY_LENGTH = 8
+
 REQUIRED_PROPERTIES = {
     'snmp_driver': _("PDU manufacturer driver.  Required."),
     'snmp_address': _("PDU IPv4 address or hostname.  Required."),
@@ -103,75 +157,646 @@ OPTIONAL_PROPERTIES = {
         _("SNMPv3 User-based Security Model (USM) username. "
           "Required for version %(v3)s")
         % {"v3": SNMP_V3},
+    'snmp_auth_key':
+        _("SNMPv3 authentication pass phrase, at least %(len)d characters. "
+          "Enables authentication (optional)")
+        % {"len": USM_MIN_KEY_LENGTH},
+    'snmp_auth_protocol':
+        _("SNMPv3 authentication protocol: md5, sha, sha224, sha256, "
+          "sha384 or sha512 (optional, default %(proto)s)")
+        % {"proto": DEFAULT_AUTH_PROTOCOL},
+    'snmp_priv_key':
+        _("SNMPv3 privacy pass phrase, at least %(len)d characters. "
+          "Enables encryption, requires authentication (optional)")
+        % {"len": USM_MIN_KEY_LENGTH},
+    'snmp_priv_protocol':
+        _("SNMPv3 privacy protocol: des, 3des, aes, aes192 or aes256 "
+          "(optional, default %(proto)s)")
+        % {"proto": DEFAULT_PRIV_PROTOCOL},
+    'snmp_engine_id':
+        _("SNMPv3 engine ID of the PDU, in hexadecimal. Lets the keys be "
+          "localized once instead of after discovering it (optional)"),
 }
 COMMON_PROPERTIES = REQUIRED_PROPERTIES.copy()
 COMMON_PROPERTIES.update(OPTIONAL_PROPERTIES)
 
 
+class RTTEstimator(object):
+    """Per-PDU retransmission timeout estimator.
+
+    Tracks the smoothed round trip time (SRTT) and its variation (RTTVAR)
+    of a PDU as TCP does (RFC 6298) and derives the timeout of the next
+    request from them. Each timeout doubles the current timeout, up to
+    ``udp_transport_timeout_max``, until a request is answered again, so
+    lost packets are retried quickly on a healthy PDU while a struggling
+    one is not flooded with retries.
+    """
+
+    alpha = 1.0 / 8
+    beta = 1.0 / 4
+    k = 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = udp_transport_timeout
+        self._lock = threading.Lock()
+
+    def _clamp(self, timeout):
+        return min(max(timeout, udp_transport_timeout_min),
+                   udp_transport_timeout_max)
+
+    def sample(self, rtt):
+        """Account for the RTT of a request answered on first attempt."""
+        with self._lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = ((1 - self.beta) * self.rttvar +
+                               self.beta * abs(self.srtt - rtt))
+                self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+            self.timeout = self._clamp(self.srtt + self.k * self.rttvar)
+
+    def backoff(self):
+        """Account for a request that timed out."""
+        with self._lock:
+            self.timeout = self._clamp(self.timeout * 2)
+
+    def estimate(self):
+        """Return the current estimate as a dict."""
+        return {'srtt': self.srtt, 'rttvar': self.rttvar,
+                'timeout': self.timeout}
+
+
+class _SingleFlight(object):
+    """Coalesce identical concurrent calls.
+
+    The first caller for a key runs the call; callers arriving with the
+    same key while it is in flight wait for it and share its result (or
+    exception) instead of running their own.
+    """
+
+    class _Call(object):
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class _PDULimiter(object):
+    """Shape the load sent to a PDU.
+
+    At most ``max_concurrency`` requests are outstanding at once and, when
+    ``rate`` is set, requests are started at no more than ``rate`` per
+    second with bursts of up to ``burst`` (token bucket). Requests over
+    those limits wait in a FIFO queue, so commands reach the PDU in the
+    order they were issued.
+
+    Threads take a slot with :meth:`slot`; callers that can not block
+    (the asyncio drivers) queue up with :meth:`enqueue` and retry
+    :meth:`take` whenever woken up.
+    """
+
+    def __init__(self, max_concurrency, rate=0, burst=1):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._active = 0
+        self._queue = collections.deque()
+        # Callbacks waking up the queued requests that do not wait on the
+        # condition, by ticket
+        self._wakers = {}
+        self._tokens = self.burst
+        self._stamp = time.time()
+        self._cond = threading.Condition()
+
+    @property
+    def queue_depth(self):
+        """The number of requests waiting for their turn."""
+        return len(self._queue)
+
+    def _token_delay(self):
+        """Take a token, or return how long to wait for the next one."""
+        if not self.rate:
+            return 0
+        now = time.time()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def _notify(self):
+        # Called with the condition held
+        self._cond.notify_all()
+        for wake in self._wakers.values():
+            wake()
+
+    def enqueue(self, wake=None):
+        """Queue up a request.
+
+        :param wake: Called, with the limiter's lock held, whenever the
+            request should call :meth:`take` again.
+        :returns: The ticket of the request.
+        """
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            if wake is not None:
+                self._wakers[ticket] = wake
+        return ticket
+
+    def take(self, ticket):
+        """Take a slot for a queued request, if its turn came.
+
+        :returns: 0 once the slot is taken, to be given back with
+            :meth:`release`. Otherwise the time (in seconds) to wait for
+            the next token, or None to wait to be woken up, before calling
+            it again.
+        """
+        with self._cond:
+            if (self._queue[0] is not ticket or
+                    self._active >= self.max_concurrency):
+                return None
+            # We are at the head of the queue, so nobody else can take
+            # the token we are waiting for.
+            delay = self._token_delay()
+            if delay:
+                return delay
+            self._queue.popleft()
+            self._wakers.pop(ticket, None)
+            self._active += 1
+            self._notify()
+            return 0
+
+    def cancel(self, ticket):
+        """Drop a queued request that gave up waiting."""
+        with self._cond:
+            try:
+                self._queue.remove(ticket)
+            except ValueError:
+                pass
+            self._wakers.pop(ticket, None)
+            self._notify()
+
+    def release(self):
+        """Give back a slot taken with :meth:`take`."""
+        with self._cond:
+            self._active -= 1
+            self._notify()
+
+    @contextlib.contextmanager
+    def slot(self):
+        ticket = self.enqueue()
+        with self._cond:
+            delay = self.take(ticket)
+            while delay != 0:
+                self._cond.wait(delay)
+                delay = self.take(ticket)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class _Stagger(object):
+    """Space the requests switching the outlets of a PDU on.
+
+    Powering many outlets on at once can trip a breaker or overload the
+    PDU, so each power on gets a time slot at least ``interval`` seconds
+    after the previous one given for the same PDU.
+    """
+
+    def __init__(self):
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, interval=None, earliest=None):
+        """Reserve the next power on slot.
+
+        :param interval: Time (in seconds) until the slot after this one;
+            defaults to [power] stagger_interval.
+        :param earliest: If set, the slot is not before this
+            :func:`time.time` value.
+        :returns: The time (as returned by :func:`time.time`) the power
+            on may be sent at.
+        """
+        if interval is None:
+            interval = CONF['power']['stagger_interval']
+        with self._lock:
+            slot = max(time.time(), self._next, earliest or 0)
+            self._next = slot + interval
+        return slot
+
+    def wait(self, interval=None):
+        """Reserve the next power on slot, then sleep until it comes."""
+        delay = self.reserve(interval) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _pdu_limits(address):
+    """Return the load limits of a PDU.
+
+    The [pdu] section of the configuration applies to every PDU; a
+    [pdu:<address>] section overrides it for a single one.
+    """
+    limits = dict(CONF['pdu'])
+    try:
+        limits.update(CONF['pdu:%s' % address])
+    except KeyError:
+        pass
+    return limits
+
+
+class _EnginePool(object):
+    """A bounded pool of PySNMP command generators.
+
+    Each command generator owns an SNMP engine, which caches the target,
+    credentials and (for SNMPv3) discovered engine IDs of the PDUs it has
+    talked to. Engines are not thread-safe, so a request checks one out for
+    its whole duration and returns it afterwards.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def engine(self):
+        """Check out a command generator.
+
+        Yields the command generator and whether it was just created; the
+        first request of an engine also loads its MIBs, which is slow.
+        """
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                self._cond.wait()
+            if self._idle:
+                cmd_gen = self._idle.pop()
+                created = False
+            else:
+                cmd_gen = cmdgen.CommandGenerator()
+                created = True
+                self._created += 1
+        try:
+            yield cmd_gen, created
+        finally:
+            with self._cond:
+                self._idle.append(cmd_gen)
+                self._cond.notify()
+
+
+def validate_security(version, security=None, auth_protocol=None,
+                      auth_key=None, priv_protocol=None, priv_key=None,
+                      engine_id=None):
+    """Check the SNMPv3 security settings of a PDU.
+
+    :raises: InvalidSNMPSecurity if the settings are not usable.
+    """
+    if version != SNMP_V3:
+        if any((auth_key, priv_key, engine_id)):
+            raise exception.InvalidSNMPSecurity(
+                error='keys and engine ID require SNMP version %s' % SNMP_V3)
+        return
+
+    if not security:
+        raise exception.InvalidSNMPSecurity(error='no USM username')
+    if priv_key and not auth_key:
+        raise exception.InvalidSNMPSecurity(
+            error='privacy requires authentication')
+    for name, key in (('authentication', auth_key), ('privacy', priv_key)):
+        if key and len(key) < USM_MIN_KEY_LENGTH:
+            raise exception.InvalidSNMPSecurity(
+                error='the %(name)s pass phrase must be at least %(len)d '
+                      'characters long' % {'name': name,
+                                           'len': USM_MIN_KEY_LENGTH})
+    if auth_protocol and auth_protocol not in snmp_auth_protocols:
+        raise exception.InvalidSNMPSecurity(
+            error='unknown authentication protocol %s' % auth_protocol)
+    if priv_protocol and priv_protocol not in snmp_priv_protocols:
+        raise exception.InvalidSNMPSecurity(
+            error='unknown privacy protocol %s' % priv_protocol)
+    if engine_id:
+        try:
+            rfc1902.OctetString(hexValue=engine_id)
+        except Exception:
+            raise exception.InvalidSNMPSecurity(
+                error='the engine ID %s is not hexadecimal' % engine_id)
+
+
+SNMP_REQUEST_SECONDS = metrics.Histogram(
+    'pbmc_snmp_request_duration_seconds',
+    'Round trip time of the SNMP requests answered by the PDUs.',
+    ('pdu', 'operation'))
+SNMP_QUEUE_SECONDS = metrics.Histogram(
+    'pbmc_snmp_queue_wait_seconds',
+    'Time SNMP requests waited for the load limits of their PDU.',
+    ('pdu',))
+SNMP_TIMEOUTS = metrics.Counter(
+    'pbmc_snmp_timeouts_total', 'SNMP requests that timed out.',
+    ('pdu', 'operation'))
+SNMP_RETRIES = metrics.Counter(
+    'pbmc_snmp_retries_total', 'SNMP requests sent again after a timeout.',
+    ('pdu', 'operation'))
+SNMP_ERRORS = metrics.Counter(
+    'pbmc_snmp_errors_total',
+    'SNMP commands that failed, after their retries.',
+    ('pdu', 'operation'))
+WAIT_FOR_STATE_SECONDS = metrics.Histogram(
+    'pbmc_snmp_wait_for_state_seconds',
+    'Time spent waiting for outlets to switch, by result: reached or '
+    'timeout.', ('pdu', 'result'), buckets=metrics.WAIT_BUCKETS)
+WAIT_FOR_STATE_POLLS = metrics.Counter(
+    'pbmc_snmp_wait_for_state_polls_total',
+    'Power state reads made while waiting for outlets to switch.',
+    ('pdu',))
+
+
+def _collect_clients(func):
+    """Return a metric collector applying ``func`` to each SNMP client."""
+    def collect():
+        with _clients_lock:
+            clients = list(_clients.values())
+        samples = {}
+        for client in clients:
+            value = func(client)
+            if value is not None:
+                # Clients of the same PDU with other credentials add up
+                samples[client.pdu_name] = (
+                    samples.get(client.pdu_name, 0) + value)
+        return [((pdu_name,), value) for pdu_name, value in samples.items()]
+    return collect
+
+
+metrics.Gauge('pbmc_snmp_queue_depth',
+              'SNMP requests waiting for the load limits of their PDU.',
+              ('pdu',),
+              collect=_collect_clients(lambda c: c.limiter.queue_depth))
+metrics.Gauge('pbmc_snmp_srtt_seconds',
+              'Smoothed round trip time of the PDUs.', ('pdu',),
+              collect=_collect_clients(lambda c: c.rtt.srtt))
+
+
 class SNMPClient(object):
     """SNMP client object.
 
     Performs low level SNMP get and set operations. Encapsulates all
     interaction with PySNMP to simplify dynamic importing and unit testing.
+
+    Clients are shared by every outlet of a PDU (see :func:`_get_client`),
+    so the SNMP engines, authorization data and transport target are built
+    once and reused for all requests, and the load limits of the PDU apply
+    to all of its outlets.
     """
 
     def __init__(self, address, port, version, community=None,
-                 security=None):
+                 security=None, auth_protocol=None, auth_key=None,
+                 priv_protocol=None, priv_key=None, engine_id=None):
         self.address = address
         self.port = port
+        # The name of the PDU in the metrics
+        self.pdu_name = (address if int(port) == SNMP_PORT
+                         else '%s:%s' % (address, port))
         self.version = version
         if self.version == SNMP_V3:
+            validate_security(version, security, auth_protocol, auth_key,
+                              priv_protocol, priv_key, engine_id)
             self.security = security
+            self.auth_protocol = auth_protocol
+            self.auth_key = auth_key
+            self.priv_protocol = priv_protocol
+            self.priv_key = priv_key
+            self.engine_id = engine_id
         else:
             self.community = community
-        self.cmd_gen = cmdgen.CommandGenerator()
+        self._auth = None
+        self._transports = {}
+        limits = _pdu_limits(address)
+        self.limiter = _PDULimiter(limits['max_concurrency'],
+                                   rate=limits['rate'],
+                                   burst=limits['burst'])
+        self._engines = _EnginePool(limits['max_concurrency'])
+        self.request_timeout = limits['request_timeout']
+        self.collector = _StatusCollector(self)
+        self.rtt = RTTEstimator()
+        self._in_flight = _SingleFlight()
+
+    def _get_usm_user_data(self):
+        """Build the SNMPv3 USM user of the PDU.
+
+        Turning a pass phrase into a key hashes a megabyte of data, and
+        every SNMP engine of the pool would do it again when configured
+        with the pass phrase. The keys are hashed here once instead, and
+        localized right away if the engine ID of the PDU is known; if it
+        is not, each engine localizes them after discovering it on its
+        first request and keeps using them afterwards.
+
+        :returns: A
+            :class:`pysnmp.entity.rfc3413.oneliner.cmdgen.UsmUserData`
+            object.
+        """
+        auth_protocol = snmp_auth_protocols['none']
+        priv_protocol = snmp_priv_protocols['none']
+        auth_key = priv_key = engine_id = None
+        key_type = snmp_config.usmKeyTypeMaster
+
+        if self.auth_key:
+            auth_protocol = snmp_auth_protocols[
+                self.auth_protocol or DEFAULT_AUTH_PROTOCOL]
+            auth_service = usm_service.SnmpUSMSecurityModel.authServices[
+                auth_protocol]
+            auth_key = auth_service.hashPassphrase(
+                rfc1902.OctetString(self.auth_key))
+
+        if self.priv_key:
+            priv_protocol = snmp_priv_protocols[
+                self.priv_protocol or DEFAULT_PRIV_PROTOCOL]
+            priv_service = usm_service.SnmpUSMSecurityModel.privServices[
+                priv_protocol]
+            priv_key = priv_service.hashPassphrase(
+                auth_protocol, rfc1902.OctetString(self.priv_key))
+
+        if self.engine_id:
+            engine_id = rfc1902.OctetString(hexValue=self.engine_id)
+            if auth_key:
+                auth_key = auth_service.localizeKey(auth_key, engine_id)
+            if priv_key:
+                priv_key = priv_service.localizeKey(auth_protocol, priv_key,
+                                                    engine_id)
+            key_type = snmp_config.usmKeyTypeLocalized
+
+        return cmdgen.UsmUserData(self.security,
+                                  authKey=auth_key,
+                                  privKey=priv_key,
+                                  authProtocol=auth_protocol,
+                                  privProtocol=priv_protocol,
+                                  securityEngineId=engine_id,
+                                  authKeyType=key_type,
+                                  privKeyType=key_type)
 
     def _get_auth(self):
         """Return the authorization data for an SNMP request.
 
+        The data is built once and reused by every request, so that the
+        SNMP engines of the pool configure the PDU's credentials only once.
+
         :returns: A
             :class:`pysnmp.entity.rfc3413.oneliner.cmdgen.CommunityData`
+            or :class:`pysnmp.entity.rfc3413.oneliner.cmdgen.UsmUserData`
             object.
         """
-        if self.version == SNMP_V3:
-            # Handling auth/encryption credentials is not (yet) supported.
-            # This version supports a security name analogous to community.
-            return cmdgen.UsmUserData(self.security)
-        else:
-            mp_model = 1 if self.version == SNMP_V2C else 0
-            return cmdgen.CommunityData(self.community, mpModel=mp_model)
-
-    def _get_transport(self):
+        if self._auth is None:
+            if self.version == SNMP_V3:
+                self._auth = self._get_usm_user_data()
+            else:
+                mp_model = 1 if self.version == SNMP_V2C else 0
+                self._auth = cmdgen.CommunityData(self.community,
+                                                  mpModel=mp_model)
+        return self._auth
+
+    def _get_transport(self, timeout):
         """Return the transport target for an SNMP request.
 
+        :param timeout: The timeout (in seconds) of the request.
         :returns: A :class:
             `pysnmp.entity.rfc3413.oneliner.cmdgen.UdpTransportTarget` object.
         :raises: snmp_error.PySnmpError if the transport address is bad.
         """
-        # The transport target accepts timeout and retries parameters, which
-        # default to 1 (second) and 5 respectively. These are deemed sensible
-        # enough to allow for an unreliable network or slow device.
-        return cmdgen.UdpTransportTarget(
-            (self.address, self.port),
-            timeout=udp_transport_timeout,
-            retries=udp_transport_retries)
+        # Retries are driven by _command so that each attempt uses the
+        # timeout estimated from the PDU's RTT. PySNMP configures a target
+        # per distinct timeout, so round it to keep that number bounded.
+        timeout = round(timeout, 2)
+        transport = self._transports.get(timeout)
+        if transport is None:
+            transport = cmdgen.UdpTransportTarget(
+                (self.address, self.port), timeout=timeout, retries=0)
+            self._transports[timeout] = transport
+        return transport
+
+    def _command(self, operation, command, *args, **kwargs):
+        """Run a PySNMP command, retrying it when it times out.
+
+        Each attempt waits for the timeout estimated from the PDU's RTT,
+        within ``request_timeout`` seconds for the whole command: a PDU
+        that stopped answering fails its requests in about that time,
+        however far its timeout backed off.
+
+        :param operation: The name of the operation, for error reporting.
+        :param command: The name of the CommandGenerator method to call.
+        :param sample_rtt: Whether the command is a single request whose
+            response time can be used to estimate the RTT of the PDU.
+        :raises: SNMPFailure if the transport address is bad.
+        :returns: The results of the command.
+        """
+        sample_rtt = kwargs.pop('sample_rtt', True)
+        deadline = time.time() + self.request_timeout
+        with trace.span('snmp.' + operation, pdu=self.pdu_name) as span:
+            queue_seconds = 0.0
+            attempts = 0
+            for attempt in range(udp_transport_retries + 1):
+                if attempt:
+                    if time.time() >= deadline:
+                        break
+                    SNMP_RETRIES.inc(self.pdu_name, operation)
+                attempts += 1
+                queued = time.time()
+                try:
+                    with self.limiter.slot(), \
+                            self._engines.engine() as (cmd_gen, created):
+                        start = time.time()
+                        timeout = min(self.rtt.timeout,
+                                      max(deadline - start,
+                                          udp_transport_timeout_min))
+                        results = getattr(cmd_gen, command)(
+                            self._get_auth(),
+                            self._get_transport(timeout),
+                            *args)
+                        rtt = time.time() - start
+                except snmp_error.PySnmpError as e:
+                    SNMP_ERRORS.inc(self.pdu_name, operation)
+                    raise exception.SNMPFailure(operation=operation,
+                                                error=e)
+                SNMP_QUEUE_SECONDS.observe(start - queued, self.pdu_name)
+                queue_seconds += start - queued
+
+                if isinstance(results[0], errind.RequestTimedOut):
+                    SNMP_TIMEOUTS.inc(self.pdu_name, operation)
+                    self.rtt.backoff()
+                    LOG.debug("SNMP PDU %(addr)s: %(operation)s timed out, "
+                              "timeout is now %(timeout).2fs",
+                              {'addr': self.address, 'operation': operation,
+                               'timeout': self.rtt.timeout})
+                    continue
+
+                SNMP_REQUEST_SECONDS.observe(rtt, self.pdu_name, operation)
+                # Only unambiguous samples are used (Karn's algorithm)
+                if sample_rtt and attempt == 0 and not created:
+                    self.rtt.sample(rtt)
+                break
+
+            span.set_attribute('attempts', attempts)
+            span.set_attribute('queue_seconds', queue_seconds)
+            if results[0] or results[1]:
+                SNMP_ERRORS.inc(self.pdu_name, operation)
+                span.set_attribute('error', str(results[0] or results[1]))
+        return results
 
     def get(self, oid):
         """Use PySNMP to perform an SNMP GET operation on a single object.
 
+        Concurrent GETs of the same object share a single request.
+
         :param oid: The OID of the object to get.
         :raises: SNMPFailure if an SNMP request fails.
         :returns: The value of the requested object.
         """
-        try:
-            results = self.cmd_gen.getCmd(self._get_auth(),
-                                          self._get_transport(),
-                                          oid)
-        except snmp_error.PySnmpError as e:
-            raise exception.SNMPFailure(operation="GET", error=e)
+        return self._in_flight.do(("GET", oid), self._get, oid)
+
+    def _get(self, oid):
+        results = self._command("GET", "getCmd", oid)
 
         error_indication, error_status, error_index, var_binds = results
 
+        if isinstance(error_indication, errind.RequestTimedOut):
+            raise exception.SNMPTimeout(operation="GET",
+                                        error=error_indication)
+
         if error_indication:
             # SNMP engine-level error.
             raise exception.SNMPFailure(operation="GET",
@@ -186,6 +811,40 @@ class SNMPClient(object):
         name, val = var_binds[0]
         return val
 
+    def get_many(self, oids):
+        """Use PySNMP to perform an SNMP GET operation on several objects.
+
+        All the objects are requested in a single SNMP message, and
+        concurrent GETs of the same objects share a single request.
+
+        :param oids: A list of OIDs of the objects to get.
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: A list of values of the requested objects, in order.
+        """
+        oids = tuple(oids)
+        return self._in_flight.do(("GET_MANY", oids), self._get_many, oids)
+
+    def _get_many(self, oids):
+        results = self._command("GET", "getCmd", *oids)
+
+        error_indication, error_status, error_index, var_binds = results
+
+        if isinstance(error_indication, errind.RequestTimedOut):
+            raise exception.SNMPTimeout(operation="GET",
+                                        error=error_indication)
+
+        if error_indication:
+            # SNMP engine-level error.
+            raise exception.SNMPFailure(operation="GET",
+                                        error=error_indication)
+
+        if error_status:
+            # SNMP PDU error.
+            raise exception.SNMPFailure(operation="GET",
+                                        error=error_status.prettyPrint())
+
+        return [val for name, val in var_binds]
+
     def get_next(self, oid):
         """Use PySNMP to perform an SNMP GET NEXT operation on a table object.
 
@@ -193,12 +852,10 @@ class SNMPClient(object):
         :raises: SNMPFailure if an SNMP request fails.
         :returns: A list of values of the requested table object.
         """
-        try:
-            results = self.cmd_gen.nextCmd(self._get_auth(),
-                                           self._get_transport(),
-                                           oid)
-        except snmp_error.PySnmpError as e:
-            raise exception.SNMPFailure(operation="GET_NEXT", error=e)
+        # A walk is made of several requests, so its duration says
+        # nothing about the RTT of the PDU
+        results = self._command("GET_NEXT", "nextCmd", oid,
+                                sample_rtt=False)
 
         error_indication, error_status, error_index, var_bind_table = results
 
@@ -221,12 +878,7 @@ class SNMPClient(object):
         :param value: The value of the object to set.
         :raises: SNMPFailure if an SNMP request fails.
         """
-        try:
-            results = self.cmd_gen.setCmd(self._get_auth(),
-                                          self._get_transport(),
-                                          (oid, value))
-        except snmp_error.PySnmpError as e:
-            raise exception.SNMPFailure(operation="SET", error=e)
+        results = self._command("SET", "setCmd", (oid, value))
 
         error_indication, error_status, error_index, var_binds = results
 
@@ -241,17 +893,157 @@ class SNMPClient(object):
                                         error=error_status.prettyPrint())
 
 
+class _StatusCollector(object):
+    """Batch the power state reads of all the outlets of a PDU.
+
+    Drivers register the OID of their outlet's power state object. The
+    first read fetches every registered object with as few multi-varbind
+    GETs as possible, and the result answers the reads of all the outlets
+    for the next ``status_batch_window`` seconds. Concurrent readers wait
+    for the fetch in progress instead of sending their own.
+
+    A failed fetch answers the reads for the same window: after a timeout
+    they fail right away, after an error (e.g. a misconfigured outlet
+    failing the whole batch) each object is read with a GET of its own,
+    outside of the lock. Objects failing on their own are left out of the
+    batches from then on.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._oids = set()
+        self._bad_oids = set()
+        self._values = {}
+        self._fetched_at = None
+        self._error = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    def register(self, oid):
+        with self._lock:
+            self._oids.add(oid)
+
+    def invalidate(self):
+        """Force the next read to fetch fresh values from the PDU."""
+        self._fetched_at = None
+        self._failed_at = None
+
+    def _recent(self, stamp, since):
+        return (stamp is not None and
+                time.time() - stamp <= status_batch_window and
+                (since is None or stamp > since))
+
+    def _fetch(self):
+        oids = sorted(self._oids - self._bad_oids)
+        values = {}
+        for i in range(0, len(oids), status_batch_size):
+            chunk = oids[i:i + status_batch_size]
+            values.update(zip(chunk, self.client.get_many(chunk)))
+        self._values = values
+        self._fetched_at = time.time()
+        self._failed_at = None
+
+    def _get_batched(self, oid, since):
+        # Called with the lock held
+        if self._recent(self._failed_at, since):
+            raise self._error
+        if not (self._recent(self._fetched_at, since) and
+                oid in self._values):
+            try:
+                self._fetch()
+            except exception.SNMPFailure as e:
+                self._error = e
+                self._failed_at = time.time()
+                raise
+        return self._values[oid]
+
+    def get(self, oid, since=None):
+        """Return the value of a registered power state object.
+
+        :param oid: The OID of the object to get.
+        :param since: If set, only values fetched after this
+            :func:`time.time` timestamp are returned.
+        :raises: SNMPTimeout if the PDU does not answer.
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: The value of the requested object.
+        """
+        with self._lock:
+            if oid not in self._bad_oids:
+                try:
+                    return self._get_batched(oid, since)
+                except exception.SNMPTimeout:
+                    # A GET of this object alone would time out as well
+                    raise
+                except exception.SNMPFailure as e:
+                    LOG.debug("SNMP PDU %(addr)s: batched status read "
+                              "failed, falling back to a single GET: "
+                              "%(error)s",
+                              {'addr': self.client.address, 'error': e})
+
+        try:
+            value = self.client.get(oid)
+        except exception.SNMPTimeout:
+            raise
+        except exception.SNMPFailure:
+            with self._lock:
+                if oid not in self._bad_oids:
+                    LOG.warning("SNMP PDU %(addr)s: reading %(oid)s "
+                                "failed, leaving it out of the batched "
+                                "status reads",
+                                {'addr': self.client.address, 'oid': oid})
+                    self._bad_oids.add(oid)
+                    # The next batch may go through without it
+                    self._failed_at = None
+            raise
+        with self._lock:
+            self._bad_oids.discard(oid)
+        return value
+
+
+# Shared SNMP clients, keyed by PDU address, port, version and credentials
+_clients = {}
+_clients_lock = threading.Lock()
+
+
 def _get_client(snmp_info):
-    """Create and return an SNMP client object.
+    """Return the shared SNMP client object for a PDU.
+
+    All the outlets of a PDU reached with the same credentials share a
+    single client, and therefore its pool of SNMP engines.
 
     :param snmp_info: SNMP driver info.
     :returns: A :class:`SNMPClient` object.
     """
-    return SNMPClient(snmp_info["address"],
-                      snmp_info["port"],
-                      snmp_info["version"],
-                      snmp_info.get("community"),
-                      snmp_info.get("security"))
+    key = (snmp_info["address"],
+           snmp_info["port"],
+           snmp_info["version"],
+           snmp_info.get("community"),
+           snmp_info.get("security"),
+           snmp_info.get("auth_protocol"),
+           snmp_info.get("auth_key"),
+           snmp_info.get("priv_protocol"),
+           snmp_info.get("priv_key"),
+           snmp_info.get("engine_id"))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = SNMPClient(*key)
+            _clients[key] = client
+    return client
+
+
+# Power on slots, shared by the outlets of a PDU whatever their driver,
+# keyed by address and port
+_staggers = {}
+
+
+def _get_stagger(snmp_info):
+    key = (snmp_info['address'], snmp_info['port'])
+    with _clients_lock:
+        stagger = _staggers.get(key)
+        if stagger is None:
+            stagger = _staggers[key] = _Stagger()
+    return stagger
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -263,11 +1055,33 @@ class SNMPDriverBase(object):
     """
 
     oid_enterprise = (1, 3, 6, 1, 4, 1)
-    retry_interval = 5
+
+    # Confirmation of power commands: the outlet is first polled after
+    # poll_initial_interval seconds, then the interval is multiplied by
+    # poll_backoff up to poll_max_interval. SNMP notifications from the PDU
+    # trigger an immediate poll.
+    poll_initial_interval = 0.2
+    poll_backoff = 2
+    poll_max_interval = 5
+
+    # Whether the power state of all the outlets of a PDU can be read with
+    # multi-varbind GETs, shared through the client's status collector
+    supports_batch_status = False
+
+    # The OID of the power state object of the outlet, for the drivers
+    # reading it with a plain GET, translated by _to_power_state(), and
+    # switching the outlet with the SET returned by _snmp_request(state)
+    # for the POWER_ON, POWER_OFF and (with native_reboot) REBOOT states
+    oid = None
 
     def __init__(self, snmp_info):
         self.snmp_info = snmp_info
         self.client = _get_client(snmp_info)
+        self.stagger = _get_stagger(snmp_info)
+
+    def _snmp_set(self, oid, value):
+        self.client.set(oid, value)
+        self.client.collector.invalidate()
 
     @abc.abstractmethod
     def _snmp_power_state(self):
@@ -291,45 +1105,109 @@ class SNMPDriverBase(object):
         :raises: SNMPFailure if an SNMP request fails.
         """
 
-    def _snmp_wait_for_state(self, goal_state):
+    def _snmp_poll_power_state(self, since):
+        """Get a power state read from the PDU after a point in time.
+
+        Used while waiting for the power state to change; drivers that
+        cache reads must not return values read before ``since``.
+
+        :param since: A :func:`time.time` timestamp.
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
+        return self._snmp_power_state()
+
+    def _poll_intervals(self):
+        """Yield the successive intervals between state confirmation polls.
+        """
+        interval = self.poll_initial_interval
+        while True:
+            yield interval
+            interval = min(interval * self.poll_backoff,
+                           self.poll_max_interval)
+
+    def _snmp_wait_for_state(self, goal_state, timeout=None,
+                             until_left=False):
         """Wait for the power state of the PDU outlet to change.
 
         :param goal_state: The power state to wait for, one of
             :class:`ironic.common.states`.
+        :param timeout: Maximum time to wait (in seconds), defaults to
+            ``power_timeout``.
+        :param until_left: Wait for the outlet to leave ``goal_state``
+            instead of reaching it.
         :raises: SNMPFailure if an SNMP request fails.
         :returns: power state. One of :class:`ironic.common.states`.
         """
+        if timeout is None:
+            timeout = power_timeout
+        started = time.time()
+        deadline = started + timeout
+        last_poll = started
+        notified = threading.Event()
+        subscription = None
+        if traps.is_listening():
+            subscription = traps.subscribe(self.snmp_info['address'],
+                                           notified)
+        with trace.span('snmp.wait_for_state', pdu=self.client.pdu_name,
+                        outlet=self.snmp_info['outlet'], goal=goal_state,
+                        until_left=until_left) as span:
+            try:
+                for interval in self._poll_intervals():
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        state = states.ERROR
+                        break
+                    if notified.wait(min(interval, remaining)):
+                        notified.clear()
+                        LOG.debug("SNMP notification from PDU %s, polling "
+                                  "early", self.snmp_info['address'])
+                    WAIT_FOR_STATE_POLLS.inc(self.client.pdu_name)
+                    with trace.span('snmp.poll',
+                                    pdu=self.client.pdu_name) as poll_span:
+                        state = self._snmp_poll_power_state(last_poll)
+                        poll_span.set_attribute('state', state)
+                    last_poll = time.time()
+                    if (state == goal_state) != until_left:
+                        break
+            finally:
+                if subscription is not None:
+                    traps.unsubscribe(subscription)
+
+            span.set_attribute('state', state)
+
+        WAIT_FOR_STATE_SECONDS.observe(
+            time.time() - started, self.client.pdu_name,
+            'timeout' if state == states.ERROR else 'reached')
+        LOG.debug("power state '%s'", state)
+        return state
 
-        def _poll_for_state(mutable):
-            """Called at an interval until the node's power is consistent.
+    def power_state(self):
+        """Returns a node's current power state.
 
-            :param mutable: dict object containing "state" and "next_time"
-            :raises: SNMPFailure if an SNMP request fails.
-            """
-            mutable["state"] = self._snmp_power_state()
-            if mutable["state"] == goal_state:
-                raise loopingcall.LoopingCallDone()
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
+        return self._snmp_power_state()
 
-            mutable["next_time"] += self.retry_interval
-            if mutable["next_time"] >= power_timeout:
-                mutable["state"] = states.ERROR
-                raise loopingcall.LoopingCallDone()
+    def send_power_on(self):
+        """Send the request to set the power state of this node to ON.
 
-        # Pass state to the looped function call in a mutable form.
-        state = {"state": None, "next_time": 0}
-        timer = loopingcall.FixedIntervalLoopingCall(_poll_for_state,
-                                                     state)
-        timer.start(interval=self.retry_interval).wait()
-        LOG.debug("power state '%s'", state["state"])
-        return state["state"]
+        Returns as soon as the PDU accepted the request; use
+        :meth:`confirm_power_on` to wait for the outlet to switch. Callers
+        take a slot from ``stagger`` first.
 
-    def power_state(self):
-        """Returns a node's current power state.
+        :raises: SNMPFailure if an SNMP request fails.
+        """
+        self._snmp_power_on()
+
+    def confirm_power_on(self):
+        """Wait for the power state of this node to become ON.
 
         :raises: SNMPFailure if an SNMP request fails.
         :returns: power state. One of :class:`ironic.common.states`.
         """
-        return self._snmp_power_state()
+        return self._snmp_wait_for_state(states.POWER_ON)
 
     def power_on(self):
         """Set the power state to this node to ON.
@@ -337,8 +1215,27 @@ class SNMPDriverBase(object):
         :raises: SNMPFailure if an SNMP request fails.
         :returns: power state. One of :class:`ironic.common.states`.
         """
-        self._snmp_power_on()
-        return self._snmp_wait_for_state(states.POWER_ON)
+        self.stagger.wait()
+        self.send_power_on()
+        return self.confirm_power_on()
+
+    def send_power_off(self):
+        """Send the request to set the power state of this node to OFF.
+
+        Returns as soon as the PDU accepted the request; use
+        :meth:`confirm_power_off` to wait for the outlet to switch.
+
+        :raises: SNMPFailure if an SNMP request fails.
+        """
+        self._snmp_power_off()
+
+    def confirm_power_off(self):
+        """Wait for the power state of this node to become OFF.
+
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
+        return self._snmp_wait_for_state(states.POWER_OFF)
 
     def power_off(self):
         """Set the power state to this node to OFF.
@@ -346,24 +1243,94 @@ class SNMPDriverBase(object):
         :raises: SNMPFailure if an SNMP request fails.
         :returns: power state. One of :class:`ironic.common.states`.
         """
+        self.send_power_off()
+        return self.confirm_power_off()
+
+    # Whether the PDU can power cycle an outlet with a single request
+    native_reboot = False
+
+    def _snmp_power_reboot(self):
+        """Perform the SNMP requests required to power cycle the outlet.
+
+        With ``native_reboot``, this is the single request defined by
+        :meth:`_snmp_request`. Otherwise the outlet is switched off and,
+        once it is off and ``reboot_delay`` seconds later, back on.
+
+        :raises: SNMPFailure if an SNMP request fails or the outlet does
+            not switch off.
+        """
+        if self.native_reboot:
+            self._snmp_set(*self._snmp_request(states.REBOOT))
+            return
+
         self._snmp_power_off()
-        return self._snmp_wait_for_state(states.POWER_OFF)
+        state = self._snmp_wait_for_state(states.POWER_OFF)
+        if state != states.POWER_OFF:
+            raise exception.SNMPFailure(
+                operation="SET",
+                error="outlet %s did not switch off" %
+                self.snmp_info['outlet'])
+        time.sleep(reboot_delay)
+        self.stagger.wait()
+        self._snmp_power_on()
 
-    def power_reset(self):
-        """Reset the power to this node.
+    def send_power_reset(self):
+        """Send the first request needed to reset the power to this node.
+
+        With ``native_reboot``, the PDU switches the outlet back on by
+        itself, so callers take a slot from ``stagger`` first.
+
+        :raises: SNMPFailure if an SNMP request fails.
+        """
+        if self.native_reboot:
+            self._snmp_power_reboot()
+        else:
+            self.send_power_off()
+
+    def confirm_power_reset(self, interval=None):
+        """Complete a reset started with :meth:`send_power_reset`.
 
+        :param interval: Time (in seconds) between two power on requests
+            sent to the PDU; defaults to [power] stagger_interval.
         :raises: SNMPFailure if an SNMP request fails.
         :returns: power state. One of :class:`ironic.common.states`.
         """
-        power_result = self.power_off()
+        if self.native_reboot:
+            # The outlet may still report power on right after the
+            # request; wait for the cycle to start, unless it is over
+            # before we manage to see it.
+            state = self._snmp_wait_for_state(
+                states.POWER_ON, timeout=reboot_start_timeout,
+                until_left=True)
+            if state == states.ERROR:
+                LOG.debug("SNMP PDU %(addr)s outlet %(outlet)s: power "
+                          "cycle not observed",
+                          {'addr': self.snmp_info['address'],
+                           'outlet': self.snmp_info['outlet']})
+            return self.confirm_power_on()
+
+        power_result = self.confirm_power_off()
         if power_result != states.POWER_OFF:
             return states.ERROR
         time.sleep(reboot_delay)
-        power_result = self.power_on()
+        self.stagger.wait(interval)
+        self.send_power_on()
+        power_result = self.confirm_power_on()
         if power_result != states.POWER_ON:
             return states.ERROR
         return power_result
 
+    def power_reset(self):
+        """Reset the power to this node.
+
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
+        if self.native_reboot:
+            self.stagger.wait()
+        self.send_power_reset()
+        return self.confirm_power_reset()
+
 
 class SNMPDriverSimple(SNMPDriverBase):
     """SNMP driver base class for simple PDU devices.
@@ -376,9 +1343,13 @@ class SNMPDriverSimple(SNMPDriverBase):
     by overriding the _snmp_oid method in a subclass.
     """
 
+    supports_batch_status = True
+
     def __init__(self, *args, **kwargs):
         super(SNMPDriverSimple, self).__init__(*args, **kwargs)
         self.oid = self._snmp_oid()
+        if self.supports_batch_status:
+            self.client.collector.register(self.oid)
 
     @abc.abstractproperty
     def oid_device(self):
@@ -392,6 +1363,14 @@ class SNMPDriverSimple(SNMPDriverBase):
     def value_power_off(self):
         """Value representing power off state."""
 
+    # Value to power cycle the outlet (and reported while it cycles), if
+    # the PDU supports it
+    value_power_reboot = None
+
+    @property
+    def native_reboot(self):
+        return self.value_power_reboot is not None
+
     def _snmp_oid(self):
         """Return the OID of the power state object.
 
@@ -401,13 +1380,35 @@ class SNMPDriverSimple(SNMPDriverBase):
         return self.oid_enterprise + self.oid_device + (outlet,)
 
     def _snmp_power_state(self):
-        state = self.client.get(self.oid)
+        if self.supports_batch_status:
+            state = self.client.collector.get(self.oid)
+        else:
+            state = self.client.get(self.oid)
+
+        return self._to_power_state(state)
+
+    def _snmp_poll_power_state(self, since):
+        if not self.supports_batch_status:
+            return self._snmp_power_state()
 
-        # Translate the state to an Ironic power state.
+        # Share the batches fetched for the other outlets of the PDU being
+        # confirmed at the same time, as long as they are recent enough
+        state = self.client.collector.get(self.oid, since=since)
+        return self._to_power_state(state)
+
+    def _to_power_state(self, state):
+        """Translate the value of the power state object to a power state.
+
+        :param state: The value read from the power state object.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
         if state == self.value_power_on:
             power_state = states.POWER_ON
         elif state == self.value_power_off:
             power_state = states.POWER_OFF
+        elif (self.value_power_reboot is not None and
+                state == self.value_power_reboot):
+            power_state = states.REBOOT
         else:
             LOG.warning("SNMP PDU %(addr)s outlet %(outlet)s: "
                         "unrecognised power state %(state)s.",
@@ -418,13 +1419,17 @@ class SNMPDriverSimple(SNMPDriverBase):
 
         return power_state
 
+    def _snmp_request(self, state):
+        values = {states.POWER_ON: self.value_power_on,
+                  states.POWER_OFF: self.value_power_off,
+                  states.REBOOT: self.value_power_reboot}
+        return self.oid, rfc1902.Integer(values[state])
+
     def _snmp_power_on(self):
-        value = rfc1902.Integer(self.value_power_on)
-        self.client.set(self.oid, value)
+        self._snmp_set(*self._snmp_request(states.POWER_ON))
 
     def _snmp_power_off(self):
-        value = rfc1902.Integer(self.value_power_off)
-        self.client.set(self.oid, value)
+        self._snmp_set(*self._snmp_request(states.POWER_OFF))
 
 
 class SNMPDriverAPCMasterSwitch(SNMPDriverSimple):
@@ -438,3 +1443,473 @@ class SNMPDriverAPCMasterSwitch(SNMPDriverSimple):
     oid_device = (318, 1, 1, 4, 4, 2, 1, 3)
     value_power_on = 1
     value_power_off = 2
+    value_power_reboot = 3
+
+
+class SNMPDriverAPCMasterSwitchPlus(SNMPDriverSimple):
+    """SNMP driver class for APC MasterSwitchPlus PDU devices.
+
+    SNMP objects for APC SNMPDriverAPCMasterSwitchPlus PDU:
+    1.3.6.1.4.1.318.1.1.6.5.1.1.5 sPDUOutletControlMSPOutletCommand
+    Values: 1=On, 3=Off, [...more options follow]
+    """
+
+    oid_device = (318, 1, 1, 6, 5, 1, 1, 5)
+    value_power_on = 1
+    value_power_off = 3
+
+
+class SNMPDriverAPCRackPDU(SNMPDriverSimple):
+    """SNMP driver class for APC RackPDU devices.
+
+    SNMP objects for APC SNMPDriverAPCRackPDU PDU:
+    1.3.6.1.4.1.318.1.1.12.3.3.1.1.4 rPDUOutletControlOutletCommand
+    Values: 1=On, 2=Off, 3=PowerCycle, [...more options follow]
+    """
+
+    oid_device = (318, 1, 1, 12, 3, 3, 1, 1, 4)
+    value_power_on = 1
+    value_power_off = 2
+    value_power_reboot = 3
+
+
+class SNMPDriverAPCRPDU2(SNMPDriverSimple):
+    """SNMP driver class for APC rPDU2 (AP8xxx) devices.
+
+    SNMP objects for APC SNMPDriverAPCRPDU2 PDU:
+    1.3.6.1.4.1.318.1.1.26.9.2.4.1.5 rPDU2OutletSwitchedControlCommand
+    Values: 1=On, 2=Off, 3=PowerCycle, [...more options follow]
+    """
+
+    oid_device = (318, 1, 1, 26, 9, 2, 4, 1, 5)
+    value_power_on = 1
+    value_power_off = 2
+    value_power_reboot = 3
+
+
+class SNMPDriverCyberPower(SNMPDriverSimple):
+    """SNMP driver class for CyberPower PDU devices.
+
+    SNMP objects for CyberPower SNMPDriverCyberPower PDU:
+    1.3.6.1.4.1.3808.1.1.3.3.3.1.1.4 ePDUOutletControlOutletCommand
+    Values: 1=On, 2=Off, 3=PowerCycle, [...more options follow]
+    """
+
+    oid_device = (3808, 1, 1, 3, 3, 3, 1, 1, 4)
+    value_power_on = 1
+    value_power_off = 2
+    value_power_reboot = 3
+
+
+class SNMPDriverBaytechMRP27(SNMPDriverSimple):
+    """SNMP driver class for Baytech MRP27 PDU devices.
+
+    SNMP objects for Baytech SNMPDriverBaytechMRP27 PDU:
+    1.3.6.1.4.1.4779.1.3.5.3.1.3.1.<outlet ID> outletControl
+    Values: 0=Off, 1=On
+    """
+
+    oid_device = (4779, 1, 3, 5, 3, 1, 3)
+    value_power_on = 1
+    value_power_off = 0
+
+    def _snmp_oid(self):
+        """Return the OID of the power state object.
+
+        :returns: Power state object OID as a tuple of integers.
+        """
+        outlet = self.snmp_info['outlet']
+        return self.oid_enterprise + self.oid_device + (1, outlet)
+
+
+class SNMPDriverSplit(SNMPDriverBase):
+    """SNMP driver base class for PDUs with separate status and control.
+
+    These devices report the power state of an outlet in one SNMP object
+    and are switched by setting other objects. The OID of each object is
+    of the form <enterprise OID>.<device OID>.<object OID>.<outlet index>,
+    where the outlet index is ``oid_outlet_index`` followed by the outlet
+    ID.
+    """
+
+    supports_batch_status = True
+
+    # Values of the status object reported while the outlet switches,
+    # translated to the REBOOT power state
+    status_pending = ()
+
+    # Object OID and value to set to power cycle the outlet, if the PDU
+    # supports it
+    oid_power_reboot = None
+    value_power_reboot = None
+
+    oid_outlet_index = ()
+
+    def __init__(self, *args, **kwargs):
+        super(SNMPDriverSplit, self).__init__(*args, **kwargs)
+        self.oid = self._snmp_oid(self.oid_status)
+        self.client.collector.register(self.oid)
+
+    @abc.abstractproperty
+    def oid_device(self):
+        """Device dependent portion of the object OIDs."""
+
+    @abc.abstractproperty
+    def oid_status(self):
+        """Power state object portion of its OID."""
+
+    @abc.abstractproperty
+    def oid_power_on(self):
+        """Object portion of the OID to set to power on."""
+
+    @abc.abstractproperty
+    def value_power_on(self):
+        """Value to set to power on."""
+
+    @abc.abstractproperty
+    def oid_power_off(self):
+        """Object portion of the OID to set to power off."""
+
+    @abc.abstractproperty
+    def value_power_off(self):
+        """Value to set to power off."""
+
+    @abc.abstractproperty
+    def status_on(self):
+        """Value of the status object representing power on state."""
+
+    @abc.abstractproperty
+    def status_off(self):
+        """Value of the status object representing power off state."""
+
+    @property
+    def native_reboot(self):
+        return self.oid_power_reboot is not None
+
+    def _snmp_oid(self, oid):
+        """Return the full OID of an object of the outlet.
+
+        :param oid: The object portion of the OID.
+        :returns: Object OID as a tuple of integers.
+        """
+        outlet = self.snmp_info['outlet']
+        return (self.oid_enterprise + self.oid_device + oid +
+                self.oid_outlet_index + (outlet,))
+
+    def _snmp_power_state(self):
+        state = self.client.collector.get(self.oid)
+        return self._to_power_state(state)
+
+    def _snmp_poll_power_state(self, since):
+        state = self.client.collector.get(self.oid, since=since)
+        return self._to_power_state(state)
+
+    def _to_power_state(self, state):
+        """Translate the value of the status object to a power state.
+
+        :param state: The value read from the status object.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
+        if state == self.status_on:
+            power_state = states.POWER_ON
+        elif state == self.status_off:
+            power_state = states.POWER_OFF
+        elif state in self.status_pending:
+            power_state = states.REBOOT
+        else:
+            LOG.warning("SNMP PDU %(addr)s outlet %(outlet)s: "
+                        "unrecognised power state %(state)s.",
+                        {'addr': self.snmp_info['address'],
+                         'outlet': self.snmp_info['outlet'],
+                         'state': state})
+            power_state = states.ERROR
+
+        return power_state
+
+    def _snmp_request(self, state):
+        oid, value = {
+            states.POWER_ON: (self.oid_power_on, self.value_power_on),
+            states.POWER_OFF: (self.oid_power_off, self.value_power_off),
+            states.REBOOT: (self.oid_power_reboot, self.value_power_reboot),
+        }[state]
+        return self._snmp_oid(oid), rfc1902.Integer(value)
+
+    def _snmp_power_on(self):
+        self._snmp_set(*self._snmp_request(states.POWER_ON))
+
+    def _snmp_power_off(self):
+        self._snmp_set(*self._snmp_request(states.POWER_OFF))
+
+
+class SNMPDriverEatonPower(SNMPDriverSplit):
+    """SNMP driver class for Eaton Power PDU.
+
+    The Eaton power PDU does not follow the single SNMP object per outlet
+    model. Instead, it has a read-only SNMP object per outlet for its power
+    state, and separate write-only SNMP objects for powering on, off and
+    power cycling.
+
+    SNMP objects for Eaton Power PDU
+    1.3.6.1.4.1.534.6.6.7.6.6.1.2.0.<outlet ID> outletControlStatus
+    Read 0=off, 1=on, 2=pending off, 3=pending on
+    1.3.6.1.4.1.534.6.6.7.6.6.1.3.0.<outlet ID> outletControlOffCmd
+    Write 0 for immediate power off
+    1.3.6.1.4.1.534.6.6.7.6.6.1.4.0.<outlet ID> outletControlOnCmd
+    Write 0 for immediate power on
+    1.3.6.1.4.1.534.6.6.7.6.6.1.5.0.<outlet ID> outletControlRebootCmd
+    Write 0 for immediate power cycle
+    """
+
+    oid_device = (534, 6, 6, 7, 6, 6, 1)
+    oid_outlet_index = (0,)
+    oid_status = (2,)
+    oid_power_off = (3,)
+    oid_power_on = (4,)
+    oid_power_reboot = (5,)
+    value_power_on = 0
+    value_power_off = 0
+    value_power_reboot = 0
+    status_off = 0
+    status_on = 1
+    status_pending = (2, 3)
+
+
+class SNMPDriverRaritanPDU2(SNMPDriverSplit):
+    """SNMP driver class for Raritan PX2 and PX3 PDU devices.
+
+    SNMP objects for Raritan PDU2 MIB, PDU 1:
+    1.3.6.1.4.1.13742.6.4.1.2.1.2.1.<outlet ID> switchingOperation
+    Write 0=Off, 1=On, 2=PowerCycle
+    1.3.6.1.4.1.13742.6.4.1.2.1.3.1.<outlet ID> outletSwitchingState
+    Read 7=On, 8=Off, [...more options follow]
+    """
+
+    oid_device = (13742, 6)
+    oid_outlet_index = (1,)
+    oid_status = (4, 1, 2, 1, 3)
+    oid_power_on = (4, 1, 2, 1, 2)
+    oid_power_off = (4, 1, 2, 1, 2)
+    oid_power_reboot = (4, 1, 2, 1, 2)
+    value_power_on = 1
+    value_power_off = 0
+    value_power_reboot = 2
+    status_on = 7
+    status_off = 8
+
+
+class SNMPDriverServerTechSentry3(SNMPDriverSplit):
+    """SNMP driver class for ServerTech Sentry 3 PDU devices.
+
+    SNMP objects for ServerTech Sentry3 MIB, tower 1 infeed 1:
+    1.3.6.1.4.1.1718.3.2.3.1.5.1.1.<outlet ID> outletStatus
+    Read 0=off, 1=on, 2=offWait, 3=onWait, [...more options follow]
+    1.3.6.1.4.1.1718.3.2.3.1.11.1.1.<outlet ID> outletControlAction
+    Write 1=On, 2=Off, 3=Reboot
+    """
+
+    oid_device = (1718, 3, 2, 3, 1)
+    oid_outlet_index = (1, 1)
+    oid_status = (5,)
+    oid_power_on = (11,)
+    oid_power_off = (11,)
+    oid_power_reboot = (11,)
+    value_power_on = 1
+    value_power_off = 2
+    value_power_reboot = 3
+    status_on = 1
+    status_off = 0
+    status_pending = (2, 3)
+
+
+def _simulated_settings(address):
+    """Return the behaviour of a simulated PDU.
+
+    The [simulated] section of the configuration applies to every
+    simulated PDU; a [simulated:<address>] section overrides it for a
+    single one.
+    """
+    settings = dict(CONF['simulated'])
+    try:
+        settings.update(CONF['simulated:%s' % address])
+    except KeyError:
+        pass
+    return settings
+
+
+class SimulatedPDU(object):
+    """An in-memory PDU, shared by the simulated outlets of an address.
+
+    Outlets switch ``switch_delay`` seconds after a command and stay off
+    for ``reboot_time`` seconds when power cycled. Every request takes
+    ``latency`` seconds and fails with probability ``failure_rate``, and
+    the outlets listed in ``stuck_outlets`` ignore commands, so the
+    retries, timeouts and error paths can be exercised too. The state
+    only lives in the memory of the process.
+    """
+
+    def __init__(self, address, port):
+        self.address = address
+        self.port = port
+        # The name of the PDU in the metrics
+        self.pdu_name = (address if int(port) == SNMP_PORT
+                         else '%s:%s' % (address, port))
+        settings = _simulated_settings(address)
+        self.latency = settings['latency']
+        self.switch_delay = settings['switch_delay']
+        self.reboot_time = settings['reboot_time']
+        self.failure_rate = settings['failure_rate']
+        self.stuck_outlets = settings['stuck_outlets']
+        self.initial_state = (states.POWER_ON
+                              if settings['initial_state'] == 'on'
+                              else states.POWER_OFF)
+        # outlet -> power state
+        self._states = {}
+        # outlet -> [(time, power state), ...] scheduled changes
+        self._transitions = {}
+        self._lock = threading.Lock()
+
+    def _request(self, operation):
+        start = time.time()
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            SNMP_ERRORS.inc(self.pdu_name, operation)
+            raise exception.SNMPFailure(operation=operation,
+                                        error='simulated failure')
+        SNMP_REQUEST_SECONDS.observe(time.time() - start, self.pdu_name,
+                                     operation)
+
+    def get(self, outlet):
+        """Return the power state of an outlet.
+
+        :raises: SNMPFailure if the request fails.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
+        with trace.span('snmp.GET', pdu=self.pdu_name, simulated=True):
+            self._request('GET')
+            with self._lock:
+                self._apply_transitions(outlet, time.time())
+                return self._states.get(outlet, self.initial_state)
+
+    def set(self, outlet, state):
+        """Switch an outlet.
+
+        :param state: ``states.POWER_ON``, ``states.POWER_OFF`` or
+            ``states.REBOOT`` to power cycle the outlet.
+        :raises: SNMPFailure if the request fails.
+        """
+        with trace.span('snmp.SET', pdu=self.pdu_name, simulated=True):
+            self._request('SET')
+            if outlet in self.stuck_outlets:
+                return
+            now = time.time()
+            start = now + self.switch_delay
+            if state == states.REBOOT:
+                transitions = [(start, states.POWER_OFF),
+                               (start + self.reboot_time, states.POWER_ON)]
+            else:
+                transitions = [(start, state)]
+            with self._lock:
+                # The changes already due happened, even if nobody read them
+                self._apply_transitions(outlet, now)
+                self._transitions[outlet] = transitions
+
+    def _apply_transitions(self, outlet, now):
+        transitions = self._transitions.get(outlet)
+        while transitions and transitions[0][0] <= now:
+            self._states[outlet] = transitions.pop(0)[1]
+
+
+# Simulated PDUs, keyed by address and port
+_simulated_pdus = {}
+
+
+def _get_simulated_pdu(snmp_info):
+    key = (snmp_info['address'], snmp_info['port'])
+    with _clients_lock:
+        pdu = _simulated_pdus.get(key)
+        if pdu is None:
+            pdu = SimulatedPDU(*key)
+            _simulated_pdus[key] = pdu
+    return pdu
+
+
+class SNMPDriverSimulated(SNMPDriverBase):
+    """Driver class for simulated PDUs.
+
+    Does not send any SNMP request: the outlets are kept in memory by a
+    :class:`SimulatedPDU` per address and port, which stands in for the
+    SNMP client. Everything above the SNMP requests (IPMI handling, power
+    state cache, command confirmation) runs as with a real PDU, so many
+    BMCs can be served for scale tests without any hardware.
+    """
+
+    native_reboot = True
+
+    def __init__(self, snmp_info):
+        self.snmp_info = snmp_info
+        self.client = _get_simulated_pdu(snmp_info)
+        self.stagger = _get_stagger(snmp_info)
+
+    def _snmp_power_state(self):
+        return self.client.get(self.snmp_info['outlet'])
+
+    def _snmp_power_on(self):
+        self.client.set(self.snmp_info['outlet'], states.POWER_ON)
+
+    def _snmp_power_off(self):
+        self.client.set(self.snmp_info['outlet'], states.POWER_OFF)
+
+    def _snmp_power_reboot(self):
+        self.client.set(self.snmp_info['outlet'], states.REBOOT)
+
+
+# The driver of the BMCs configured without an snmp_driver
+DEFAULT_DRIVER = 'apc_masterswitch'
+
+# A dictionary of supported drivers keyed by snmp_driver attribute
+DRIVER_CLASSES = {
+    'apc': SNMPDriverAPCMasterSwitch,
+    'apc_masterswitch': SNMPDriverAPCMasterSwitch,
+    'apc_masterswitchplus': SNMPDriverAPCMasterSwitchPlus,
+    'apc_rackpdu': SNMPDriverAPCRackPDU,
+    'apc_rpdu2': SNMPDriverAPCRPDU2,
+    'baytech_mrp27': SNMPDriverBaytechMRP27,
+    'cyberpower': SNMPDriverCyberPower,
+    'eatonpower': SNMPDriverEatonPower,
+    'raritan_pdu2': SNMPDriverRaritanPDU2,
+    'servertech_sentry3': SNMPDriverServerTechSentry3,
+    'simulated': SNMPDriverSimulated,
+}
+
+
+def get_driver_class(name):
+    """Return the SNMP driver class registered under a name.
+
+    :param name: One of the keys of ``DRIVER_CLASSES``.
+    :raises: SNMPDriverNotFound if no driver has this name.
+    :returns: A :class:`SNMPDriverBase` subclass.
+    """
+    try:
+        return DRIVER_CLASSES[name]
+    except KeyError:
+        raise exception.SNMPDriverNotFound(
+            driver=name, drivers=', '.join(sorted(DRIVER_CLASSES)))
+
+
+def get_async_driver_class(name):
+    """Return the asyncio variant of an SNMP driver class.
+
+    See :mod:`poorbmc.snmp_async`, which is only imported here as it
+    requires Python 3.
+
+    :param name: One of the keys of ``DRIVER_CLASSES``.
+    :raises: PoorBMCError on Python 2.
+    :raises: SNMPDriverNotFound if no driver has this name.
+    :returns: A :class:`SNMPDriverBase` subclass.
+    """
+    if six.PY2:
+        raise exception.PoorBMCError(
+            'The asyncio SNMP drivers require Python 3')
+    from poorbmc import snmp_async
+    return snmp_async.get_driver_class(name)
@@ -0,0 +1,548 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+asyncio variants of the SNMP drivers.
+
+The drivers of :mod:`poorbmc.snmp` block a thread for each SNMP request,
+so a process can only have as many requests outstanding as it has
+threads. The classes returned by :func:`get_driver_class` extend them with
+coroutines (``async_power_state``, ``async_power_on``, ``async_power_off``
+and ``async_power_reset``) running on an event loop, which can keep
+hundreds of PDU requests in flight.
+
+Their requests go through the load limits, RTT estimate and metrics of
+the synchronous client of the PDU, so both kinds of drivers can be used
+side by side. Messages are built and parsed with
+the PySNMP protocol API and sent over an asyncio datagram endpoint; only
+SNMP versions 1 and 2c are supported this way. SNMPv3 outlets, and the
+drivers that do not switch outlets with plain SETs (e.g. the simulated
+one), run their synchronous methods in the default executor of the loop
+instead. The requests made from the event loop are not traced, as spans
+nest per thread.
+
+This module requires Python 3: import it through
+:func:`poorbmc.snmp.get_async_driver_class`.
+"""
+
+import asyncio
+import time
+
+from pyasn1.codec.ber import decoder
+from pyasn1.codec.ber import encoder
+from pyasn1.type import univ
+from pysnmp.proto import api
+
+from poorbmc import exception
+from poorbmc import log
+from poorbmc import snmp
+from poorbmc import traps
+
+LOG = log.get_logger()
+
+states = snmp.states
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    """Match SNMP responses to the pending requests by request ID."""
+
+    def __init__(self, proto_mod):
+        self.proto_mod = proto_mod
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        p = self.proto_mod
+        try:
+            msg, _ = decoder.decode(data, asn1Spec=p.Message())
+            pdu = p.apiMessage.getPDU(msg)
+            request_id = int(p.apiPDU.getRequestID(pdu))
+        except Exception as e:
+            LOG.debug("Ignoring malformed SNMP message from %(addr)s: "
+                      "%(error)s", {'addr': addr, 'error': e})
+            return
+
+        future = self.pending.get(request_id)
+        if future is not None and not future.done():
+            future.set_result(pdu)
+
+    def error_received(self, exc):
+        # ICMP errors (e.g. port unreachable); the request times out and
+        # is retried like a lost datagram.
+        LOG.debug("SNMP transport error: %s", exc)
+
+
+class _SingleFlight(object):
+    """Coalesce identical concurrent coroutines.
+
+    The asyncio counterpart of :class:`poorbmc.snmp._SingleFlight`: the
+    first caller for a key runs the coroutine, callers arriving with the
+    same key while it is in flight share its result (or exception). It is
+    cancelled once all of its callers are.
+    """
+
+    class _Call(object):
+
+        def __init__(self, future):
+            self.future = future
+            self.waiters = 0
+
+    def __init__(self):
+        self._calls = {}
+
+    def _done(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key, func, *args):
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = self._Call(
+                asyncio.ensure_future(func(*args)))
+            call.future.add_done_callback(
+                lambda future: self._done(key, call))
+        call.waiters += 1
+        try:
+            # A caller giving up must not cancel the call of the others
+            return await asyncio.shield(call.future)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.future.done():
+                call.future.cancel()
+
+
+class _Slot(object):
+    """Hold a slot of a :class:`poorbmc.snmp._PDULimiter`, asynchronously.
+
+    The request queues up with the threads using the PDU, and is woken up
+    from whichever thread frees a slot.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    async def __aenter__(self):
+        loop = asyncio.get_event_loop()
+        woken = asyncio.Event()
+        ticket = self.limiter.enqueue(
+            lambda: loop.call_soon_threadsafe(woken.set))
+        try:
+            delay = self.limiter.take(ticket)
+            while delay != 0:
+                try:
+                    await asyncio.wait_for(woken.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                # Nothing else runs on the loop until take() is called,
+                # so no wake up can be missed
+                woken.clear()
+                delay = self.limiter.take(ticket)
+        except BaseException:
+            self.limiter.cancel(ticket)
+            raise
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.limiter.release()
+
+
+class AsyncSNMPClient(object):
+    """asyncio SNMP client object.
+
+    Performs the SNMP get and set operations of an
+    :class:`poorbmc.snmp.SNMPClient`, with the same contract, as
+    coroutines, sharing its load limits, RTT estimator and metrics.
+
+    :param client: The synchronous :class:`poorbmc.snmp.SNMPClient` of the
+        PDU, using SNMP version 1 or 2c.
+    """
+
+    def __init__(self, client):
+        if client.version == snmp.SNMP_V3:
+            raise exception.PoorBMCError(
+                'SNMPv3 is not supported by the asyncio SNMP client')
+        self.client = client
+        if client.version == snmp.SNMP_V2C:
+            self.proto_mod = api.protoModules[api.protoVersion2c]
+        else:
+            self.proto_mod = api.protoModules[api.protoVersion1]
+        self._protocol = None
+        self._connecting = None
+        self._in_flight = _SingleFlight()
+
+    async def _get_protocol(self):
+        if self._protocol is None:
+            if self._connecting is None:
+                loop = asyncio.get_event_loop()
+                self._connecting = asyncio.ensure_future(
+                    loop.create_datagram_endpoint(
+                        lambda: _Protocol(self.proto_mod),
+                        remote_addr=(self.client.address,
+                                     self.client.port)))
+            try:
+                _, self._protocol = await self._connecting
+            except OSError as e:
+                self._connecting = None
+                raise exception.SNMPFailure(operation="CONNECT", error=e)
+        return self._protocol
+
+    def close(self):
+        if self._protocol is not None:
+            self._protocol.transport.close()
+            self._protocol = None
+            self._connecting = None
+
+    def _make_pdu(self, pdu_class, var_binds):
+        p = self.proto_mod
+        pdu = pdu_class()
+        p.apiPDU.setDefaults(pdu)
+        p.apiPDU.setVarBinds(pdu, var_binds)
+        return pdu
+
+    async def _command(self, operation, pdu):
+        """Send a request PDU, retrying it when it times out.
+
+        Like :meth:`poorbmc.snmp.SNMPClient._command`, each attempt takes a
+        slot of the PDU and waits for the timeout estimated from its RTT,
+        within the ``request_timeout`` of the client, and only the
+        requests answered on first attempt are RTT samples.
+        Retries are sent with the same request ID, so a late answer to an
+        earlier attempt is accepted.
+
+        :raises: SNMPTimeout if no response is received.
+        :raises: SNMPFailure if the response carries an error.
+        :returns: The response var-binds.
+        """
+        client = self.client
+        p = self.proto_mod
+        msg = p.Message()
+        p.apiMessage.setDefaults(msg)
+        p.apiMessage.setCommunity(msg, client.community)
+        p.apiMessage.setPDU(msg, pdu)
+        data = encoder.encode(msg)
+        request_id = int(p.apiPDU.getRequestID(pdu))
+
+        protocol = await self._get_protocol()
+        loop = asyncio.get_event_loop()
+        response = None
+        deadline = time.time() + client.request_timeout
+        for attempt in range(snmp.udp_transport_retries + 1):
+            if attempt:
+                if time.time() >= deadline:
+                    break
+                snmp.SNMP_RETRIES.inc(client.pdu_name, operation)
+            queued = time.time()
+            async with _Slot(client.limiter):
+                start = time.time()
+                snmp.SNMP_QUEUE_SECONDS.observe(start - queued,
+                                                client.pdu_name)
+                future = loop.create_future()
+                protocol.pending[request_id] = future
+                protocol.transport.sendto(data)
+                timeout = min(client.rtt.timeout,
+                              max(deadline - start,
+                                  snmp.udp_transport_timeout_min))
+                try:
+                    response = await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    protocol.pending.pop(request_id, None)
+                rtt = time.time() - start
+
+            if response is None:
+                snmp.SNMP_TIMEOUTS.inc(client.pdu_name, operation)
+                client.rtt.backoff()
+                LOG.debug("SNMP PDU %(addr)s: %(operation)s timed out, "
+                          "timeout is now %(timeout).2fs",
+                          {'addr': client.address, 'operation': operation,
+                           'timeout': client.rtt.timeout})
+                continue
+
+            snmp.SNMP_REQUEST_SECONDS.observe(rtt, client.pdu_name,
+                                              operation)
+            # Only unambiguous samples are used (Karn's algorithm)
+            if attempt == 0:
+                client.rtt.sample(rtt)
+            break
+
+        if response is None:
+            snmp.SNMP_ERRORS.inc(client.pdu_name, operation)
+            raise exception.SNMPTimeout(
+                operation=operation,
+                error='No SNMP response received before timeout')
+
+        error_status = p.apiPDU.getErrorStatus(response)
+        if error_status:
+            # SNMP PDU error.
+            snmp.SNMP_ERRORS.inc(client.pdu_name, operation)
+            raise exception.SNMPFailure(operation=operation,
+                                        error=error_status.prettyPrint())
+
+        return p.apiPDU.getVarBinds(response)
+
+    def _check_value(self, operation, val):
+        if self.client.version == snmp.SNMP_V2C and (
+                isinstance(val, (self.proto_mod.NoSuchObject,
+                                 self.proto_mod.NoSuchInstance))):
+            raise exception.SNMPFailure(operation=operation,
+                                        error=val.prettyPrint())
+        return val
+
+    async def get(self, oid):
+        """Perform an SNMP GET operation on a single object.
+
+        Concurrent GETs of the same object share a single request.
+
+        :param oid: The OID of the object to get.
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: The value of the requested object.
+        """
+        return await self._in_flight.do(("GET", tuple(oid)), self._get, oid)
+
+    async def _get(self, oid):
+        p = self.proto_mod
+        pdu = self._make_pdu(p.GetRequestPDU, [(oid, p.Null(''))])
+        var_binds = await self._command("GET", pdu)
+        # We only expect a single value back
+        name, val = var_binds[0]
+        return self._check_value("GET", val)
+
+    async def get_next(self, oid):
+        """Perform SNMP GET NEXT operations to walk a table object.
+
+        :param oid: The OID of the object to get.
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: A list of values of the requested table object.
+        """
+        p = self.proto_mod
+        root = univ.ObjectIdentifier(oid)
+        values = []
+        next_oid = root
+        while True:
+            pdu = self._make_pdu(p.GetNextRequestPDU,
+                                 [(next_oid, p.Null(''))])
+            try:
+                var_binds = await self._command("GET_NEXT", pdu)
+            except exception.SNMPTimeout:
+                raise
+            except exception.SNMPFailure:
+                # SNMPv1 agents report the end of the MIB as noSuchName
+                if values and self.client.version != snmp.SNMP_V2C:
+                    break
+                raise
+            name, val = var_binds[0]
+            if (not root.isPrefixOf(name) or
+                    isinstance(val, getattr(p, 'EndOfMibView', ()))):
+                break
+            if name <= next_oid:
+                raise exception.SNMPFailure(operation="GET_NEXT",
+                                            error='OIDs are not increasing')
+            values.append(val)
+            next_oid = name
+        return values
+
+    async def set(self, oid, value):
+        """Perform an SNMP SET operation on a single object.
+
+        :param oid: The OID of the object to set.
+        :param value: The value of the object to set.
+        :raises: SNMPFailure if an SNMP request fails.
+        """
+        pdu = self._make_pdu(self.proto_mod.SetRequestPDU, [(oid, value)])
+        await self._command("SET", pdu)
+
+
+# asyncio SNMP clients, by synchronous client and event loop: datagram
+# endpoints and futures belong to a loop
+_clients = {}
+
+
+def get_client(client):
+    """Return the asyncio SNMP client of a PDU for the running loop.
+
+    :param client: The synchronous :class:`poorbmc.snmp.SNMPClient` of
+        the PDU.
+    :returns: A :class:`AsyncSNMPClient` object.
+    """
+    key = (client, asyncio.get_event_loop())
+    async_client = _clients.get(key)
+    if async_client is None:
+        async_client = _clients[key] = AsyncSNMPClient(client)
+    return async_client
+
+
+class _Notified(object):
+    """Set an asyncio event from the SNMP notification listener thread."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+
+class AsyncDriverMixin(object):
+    """asyncio variants of the power operations of an SNMP driver.
+
+    Mixed into the :class:`poorbmc.snmp.SNMPDriverBase` subclasses by
+    :func:`get_driver_class`, the synchronous methods remaining available.
+    They read the outlet's ``oid`` and switch it with the SETs of
+    ``_snmp_request``, and wait for it to switch as
+    :meth:`poorbmc.snmp.SNMPDriverBase._snmp_wait_for_state` does.
+    """
+
+    def _async_client(self):
+        if self.oid is None or self.client.version == snmp.SNMP_V3:
+            return None
+        return get_client(self.client)
+
+    async def _in_executor(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def _async_read(self):
+        value = await self._async_client().get(self.oid)
+        return self._to_power_state(value)
+
+    async def _async_set(self, state):
+        await self._async_client().set(*self._snmp_request(state))
+        self.client.collector.invalidate()
+
+    async def _async_stagger(self, interval=None):
+        delay = self.stagger.reserve(interval) - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _async_wait_for_state(self, goal_state, timeout=None,
+                                    until_left=False):
+        if timeout is None:
+            timeout = snmp.power_timeout
+        started = time.time()
+        deadline = started + timeout
+        notified = _Notified(asyncio.get_event_loop())
+        subscription = None
+        if traps.is_listening():
+            subscription = traps.subscribe(self.snmp_info['address'],
+                                           notified)
+        try:
+            for interval in self._poll_intervals():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    state = states.ERROR
+                    break
+                try:
+                    await asyncio.wait_for(notified.event.wait(),
+                                           min(interval, remaining))
+                    notified.event.clear()
+                except asyncio.TimeoutError:
+                    pass
+                snmp.WAIT_FOR_STATE_POLLS.inc(self.client.pdu_name)
+                state = await self._async_read()
+                if (state == goal_state) != until_left:
+                    break
+        finally:
+            if subscription is not None:
+                traps.unsubscribe(subscription)
+
+        snmp.WAIT_FOR_STATE_SECONDS.observe(
+            time.time() - started, self.client.pdu_name,
+            'timeout' if state == states.ERROR else 'reached')
+        return state
+
+    async def async_power_state(self):
+        """Returns a node's current power state.
+
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
+        if self._async_client() is None:
+            return await self._in_executor(self.power_state)
+        return await self._async_read()
+
+    async def async_power_on(self):
+        """Set the power state to this node to ON.
+
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
+        if self._async_client() is None:
+            return await self._in_executor(self.power_on)
+        await self._async_stagger()
+        await self._async_set(states.POWER_ON)
+        return await self._async_wait_for_state(states.POWER_ON)
+
+    async def async_power_off(self):
+        """Set the power state to this node to OFF.
+
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
+        if self._async_client() is None:
+            return await self._in_executor(self.power_off)
+        await self._async_set(states.POWER_OFF)
+        return await self._async_wait_for_state(states.POWER_OFF)
+
+    async def async_power_reset(self):
+        """Reset the power to this node.
+
+        :raises: SNMPFailure if an SNMP request fails.
+        :returns: power state. One of :class:`ironic.common.states`.
+        """
+        if self._async_client() is None:
+            return await self._in_executor(self.power_reset)
+        if self.native_reboot:
+            await self._async_stagger()
+            await self._async_set(states.REBOOT)
+            # The outlet may still report power on right after the
+            # request; wait for the cycle to start, unless it is over
+            # before we manage to see it.
+            await self._async_wait_for_state(
+                states.POWER_ON, timeout=snmp.reboot_start_timeout,
+                until_left=True)
+            return await self._async_wait_for_state(states.POWER_ON)
+
+        await self._async_set(states.POWER_OFF)
+        state = await self._async_wait_for_state(states.POWER_OFF)
+        if state != states.POWER_OFF:
+            return states.ERROR
+        await asyncio.sleep(snmp.reboot_delay)
+        await self._async_stagger()
+        await self._async_set(states.POWER_ON)
+        state = await self._async_wait_for_state(states.POWER_ON)
+        if state != states.POWER_ON:
+            return states.ERROR
+        return state
+
+
+_driver_classes = {}
+
+
+def get_driver_class(name):
+    """Return the asyncio variant of an SNMP driver class.
+
+    :param name: The name of the driver, one of
+        :data:`poorbmc.snmp.DRIVER_CLASSES`.
+    :raises: SNMPDriverNotFound if there is no such driver.
+    :returns: A subclass of the driver class and of
+        :class:`AsyncDriverMixin`.
+    """
+    driver_class = snmp.get_driver_class(name)
+    async_class = _driver_classes.get(driver_class)
+    if async_class is None:
+        async_class = _driver_classes[driver_class] = type(
+            str('Async' + driver_class.__name__),
+            (AsyncDriverMixin, driver_class), {})
+    return async_class
@@ -0,0 +1,261 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Persistent runtime state.
+
+Runtime state, like the boot device set over IPMI, is kept in memory and
+written to disk behind the requests that change it: changes are collected
+for up to ``[state] flush_interval`` seconds and then written in a single
+pass, where every file is replaced atomically (written to a temporary file,
+fsync'ed and renamed over the previous version). A burst of changes costs
+one write per file and one fsync per file and directory, instead of one
+fsync per IPMI request, and a crash can lose the last few changes but never
+leave a truncated file behind.
+"""
+
+import atexit
+import errno
+import json
+import os
+import threading
+import time
+
+from poorbmc import config as pbmc_config
+from poorbmc import log
+
+LOG = log.get_logger()
+
+CONF = pbmc_config.get_config()
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Not supported by every file system
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_files(files):
+    """Atomically replace a batch of files.
+
+    Every file is written to a temporary file next to it and fsync'ed
+    before any of them is renamed into place, then each of the directories
+    involved is fsync'ed once.
+
+    :param files: A dict mapping paths to their new content (bytes).
+    :returns: The list of the paths that could not be written.
+    """
+    renames = []
+    failed = []
+    for path, data in files.items():
+        tmp_path = '%s.tmp' % path
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        except (IOError, OSError) as e:
+            LOG.error('Error writing %(path)s. Error: %(error)s',
+                      {'path': path, 'error': e})
+            failed.append(path)
+        else:
+            renames.append((tmp_path, path))
+
+    directories = set()
+    for tmp_path, path in renames:
+        try:
+            os.rename(tmp_path, path)
+        except OSError as e:
+            LOG.error('Error writing %(path)s. Error: %(error)s',
+                      {'path': path, 'error': e})
+            failed.append(path)
+        else:
+            directories.add(os.path.dirname(path))
+
+    for directory in directories:
+        _fsync_dir(directory)
+
+    return failed
+
+
+class WriteBehind(object):
+    """Write files to disk in batches from a background thread.
+
+    Writers schedule an object providing a ``path`` attribute, a
+    ``render()`` method returning the content of the file, or ``None`` if
+    it does not need to be written, and a ``written(data)`` method called
+    once that content is on disk. Scheduling the same path again before
+    it is written only renders it once, with its latest content. Everything
+    pending is written in a single :func:`write_files` batch, and the files
+    that could not be written are retried with the next batch.
+
+    :param interval: Time (in seconds) changes are collected before being
+        written.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, item):
+        with self._cond:
+            self._pending[item.path] = item
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Let the changes accumulate before writing them
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write the pending changes now."""
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            files = {}
+            items = {}
+            for path, item in pending.items():
+                try:
+                    data = item.render()
+                except Exception as e:
+                    LOG.error('Error rendering %(path)s. Error: %(error)s',
+                              {'path': path, 'error': e})
+                    continue
+                if data is not None:
+                    files[path] = data
+                    items[path] = item
+            if not files:
+                return
+
+            failed = set(write_files(files))
+            for path, item in items.items():
+                if path not in failed:
+                    item.written(files[path])
+            LOG.debug('Wrote %(count)d file(s), %(failed)d failed',
+                      {'count': len(files) - len(failed),
+                       'failed': len(failed)})
+            if failed:
+                LOG.warning('Failed to write %(failed)s, retrying in '
+                            '%(interval)s seconds',
+                            {'failed': ', '.join(sorted(failed)),
+                             'interval': self.interval})
+                with self._cond:
+                    for path in failed:
+                        # Unless it was scheduled again meanwhile
+                        self._pending.setdefault(path, items[path])
+                    self._cond.notify()
+
+
+def get_writer():
+    """Return the write-behind writer shared by the process."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = WriteBehind(CONF['state']['flush_interval'])
+            atexit.register(_writer.flush)
+    return _writer
+
+
+def flush():
+    """Write the pending state changes of the process now.
+
+    Called when shutting down, so state changed within the last
+    ``flush_interval`` seconds is not lost.
+    """
+    if _writer is not None:
+        _writer.flush()
+
+
+class StateStore(object):
+    """The persistent runtime state of a BMC.
+
+    A small JSON object, loaded from ``path`` when the store is created
+    and written back to it behind :meth:`set`.
+
+    :param path: The path of the state file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._written = None
+        self._state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                self._written = f.read()
+            state = json.loads(self._written.decode('utf-8'))
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                LOG.warning('Error reading the state file %(path)s, '
+                            'starting afresh. Error: %(error)s',
+                            {'path': self.path, 'error': e})
+            return {}
+        except ValueError as e:
+            LOG.warning('Ignoring the corrupt state file %(path)s. '
+                        'Error: %(error)s', {'path': self.path, 'error': e})
+            return {}
+
+        if not isinstance(state, dict):
+            LOG.warning('Ignoring the corrupt state file %s', self.path)
+            return {}
+        return state
+
+    def get(self, key, default=None):
+        return self._state.get(key, default)
+
+    def set(self, key, value):
+        """Change a value, writing it to disk shortly after."""
+        with self._lock:
+            if key in self._state and self._state[key] == value:
+                return
+            self._state[key] = value
+        get_writer().schedule(self)
+
+    def render(self):
+        with self._lock:
+            data = json.dumps(self._state, sort_keys=True,
+                              separators=(',', ':')).encode('utf-8')
+            if data == self._written:
+                # Changed back before being written
+                return None
+        return data
+
+    def written(self, data):
+        with self._lock:
+            self._written = data
@@ -0,0 +1,254 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Supervision of the BMCs hosted by "pbmc serve".
+
+:func:`probe` checks that BMCs actually answer IPMI, and
+:class:`ControlServer` and :func:`control` carry the start, stop, status
+and power requests of ``pbmc`` to the server over a UNIX socket, one JSON
+object per line each way.
+"""
+
+import errno
+import json
+import os
+import select
+import socket
+import threading
+import time
+
+from poorbmc import exception
+from poorbmc import log
+
+LOG = log.get_logger()
+
+_RMCP_HEADER = b'\x06\x00\xff\x07'
+
+# Get Channel Authentication Capabilities, for the current channel and the
+# administrator privilege level. It needs no session, so any BMC answers
+# it right away.
+_GET_CHANNEL_AUTH_CAPABILITIES = 0x38
+
+
+def _checksum(data):
+    return -sum(bytearray(data)) & 0xff
+
+
+def _probe_packet():
+    # BMC and software addresses, netfn App, sequence number 1, then the
+    # channel (current, IPMI v2.0 data) and privilege level
+    header = bytearray((0x20, 0x06 << 2))
+    body = bytearray((0x81, 1 << 2, _GET_CHANNEL_AUTH_CAPABILITIES,
+                      0x8e, 0x04))
+    message = (header + bytearray((_checksum(header),)) + body +
+               bytearray((_checksum(body),)))
+    # Sessionless IPMI v1.5 wrapper
+    return bytes(_RMCP_HEADER + b'\x00' + b'\x00' * 8 +
+                 bytearray((len(message),)) + message)
+
+
+_PROBE = _probe_packet()
+
+# Addresses to probe the BMCs bound to every address on
+_WILDCARDS = {'0.0.0.0': '127.0.0.1', '::': '::1', '': '127.0.0.1'}
+
+
+def _probe_address(address):
+    return _WILDCARDS.get(address, address)
+
+
+def probe(endpoints, timeout):
+    """Check which BMCs answer IPMI requests.
+
+    A Get Channel Authentication Capabilities request is sent to every
+    BMC at once, then the answers are collected for up to ``timeout``
+    seconds.
+
+    :param endpoints: A list of ``(address, port)`` tuples of BMCs.
+    :param timeout: Time (in seconds) the BMCs have to answer.
+    :returns: The set of the endpoints that answered.
+    """
+    targets = {}
+    for address, port in endpoints:
+        targets[(_probe_address(address), int(port))] = (address, port)
+
+    sockets = {}
+    try:
+        for target in targets:
+            family = socket.AF_INET6 if ':' in target[0] else socket.AF_INET
+            if family not in sockets:
+                sockets[family] = socket.socket(family, socket.SOCK_DGRAM)
+            try:
+                sockets[family].sendto(_PROBE, target)
+            except socket.error as e:
+                LOG.debug('Error probing %(address)s port %(port)d. '
+                          'Error: %(error)s', {'address': target[0],
+                                               'port': target[1],
+                                               'error': e})
+
+        answered = set()
+        deadline = time.time() + timeout
+        while len(answered) < len(targets):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            readable = select.select(list(sockets.values()), [], [],
+                                     remaining)[0]
+            for sock in readable:
+                try:
+                    data, source = sock.recvfrom(512)
+                except socket.error:
+                    # e.g. ICMP port unreachable, from a closed listener
+                    continue
+                data = bytearray(data)
+                target = (source[0], source[1])
+                if (target in targets and len(data) > 20 and
+                        data[:4] == _RMCP_HEADER and
+                        data[19] == _GET_CHANNEL_AUTH_CAPABILITIES):
+                    answered.add(targets[target])
+        return answered
+    finally:
+        for sock in sockets.values():
+            sock.close()
+
+
+class ControlServer(object):
+    """Answer control requests on a UNIX socket, from a thread.
+
+    :param path: The path of the socket.
+    :param handler: Called with every request (a dict with at least a
+        ``command`` key), returns the JSON serializable result or raises
+        :class:`poorbmc.exception.PoorBMCError`.
+    """
+
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        self._running = False
+        self._thread = None
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(path)
+        # Anyone allowed to connect can stop the BMCs
+        os.chmod(path, 0o600)
+        self._socket.listen(16)
+
+    def _handle(self, conn):
+        conn.settimeout(5)
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = conn.recv(65536)
+            if not chunk:
+                return
+            data += chunk
+
+        try:
+            request = json.loads(data.decode('utf-8'))
+            response = {'result': self.handler(request)}
+        except exception.PoorBMCError as e:
+            response = {'error': str(e)}
+        except Exception as e:
+            LOG.exception('Error handling control request %r', data)
+            response = {'error': 'Internal error: %s' % e}
+        conn.sendall(json.dumps(response).encode('utf-8') + b'\n')
+
+    def serve_forever(self):
+        self._running = True
+        while self._running:
+            if not select.select([self._socket], [], [], 0.5)[0]:
+                continue
+            conn, _ = self._socket.accept()
+            # Power requests wait for the outlets to switch, so do not let
+            # them hold the others up
+            thread = threading.Thread(target=self._serve, args=(conn,),
+                                      name='pbmc-control-request')
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn):
+        try:
+            self._handle(conn)
+        except socket.error as e:
+            LOG.debug('Error answering a control request. Error: %s', e)
+        finally:
+            conn.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='pbmc-control')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._socket.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def control(path, command, timeout=60, **kwargs):
+    """Send a request to the control socket of "pbmc serve".
+
+    :param path: The path of the socket.
+    :param command: The command, e.g. ``status``.
+    :param timeout: Time (in seconds) to wait for the answer.
+    :param kwargs: The arguments of the command.
+    :raises: PoorBMCError if the server fails the request or does not
+        answer it.
+    :returns: The result of the command, or ``None`` if the server is not
+        running.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error as e:
+            if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                return None
+            raise
+
+        request = dict(kwargs, command=command)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    except socket.error as e:
+        raise exception.PoorBMCError(
+            'Error talking to pbmc serve on %(path)s. Error: %(error)s' %
+            {'path': path, 'error': e})
+    finally:
+        sock.close()
+
+    try:
+        response = json.loads(data.decode('utf-8'))
+    except ValueError:
+        raise exception.PoorBMCError(
+            'Invalid answer from pbmc serve on %(path)s: %(data)r' %
+            {'path': path, 'data': data})
+    if 'error' in response:
+        raise exception.PoorBMCError(response['error'])
+    return response['result']
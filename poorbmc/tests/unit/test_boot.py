@@ -0,0 +1,132 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+import mock
+
+from poorbmc import boot
+from poorbmc import exception
+from poorbmc import state
+from poorbmc.tests.unit import base
+
+MAC = '52:54:00:AB:cd:01'
+
+
+class GrubBackendTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GrubBackendTestCase, self).setUp()
+        self.backend = boot.GrubBackend('/srv/tftp')
+
+    def test_filename(self):
+        self.assertEqual('grub.cfg-01-52-54-00-ab-cd-01',
+                         self.backend.filename('node1', MAC))
+        self.assertEqual('grub.cfg-node1', self.backend.filename('node1'))
+        self.assertEqual('/srv/tftp/grub.cfg-node1',
+                         self.backend.path('node1'))
+
+    @mock.patch.dict(boot.CONF['boot'], {'grub_include': 'pbmc.cfg'})
+    def test_render(self):
+        lines = self.backend.render('node1', 'network').decode().split('\n')
+        self.assertTrue(lines[0].startswith('# Generated by poorbmc'))
+        self.assertEqual(['set pbmc_bmc="node1"',
+                          'set pbmc_boot_device="network"',
+                          'source "$prefix/pbmc.cfg"', ''], lines[1:])
+
+
+class IPXEBackendTestCase(base.TestCase):
+
+    def setUp(self):
+        super(IPXEBackendTestCase, self).setUp()
+        self.backend = boot.IPXEBackend('/srv/tftp')
+
+    def test_filename(self):
+        self.assertEqual('52-54-00-ab-cd-01.ipxe',
+                         self.backend.filename('node1', MAC))
+        self.assertEqual('node1.ipxe', self.backend.filename('node1'))
+
+    @mock.patch.dict(boot.CONF['boot'], {'ipxe_chain': 'pbmc.ipxe'})
+    def test_render(self):
+        lines = self.backend.render('node1', 'hd').decode().split('\n')
+        self.assertEqual('#!ipxe', lines[0])
+        self.assertEqual(['set pbmc_bmc node1', 'set pbmc_boot_device hd',
+                          'chain pbmc.ipxe', ''], lines[2:])
+
+
+class GrubenvBackendTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GrubenvBackendTestCase, self).setUp()
+        self.backend = boot.GrubenvBackend('/srv/tftp')
+
+    def test_filename(self):
+        self.assertEqual('grubenv-01-52-54-00-ab-cd-01',
+                         self.backend.filename('node1', MAC))
+        self.assertEqual('grubenv-node1', self.backend.filename('node1'))
+
+    def test_render(self):
+        data = self.backend.render('node1', 'optical')
+        self.assertEqual(boot.GRUBENV_SIZE, len(data))
+        self.assertTrue(data.startswith(b'# GRUB Environment Block\n'
+                                        b'pbmc_bmc=node1\n'
+                                        b'pbmc_boot_device=optical\n#'))
+        self.assertTrue(data.endswith(b'####'))
+
+    def test_render_too_large(self):
+        self.assertRaises(exception.PoorBMCError, self.backend.render,
+                          'n' * boot.GRUBENV_SIZE, 'hd')
+
+
+class BootFileTestCase(base.TestCase):
+
+    def setUp(self):
+        super(BootFileTestCase, self).setUp()
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.backend = boot.GrubenvBackend(os.path.join(tmpdir, 'boot'))
+        self.writer = state.WriteBehind(3600)
+        patcher = mock.patch.object(state, '_writer', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _read(self, boot_file):
+        with open(boot_file.path, 'rb') as f:
+            return f.read()
+
+    def test_written(self):
+        boot_file = boot.BootFile(self.backend, 'node1', 'default', mac=MAC)
+        self.writer.flush()
+        self.assertEqual(self.backend.render('node1', 'default'),
+                         self._read(boot_file))
+        self.assertEqual('grubenv-01-52-54-00-ab-cd-01',
+                         os.path.basename(boot_file.path))
+
+        boot_file.set('network')
+        self.writer.flush()
+        self.assertEqual(self.backend.render('node1', 'network'),
+                         self._read(boot_file))
+
+    def test_up_to_date(self):
+        boot.BootFile(self.backend, 'node1', 'hd')
+        self.writer.flush()
+        # A new instance finds the file up to date
+        boot_file = boot.BootFile(self.backend, 'node1', 'hd')
+        self.assertIsNone(boot_file.render())
+
+    def test_unsafe_name(self):
+        # BMCs created before the names were checked
+        for bmc_name in ('node 1', 'a"b', 'a\nb', '${x}', '../node1'):
+            self.assertRaises(exception.PoorBMCError, boot.BootFile,
+                              self.backend, bmc_name, 'hd')
+        self.writer.flush()
+        self.assertFalse(os.path.exists(self.backend.output_dir))
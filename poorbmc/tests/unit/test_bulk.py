@@ -0,0 +1,136 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+import json
+import os
+
+import fixtures
+import mock
+
+from poorbmc import bulk
+from poorbmc import exception
+from poorbmc.tests.unit import base
+
+CSV_DATA = u"""bmc_name,port,snmp_address,snmp_outlet,boot_mac
+node1,6230,192.0.2.1,1,52:54:00:12:34:56
+node2,6231,192.0.2.1,2,
+"""
+
+
+class LoadTestCase(base.TestCase):
+
+    def setUp(self):
+        super(LoadTestCase, self).setUp()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+
+    def _write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def test_csv(self):
+        bmcs = bulk.load(self._write('bmcs.csv', CSV_DATA))
+        self.assertEqual(2, len(bmcs))
+        self.assertEqual('node1', bmcs[0]['bmc_name'])
+        self.assertEqual('6230', bmcs[0]['port'])
+        self.assertEqual('52:54:00:12:34:56', bmcs[0]['boot_mac'])
+        # Empty cells are unset, and get the defaults of "pbmc add"
+        self.assertNotIn('boot_mac', bmcs[1])
+        self.assertEqual('private', bmcs[1]['snmp_community'])
+        self.assertEqual('admin', bmcs[1]['username'])
+
+    def test_json_list(self):
+        path = self._write('bmcs.json', json.dumps([
+            {'bmc_name': 'node1', 'port': 6230, 'snmp_address': '192.0.2.1',
+             'snmp_outlet': 1}]))
+        bmcs = bulk.load(path)
+        # Values are text whatever their type in the file
+        self.assertEqual('6230', bmcs[0]['port'])
+        self.assertEqual('1', bmcs[0]['snmp_outlet'])
+
+    def test_yaml_mapping(self):
+        path = self._write('bmcs.yml',
+                           'node2:\n  port: 6231\n  snmp_outlet: 2\n'
+                           'node1:\n  port: 6230\n  snmp_outlet: 1\n')
+        bmcs = bulk.load(path)
+        self.assertEqual(['node1', 'node2'],
+                         [bmc['bmc_name'] for bmc in bmcs])
+        self.assertEqual('6231', bmcs[1]['port'])
+
+    def test_format(self):
+        path = self._write('bmcs.txt', CSV_DATA)
+        self.assertEqual(2, len(bulk.load(path, bulk.CSV)))
+        self.assertRaises(exception.PoorBMCError, bulk.load, path)
+
+    def test_empty(self):
+        self.assertEqual([], bulk.load(self._write('bmcs.yaml', '')))
+
+    def test_invalid(self):
+        for name, data, error in (
+                ('a.json', '{', 'Invalid JSON'),
+                ('a.yaml', 'a: [', 'Invalid YAML'),
+                ('a.json', '42', 'expected a list or a mapping'),
+                ('a.json', '[42]', 'at index 0'),
+                ('a.json', '[{"bmc_name": "n", "colour": "red"}]',
+                 'Unknown BMC settings at index 0: colour'),
+                ('a.csv', 'bmc_name,port\nnode1,6230,extra\n',
+                 'Unknown BMC settings on line 2')):
+            exc = self.assertRaises(exception.PoorBMCError, bulk.load,
+                                    self._write(name, data))
+            self.assertIn(error, str(exc))
+
+    def test_missing_file(self):
+        self.assertRaises(exception.PoorBMCError, bulk.load,
+                          os.path.join(self.tmpdir, 'missing.json'))
+
+    @mock.patch.object(bulk, '_import_yaml', autospec=True,
+                       side_effect=exception.PoorBMCError('no PyYAML'))
+    def test_no_yaml(self, mock_import):
+        self.assertRaises(exception.PoorBMCError, bulk.load,
+                          self._write('bmcs.yaml', 'node1: {}\n'))
+
+
+class DumpTestCase(base.TestCase):
+
+    BMCS = [{'bmc_name': 'node1', 'port': '6230', 'snmp_address': '192.0.2.1',
+             'snmp_outlet': '1', 'snmp_driver': None},
+            {'bmc_name': 'node2', 'port': '6231', 'snmp_address': '192.0.2.1',
+             'snmp_outlet': '2', 'boot_mac': '52:54:00:12:34:56'}]
+
+    def setUp(self):
+        super(DumpTestCase, self).setUp()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+
+    def _round_trip(self, name):
+        path = os.path.join(self.tmpdir, name)
+        bulk.dump(self.BMCS, path)
+        return path, bulk.load(path)
+
+    def test_round_trip(self):
+        for name in ('bmcs.csv', 'bmcs.json', 'bmcs.yaml'):
+            path, bmcs = self._round_trip(name)
+            self.assertEqual(['node1', 'node2'],
+                             [bmc['bmc_name'] for bmc in bmcs], name)
+            self.assertEqual('6231', bmcs[1]['port'], name)
+            self.assertEqual('52:54:00:12:34:56', bmcs[1]['boot_mac'], name)
+            self.assertNotIn('snmp_driver', bmcs[0], name)
+
+    def test_json_order(self):
+        path, _ = self._round_trip('bmcs.json')
+        with open(path) as f:
+            data = f.read()
+        # Unset settings are left out, the others in FIELDS order
+        self.assertNotIn('snmp_driver', data)
+        self.assertLess(data.index('bmc_name'), data.index('port'))
+        self.assertLess(data.index('port'), data.index('snmp_address'))
@@ -0,0 +1,160 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from poorbmc import cache
+from poorbmc.tests.unit import base
+
+states = cache.states
+
+
+@mock.patch('poorbmc.cache.time')
+class PowerStateCacheTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PowerStateCacheTestCase, self).setUp()
+        self.refresh = mock.Mock(return_value=states.POWER_ON)
+        self.cache = cache.PowerStateCache(self.refresh, ttl=2, stale_ttl=10,
+                                           bmc_name='node1')
+        self.executor = mock.Mock()
+        get_executor = mock.patch.object(cache.power, 'get_refresh_executor',
+                                         return_value=self.executor)
+        get_executor.start()
+        self.addCleanup(get_executor.stop)
+
+    def _run_refresh(self):
+        # Run the background refresh submitted to the executor
+        args = self.executor.submit.call_args[0]
+        args[0](*args[1:])
+
+    def _read(self):
+        # A miss, then the read retried once the PDU answered
+        self.assertIsNone(self.cache.get())
+        self._run_refresh()
+        return self.cache.get()
+
+    def test_miss(self, mock_time):
+        mock_time.time.return_value = 100
+        self.assertIsNone(self.cache.get())
+        self.assertFalse(self.refresh.called)
+        self.assertIsNone(self.cache.get())
+        # A single background refresh for both reads
+        self.assertEqual(1, self.executor.submit.call_count)
+        self._run_refresh()
+        self.assertEqual(states.POWER_ON, self.cache.get())
+        self.assertEqual(1, self.refresh.call_count)
+
+    def test_hit(self, mock_time):
+        mock_time.time.return_value = 100
+        self._read()
+        mock_time.time.return_value = 102
+        self.assertEqual(states.POWER_ON, self.cache.get())
+        self.assertEqual(1, self.refresh.call_count)
+        self.assertEqual(1, self.executor.submit.call_count)
+
+    def test_stale(self, mock_time):
+        mock_time.time.return_value = 100
+        self._read()
+        self.refresh.return_value = states.POWER_OFF
+        mock_time.time.return_value = 105
+        self.assertEqual(states.POWER_ON, self.cache.get())
+        self.assertEqual(states.POWER_ON, self.cache.get())
+        self.assertEqual(2, self.executor.submit.call_count)
+        self._run_refresh()
+        self.assertEqual(states.POWER_OFF, self.cache.get())
+        self.assertEqual(2, self.refresh.call_count)
+
+    def test_stale_refresh_failed(self, mock_time):
+        mock_time.time.return_value = 100
+        self._read()
+        self.refresh.side_effect = Exception('boom')
+        mock_time.time.return_value = 105
+        self.cache.get()
+        self._run_refresh()
+        self.assertEqual(states.POWER_ON, self.cache.get())
+        # Another refresh can start
+        self.assertEqual(3, self.executor.submit.call_count)
+
+    def test_expired(self, mock_time):
+        mock_time.time.return_value = 100
+        self._read()
+        self.refresh.return_value = states.POWER_OFF
+        mock_time.time.return_value = 111
+        self.assertEqual(states.POWER_OFF, self._read())
+        self.assertEqual(2, self.refresh.call_count)
+
+    def test_set(self, mock_time):
+        mock_time.time.return_value = 100
+        self.cache.set(states.POWER_OFF)
+        self.assertEqual(states.POWER_OFF, self.cache.get())
+        self.assertFalse(self.executor.submit.called)
+
+    def test_invalidate(self, mock_time):
+        mock_time.time.return_value = 100
+        self._read()
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.get())
+        self.assertEqual(2, self.executor.submit.call_count)
+
+    def test_refresh_does_not_overwrite_set(self, mock_time):
+        mock_time.time.return_value = 100
+        self.cache.get()
+        # A power command completes while the PDU is read
+        self.cache.set(states.POWER_OFF)
+        self._run_refresh()
+        self.assertEqual(states.POWER_OFF, self.cache.get())
+
+    def test_stale_refresh_does_not_overwrite_set(self, mock_time):
+        mock_time.time.return_value = 100
+        self._read()
+        mock_time.time.return_value = 105
+        self.cache.get()
+        self.cache.set(states.POWER_OFF)
+        self._run_refresh()
+        self.assertEqual(states.POWER_OFF, self.cache.get())
+
+    def test_error_not_cached(self, mock_time):
+        mock_time.time.return_value = 100
+        self.refresh.return_value = states.ERROR
+        self.assertIsNone(self._read())
+        self.assertEqual(2, self.executor.submit.call_count)
+
+    def test_set_error(self, mock_time):
+        mock_time.time.return_value = 100
+        self.cache.set(states.POWER_OFF)
+        self.cache.set(states.ERROR)
+        self.assertEqual(states.POWER_ON, self._read())
+
+    def test_no_ttl(self, mock_time):
+        mock_time.time.return_value = 100
+        self.cache.ttl = 0
+        self._read()
+        mock_time.time.return_value = 101
+        # Every read starts a refresh, the last state is served meanwhile
+        self.assertEqual(states.POWER_ON, self.cache.get())
+        self.assertEqual(states.POWER_ON, self.cache.get())
+        self.assertEqual(2, self.executor.submit.call_count)
+        self._run_refresh()
+        mock_time.time.return_value = 102
+        self.cache.get()
+        self.assertEqual(3, self.executor.submit.call_count)
+
+    def test_metrics(self, mock_time):
+        mock_time.time.return_value = 100
+        with mock.patch.object(cache, 'CACHE_READS') as mock_reads:
+            self._read()
+            mock_time.time.return_value = 105
+            self.cache.get()
+        mock_reads.inc.assert_has_calls([mock.call('node1', cache.MISS),
+                                         mock.call('node1', cache.HIT),
+                                         mock.call('node1', cache.STALE)])
@@ -0,0 +1,89 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+import os
+import sqlite3
+
+import fixtures
+
+from poorbmc import index
+from poorbmc.tests.unit import base
+
+
+class BMCIndexTestCase(base.TestCase):
+
+    def setUp(self):
+        super(BMCIndexTestCase, self).setUp()
+        self.config_dir = self.useFixture(fixtures.TempDir()).path
+        self.index = index.BMCIndex(self.config_dir)
+
+    def test_put_get(self):
+        self.assertEqual([], self.index.get_all())
+        self.assertIsNone(self.index.get('node1'))
+        self.index.put('node2', {'port': 6231}, 20.0)
+        self.index.put('node1', {'port': 6230}, 10.0, pid=42)
+        self.assertEqual(('node1', {'port': 6230}, 10.0, 42),
+                         self.index.get('node1'))
+        self.assertEqual([('node1', {'port': 6230}, 10.0, 42),
+                          ('node2', {'port': 6231}, 20.0, None)],
+                         self.index.get_all())
+        self.assertEqual({'node1': 10.0, 'node2': 20.0},
+                         self.index.config_mtimes())
+        self.assertTrue(os.path.exists(os.path.join(
+            self.config_dir, index.INDEX_DIR, index.INDEX_FILE)))
+
+    def test_set_pid_delete(self):
+        self.index.put('node1', {}, 10.0)
+        self.index.set_pid('node1', 42)
+        self.assertEqual(42, self.index.get('node1')[3])
+        self.index.delete('node1')
+        self.assertIsNone(self.index.get('node1'))
+
+    def test_persistent(self):
+        self.index.put('node1', {'port': 6230}, 10.0)
+        self.index.set_dir_mtime(123.5)
+        other = index.BMCIndex(self.config_dir)
+        self.assertEqual(('node1', {'port': 6230}, 10.0, None),
+                         other.get('node1'))
+        self.assertEqual(123.5, other.dir_mtime())
+
+    def test_transaction_rollback(self):
+        self.index.put('node1', {}, 10.0)
+
+        def fail():
+            with self.index.transaction():
+                self.index.delete('node1')
+                # Nested transactions commit with the outermost one
+                with self.index.transaction():
+                    self.index.put('node2', {}, 20.0)
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(['node1'],
+                         [entry[0] for entry in self.index.get_all()])
+
+    def test_touch(self):
+        self.assertIsNone(self.index.dir_mtime())
+        self.index.set_dir_mtime(10.0)
+        self.index.touch(10.0, 11.0)
+        self.assertEqual(11.0, self.index.dir_mtime())
+        # Changed behind the back of the index since
+        self.index.touch(10.0, 12.0)
+        self.assertEqual(11.0, self.index.dir_mtime())
+
+    def test_corrupt(self):
+        self.index.put('node1', {}, 10.0)
+        with open(self.index.path, 'wb') as f:
+            f.write(b'not a database' * 100)
+        self.assertRaises(sqlite3.Error,
+                          index.BMCIndex(self.config_dir).get_all)
@@ -0,0 +1,360 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+
+import fixtures
+import mock
+
+from poorbmc import exception
+from poorbmc import manager
+from poorbmc.tests.unit import base
+
+
+class PoorBMCManagerValidateTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PoorBMCManagerValidateTestCase, self).setUp()
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        patcher = mock.patch.dict(manager.CONF['default'],
+                                  {'config_dir': tmpdir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = manager.PoorBMCManager()
+
+    def _bmc(self, **kwargs):
+        bmc = {'bmc_name': 'node1', 'port': 6230, 'address': '::',
+               'snmp_address': '192.0.2.1', 'snmp_outlet': 1,
+               'snmp_port': 161, 'snmp_community': 'public'}
+        bmc.update(kwargs)
+        return bmc
+
+    def test_valid(self):
+        self.manager._validate(self._bmc())
+
+    def test_invalid_name(self):
+        for bmc_name in ('', '.hidden', '-v', 'a/b', 'node 1', 'a"b',
+                         "a'b", 'a\nb', '$prefix', 'a;b', u'n\u0153ud',
+                         'node1\n'):
+            self.assertRaises(exception.InvalidBMCSettings,
+                              self.manager._validate,
+                              self._bmc(bmc_name=bmc_name))
+
+    def test_valid_names(self):
+        for bmc_name in ('node1', 'rack-1.node_2', 'node@pdu:1', 'a+b'):
+            self.manager._validate(self._bmc(bmc_name=bmc_name))
+
+    def test_invalid_port(self):
+        for port in ('foo', 0, 65536):
+            self.assertRaises(exception.InvalidBMCSettings,
+                              self.manager._validate, self._bmc(port=port))
+
+    def test_boot_mac_normalized(self):
+        for boot_mac in ('52:54:00:AB:cd:01', '52-54-00-ab-CD-01'):
+            bmc = self._bmc(boot_mac=boot_mac)
+            self.manager._validate(bmc)
+            self.assertEqual('52:54:00:ab:cd:01', bmc['boot_mac'])
+
+    def test_boot_mac_invalid(self):
+        for boot_mac in ('../../etc/passwd', '52:54:00:ab:cd',
+                         '52:54:00:ab:cd:01:02', '52:54-00:ab:cd:01',
+                         '52:54:00:ab:cd:0g', '5254.00ab.cd01',
+                         '52:54:00:ab:cd:01\n'):
+            self.assertRaises(exception.InvalidBMCSettings,
+                              self.manager._validate,
+                              self._bmc(boot_mac=boot_mac))
+
+
+class PoorBMCManagerIndexTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PoorBMCManagerIndexTestCase, self).setUp()
+        self.config_dir = self.useFixture(fixtures.TempDir()).path
+        patcher = mock.patch.dict(manager.CONF['default'],
+                                  {'config_dir': self.config_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = manager.PoorBMCManager()
+        for i in (1, 2):
+            self.manager.add_many([self._bmc('node%d' % i, 6229 + i, i)])
+
+    def _bmc(self, bmc_name, port, outlet):
+        return {'username': 'admin', 'password': 'password', 'port': port,
+                'address': '::', 'bmc_name': bmc_name,
+                'snmp_address': '192.0.2.1', 'snmp_outlet': outlet,
+                'snmp_community': 'public', 'snmp_port': 161}
+
+    def _list(self):
+        return dict((bmc['bmc_name'], bmc) for bmc in self.manager.list())
+
+    def _changed(self, path):
+        # Make the change visible whatever the mtime resolution
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+    def test_list_from_index(self):
+        with mock.patch.object(self.manager, '_parse_config',
+                               autospec=True) as mock_parse:
+            bmcs = self._list()
+        self.assertFalse(mock_parse.called)
+        self.assertEqual(['node1', 'node2'], sorted(bmcs))
+        self.assertEqual(6231, bmcs['node2']['port'])
+        self.assertEqual(manager.DOWN, bmcs['node2']['status'])
+
+    def test_show_from_index(self):
+        with mock.patch.object(self.manager, '_parse_config',
+                               autospec=True) as mock_parse:
+            bmc = self.manager.show('node1')
+        self.assertFalse(mock_parse.called)
+        self.assertEqual('192.0.2.1', bmc['snmp_address'])
+
+    def test_added_behind_its_back(self):
+        self.manager._create(self._bmc('node3', 6232, 3))
+        self._changed(self.config_dir)
+        self.assertEqual(['node1', 'node2', 'node3'], sorted(self._list()))
+
+    def test_deleted_behind_its_back(self):
+        shutil.rmtree(os.path.join(self.config_dir, 'node1'))
+        self._changed(self.config_dir)
+        self.assertEqual(['node2'], sorted(self._list()))
+        self.assertIsNone(self.manager.index.get('node1'))
+
+    def test_config_changed(self):
+        config_path = os.path.join(self.config_dir, 'node1', 'config')
+        with open(config_path) as f:
+            config = f.read()
+        with open(config_path, 'w') as f:
+            f.write(config.replace('6230', '7000'))
+        self._changed(config_path)
+        self.assertEqual(7000, self._list()['node1']['port'])
+        self.assertEqual(7000, self.manager.show('node1')['port'])
+
+    def test_delete(self):
+        self.manager.delete('node2')
+        self.assertEqual(['node1'],
+                         [entry[0] for entry in self.manager.index.get_all()])
+        # The index is still up to date with the directory
+        self.assertEqual(os.stat(self.config_dir).st_mtime,
+                         self.manager.index.dir_mtime())
+
+    def test_broken_index(self):
+        with open(self.manager.index.path, 'wb') as f:
+            f.write(b'not a database' * 100)
+        other = manager.PoorBMCManager()
+        self.assertEqual(['node1', 'node2'],
+                         sorted(bmc['bmc_name'] for bmc in other.list()))
+        self.assertEqual(6230, other.show('node1')['port'])
+
+
+class PoorBMCManagerAddManyTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PoorBMCManagerAddManyTestCase, self).setUp()
+        self.config_dir = self.useFixture(fixtures.TempDir()).path
+        patcher = mock.patch.dict(manager.CONF['default'],
+                                  {'config_dir': self.config_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = manager.PoorBMCManager()
+
+    def _bmc(self, bmc_name, port, outlet, **kwargs):
+        bmc = {'username': 'admin', 'password': 'password', 'port': port,
+               'address': '::', 'bmc_name': bmc_name,
+               'snmp_address': '192.0.2.1', 'snmp_outlet': outlet,
+               'snmp_community': 'public', 'snmp_port': 161}
+        bmc.update(kwargs)
+        return bmc
+
+    def _names(self):
+        return sorted(bmc['bmc_name'] for bmc in self.manager.list())
+
+    def test_add_many(self):
+        results = self.manager.add_many([self._bmc('node1', 6230, 1),
+                                         self._bmc('node2', 6231, 2)])
+        self.assertEqual({'node1': True, 'node2': True}, results)
+        self.assertEqual(['node1', 'node2'], self._names())
+        self.assertEqual(['node1', 'node2'],
+                         [entry[0] for entry in self.manager.index.get_all()])
+
+    def test_validated_first(self):
+        self.assertRaises(exception.InvalidBMCSettings,
+                          self.manager.add_many,
+                          [self._bmc('node1', 6230, 1),
+                           self._bmc('node2', 0, 2)])
+        # Nothing created
+        self.assertEqual([], self._names())
+
+    def test_clashes(self):
+        for bmcs in ([self._bmc('node1', 6230, 1),
+                      self._bmc('node2', 6230, 2)],
+                     [self._bmc('node1', 6230, 1),
+                      self._bmc('node2', 6231, 1)],
+                     [self._bmc('node1', 6230, 1),
+                      self._bmc('node1', 6231, 2)]):
+            self.assertRaises(exception.InvalidBMCSettings,
+                              self.manager.add_many, bmcs)
+        self.assertEqual([], self._names())
+
+    def test_clash_with_existing(self):
+        self.manager.add_many([self._bmc('node1', 6230, 1)])
+        exc = self.assertRaises(exception.InvalidBMCSettings,
+                                self.manager.add_many,
+                                [self._bmc('node2', 6231, 1)])
+        self.assertIn('used by bmc node1', str(exc))
+
+    def test_existing(self):
+        self.manager.add_many([self._bmc('node1', 6230, 1)])
+        self.assertRaises(exception.BMCAlreadyExists, self.manager.add_many,
+                          [self._bmc('node1', 6230, 1)])
+        results = self.manager.add_many([self._bmc('node1', 6230, 1),
+                                         self._bmc('node2', 6231, 2)],
+                                        skip_existing=True)
+        self.assertEqual({'node1': False, 'node2': True}, results)
+        self.assertEqual(['node1', 'node2'], self._names())
+
+    def test_export(self):
+        self.manager.add_many([self._bmc('node1', 6230, 1,
+                                         snmp_driver='cyberpower')])
+        exported = self.manager.export()
+        self.assertEqual(1, len(exported))
+        self.assertEqual('cyberpower', exported[0]['snmp_driver'])
+        self.assertEqual('password', exported[0]['password'])
+        self.assertRaises(exception.BMCNotFound, self.manager.export,
+                          ['node9'])
+
+
+class PoorBMCManagerStartStopManyTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PoorBMCManagerStartStopManyTestCase, self).setUp()
+        self.config_dir = self.useFixture(fixtures.TempDir()).path
+        patcher = mock.patch.dict(manager.CONF['default'],
+                                  {'config_dir': self.config_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = manager.PoorBMCManager()
+        self.manager.add_many([
+            {'username': 'admin', 'password': 'password', 'port': 6229 + i,
+             'address': '::', 'bmc_name': 'node%d' % i,
+             'snmp_address': '192.0.2.1', 'snmp_outlet': i,
+             'snmp_community': 'public', 'snmp_port': 161}
+            for i in (1, 2, 3)])
+
+    def _pipe(self, data=None):
+        read_fd, write_fd = os.pipe()
+        if data is not None:
+            os.write(write_fd, data)
+            os.close(write_fd)
+        else:
+            self.addCleanup(os.close, write_fd)
+        return read_fd
+
+    def test_wait_ready(self):
+        pipes = {self._pipe(manager._READY): ('node1', b''),
+                 self._pipe(b'port taken'): ('node2', b''),
+                 self._pipe(b''): ('node3', b''),
+                 self._pipe(): ('node4', b'')}
+        results = self.manager._wait_ready(pipes, 0.2)
+        self.assertEqual(manager.STARTED, results['node1'])
+        self.assertEqual('port taken', str(results['node2']))
+        self.assertIn('the daemon exited', str(results['node3']))
+        self.assertIn('not ready after 0.2 seconds', str(results['node4']))
+
+    @mock.patch.object(manager.PoorBMCManager, '_serve_pid', lambda s: None)
+    def test_start_many(self):
+        forked = []
+
+        def fork_daemon(bmc_name, pipes):
+            forked.append(bmc_name)
+            return self._pipe(manager._READY)
+
+        running = {'node2': 42}
+        with mock.patch.object(self.manager, '_fork_daemon',
+                               side_effect=fork_daemon), \
+                mock.patch.object(self.manager, '_running_pid',
+                                  side_effect=running.get):
+            results = self.manager.start_many(['node1', 'node2', 'node3',
+                                               'node9'])
+        self.assertEqual(['node1', 'node3'], forked)
+        self.assertEqual(manager.STARTED, results['node1'])
+        self.assertEqual(manager.ALREADY_RUNNING, results['node2'])
+        self.assertEqual(manager.STARTED, results['node3'])
+        self.assertIsInstance(results['node9'], exception.BMCNotFound)
+
+    @mock.patch.object(manager.PoorBMCManager, '_serve_pid', lambda s: 42)
+    @mock.patch.object(manager.supervisor, 'control', autospec=True)
+    def test_start_many_served(self, mock_control):
+        mock_control.return_value = {'node1': manager.STARTED,
+                                     'node2': {'error': 'port taken'}}
+        results = self.manager.start_many(['node1', 'node2', 'node9'])
+        mock_control.assert_called_once_with(
+            self.manager.control_path, 'start', timeout=manager.START_TIMEOUT,
+            bmcs=['node1', 'node2'])
+        self.assertEqual(manager.STARTED, results['node1'])
+        self.assertEqual('port taken', str(results['node2']))
+        self.assertIsInstance(results['node9'], exception.BMCNotFound)
+
+    @mock.patch.object(manager.PoorBMCManager, '_served',
+                       lambda s: (None, None))
+    def test_stop_many(self):
+        pid_path = os.path.join(self.config_dir, 'node3', 'pid')
+        with open(pid_path, 'w') as f:
+            f.write('12345')
+        running = {'node1': 41, 'node2': 42}
+
+        def signal_stop(bmc_name):
+            if bmc_name not in running:
+                raise exception.BMCNotFound(bmc=bmc_name)
+            return running[bmc_name]
+
+        with mock.patch.object(self.manager, '_running_pid',
+                               side_effect=running.get), \
+                mock.patch.object(self.manager, '_signal_stop',
+                                  side_effect=signal_stop), \
+                mock.patch.object(self.manager, '_wait_stopped',
+                                  autospec=True) as mock_wait:
+            results = self.manager.stop_many(['node1', 'node2', 'node3',
+                                              'node9'])
+        self.assertEqual(manager.STOPPED, results['node1'])
+        self.assertEqual(manager.STOPPED, results['node2'])
+        # Stale PID file
+        self.assertEqual(manager.NOT_RUNNING, results['node3'])
+        self.assertFalse(os.path.exists(pid_path))
+        self.assertIsInstance(results['node9'], exception.BMCNotFound)
+        # Signalled first, then waited for at once
+        mock_wait.assert_called_once_with({'node1': 41, 'node2': 42})
+
+    @mock.patch.object(manager.PoorBMCManager, '_served',
+                       lambda s: (42, {'node1': {}, 'node2': {}}))
+    @mock.patch.object(manager.supervisor, 'control', autospec=True)
+    def test_stop_many_served(self, mock_control):
+        mock_control.return_value = {'node1': manager.STOPPED,
+                                     'node2': manager.NOT_RUNNING}
+        with mock.patch.object(self.manager, '_running_pid',
+                               return_value=None):
+            results = self.manager.stop_many(['node1', 'node2', 'node3'])
+        mock_control.assert_called_once_with(
+            self.manager.control_path, 'stop',
+            timeout=manager.STATUS_TIMEOUT, bmcs=['node1', 'node2'])
+        self.assertEqual({'node1': manager.STOPPED,
+                          'node2': manager.NOT_RUNNING,
+                          'node3': manager.NOT_RUNNING}, results)
+
+    @mock.patch.object(manager, 'STOP_TIMEOUT', 0)
+    @mock.patch.object(manager.os, 'kill', autospec=True)
+    def test_wait_stopped_kill(self, mock_kill):
+        with mock.patch.dict(manager.CONF['power'], {'drain_timeout': 0}), \
+                mock.patch.object(self.manager, '_is_running',
+                                  side_effect=lambda name, pid: pid == 41):
+            self.manager._wait_stopped({'node1': 41, 'node2': 42})
+        mock_kill.assert_called_once_with(41, manager.signal.SIGKILL)
@@ -0,0 +1,105 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+import mock
+from six.moves import urllib
+
+from poorbmc import metrics
+from poorbmc.tests.unit import base
+
+
+class MetricsTestCase(base.TestCase):
+
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        patcher = mock.patch.object(metrics, '_registry', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_counter(self):
+        counter = metrics.Counter('requests_total', 'Requests.', ('pdu',))
+        counter.inc('pdu1')
+        counter.add(2, 'pdu1')
+        counter.inc('pdu"2')
+        self.assertEqual('# HELP requests_total Requests.\n'
+                         '# TYPE requests_total counter\n'
+                         'requests_total{pdu="pdu\\"2"} 1\n'
+                         'requests_total{pdu="pdu1"} 3',
+                         counter.expose())
+
+    def test_gauge(self):
+        gauge = metrics.Gauge('depth', 'Depth.')
+        gauge.set(2.5)
+        self.assertEqual([('depth', (), (), 2.5)], list(gauge.samples()))
+
+    def test_gauge_collect(self):
+        gauge = metrics.Gauge('depth', 'Depth.', ('pdu',),
+                              collect=lambda: [(['pdu2'], 1), (['pdu1'], 0)])
+        self.assertEqual([('depth', ('pdu',), ('pdu1',), 0),
+                          ('depth', ('pdu',), ('pdu2',), 1)],
+                         list(gauge.samples()))
+
+    def test_gauge_collect_error(self):
+        gauge = metrics.Gauge('depth', 'Depth.',
+                              collect=mock.Mock(side_effect=ValueError()))
+        self.assertEqual('# HELP depth Depth.\n# TYPE depth gauge',
+                         gauge.expose())
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('seconds', 'Seconds.', ('op',),
+                                      buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.7, 5):
+            histogram.observe(value, 'GET')
+        self.assertEqual(
+            ['seconds_bucket{op="GET",le="0.1"} 1',
+             'seconds_bucket{op="GET",le="1.0"} 3',
+             'seconds_bucket{op="GET",le="+Inf"} 4',
+             'seconds_sum{op="GET"} 6.25',
+             'seconds_count{op="GET"} 4'],
+            histogram.expose().split('\n')[2:])
+
+    def test_expose(self):
+        metrics.Counter('a_total', 'A.').inc()
+        metrics.Gauge('b', 'B.').set(1)
+        self.assertEqual('# HELP a_total A.\n# TYPE a_total counter\n'
+                         'a_total 1\n'
+                         '# HELP b B.\n# TYPE b gauge\nb 1\n',
+                         metrics.expose())
+
+
+class MetricsServerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(MetricsServerTestCase, self).setUp()
+        patcher = mock.patch.object(metrics, '_registry', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.Counter('a_total', 'A.').inc()
+        server = metrics.start_server('127.0.0.1', 0)
+        self.addCleanup(metrics.stop_server)
+        self.url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    def test_scrape(self):
+        response = urllib.request.urlopen(self.url + '/metrics', timeout=5)
+        self.assertEqual(metrics.CONTENT_TYPE,
+                         response.headers['Content-Type'])
+        self.assertIn(b'a_total 1\n', response.read())
+
+    def test_not_found(self):
+        error = self.assertRaises(urllib.error.HTTPError,
+                                  urllib.request.urlopen,
+                                  self.url + '/other', timeout=5)
+        self.assertEqual(404, error.code)
+
+    def test_single_server(self):
+        self.assertIs(metrics._server, metrics.start_server('127.0.0.1', 0))
@@ -0,0 +1,97 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import fixtures
+import mock
+
+from poorbmc import pbmc
+from poorbmc import snmp
+from poorbmc.tests.unit import base
+
+states = snmp.states
+
+
+class GetPowerStateTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetPowerStateTestCase, self).setUp()
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        patcher = mock.patch.dict(pbmc.CONF['default'],
+                                  {'config_dir': tmpdir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Do not bind the IPMI socket
+        self.useFixture(fixtures.MockPatchObject(pbmc.bmc.Bmc, '__init__',
+                                                 return_value=None))
+        self.mock_state = self.useFixture(fixtures.MockPatchObject(
+            snmp.SNMPDriverSimulated, 'power_state',
+            return_value=states.POWER_ON)).mock
+        self.executor = mock.Mock()
+        self.useFixture(fixtures.MockPatchObject(
+            pbmc.cache.power, 'get_refresh_executor',
+            return_value=self.executor))
+        self.pbmc = pbmc.PoorBMC('admin', 'password', port=623,
+                                 address='::', bmc_name='node1',
+                                 snmp_address='192.0.2.1', snmp_outlet=1,
+                                 snmp_community='public', snmp_port=161,
+                                 snmp_driver='simulated')
+
+    def test_miss_busy(self):
+        self.assertEqual(pbmc.IPMI_COMMAND_NODE_BUSY,
+                         self.pbmc.get_power_state())
+        # The PDU is read off the IPMI loop
+        self.assertFalse(self.mock_state.called)
+        self.assertEqual(1, self.executor.submit.call_count)
+
+    def test_refreshed(self):
+        self.pbmc.get_power_state()
+        func, args = (self.executor.submit.call_args[0][0],
+                      self.executor.submit.call_args[0][1:])
+        func(*args)
+        self.assertEqual(pbmc.POWERON, self.pbmc.get_power_state())
+        self.assertEqual(1, self.mock_state.call_count)
+
+    def test_refresh_failed_busy(self):
+        self.mock_state.side_effect = snmp.exception.SNMPFailure('boom')
+        self.pbmc.get_power_state()
+        func, args = (self.executor.submit.call_args[0][0],
+                      self.executor.submit.call_args[0][1:])
+        func(*args)
+        self.assertEqual(pbmc.IPMI_COMMAND_NODE_BUSY,
+                         self.pbmc.get_power_state())
+        # Another refresh started
+        self.assertEqual(2, self.executor.submit.call_count)
+
+    def test_metrics(self):
+        def value(metric, *labels):
+            return metric._values.get(('node1',) + labels, 0)
+
+        busy = value(pbmc.IPMI_BUSY, 'get_power_state')
+        misses = value(pbmc.cache.CACHE_READS, pbmc.cache.MISS)
+        self.pbmc.get_power_state()
+        self.assertEqual(busy + 1, value(pbmc.IPMI_BUSY, 'get_power_state'))
+        self.assertEqual(misses + 1,
+                         value(pbmc.cache.CACHE_READS, pbmc.cache.MISS))
+        self.assertTrue(value(pbmc.IPMI_REQUEST_SECONDS, 'get_power_state'))
+
+
+class CheckPyghmiTestCase(base.TestCase):
+
+    def test_supported(self):
+        pbmc.check_pyghmi()
+
+    @mock.patch.object(pbmc, 'PYGHMI_INTERNALS',
+                       ('iosockets', 'Session.gone', 'gone.too'))
+    def test_missing(self):
+        self.assertRaisesRegex(pbmc.exception.PoorBMCError,
+                               'lacks Session.gone, gone.too',
+                               pbmc.check_pyghmi)
@@ -0,0 +1,205 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+import mock
+
+from poorbmc import exception
+from poorbmc import power
+from poorbmc import snmp
+from poorbmc.tests.unit import base
+
+states = snmp.states
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() >= deadline:
+            raise AssertionError('Timed out waiting for %r' % condition)
+        time.sleep(0.001)
+
+
+class OutletPowerControlTestCase(base.TestCase):
+
+    def setUp(self):
+        super(OutletPowerControlTestCase, self).setUp()
+        self.driver = self._driver()
+        self.on_result = mock.Mock()
+        self.control = power.OutletPowerControl(self.driver,
+                                                on_result=self.on_result)
+
+    def _driver(self):
+        driver = mock.Mock(snmp_info={'address': '192.0.2.1', 'outlet': 1},
+                           native_reboot=False)
+        driver.stagger.reserve.side_effect = (
+            lambda interval, earliest: earliest)
+        driver.confirm_power_on.return_value = states.POWER_ON
+        driver.confirm_power_off.return_value = states.POWER_OFF
+        return driver
+
+    def _wait_idle(self, control=None):
+        control = control or self.control
+        _wait_for(lambda: control.in_flight is None)
+
+    def test_power_on(self):
+        future = self.control.power_on()
+        self.assertEqual(states.POWER_ON, future.result(5))
+        self._wait_idle()
+        self.driver.send_power_on.assert_called_once_with()
+        self.driver.stagger.reserve.assert_called_once_with(None,
+                                                            mock.ANY)
+        self.on_result.assert_called_once_with(states.POWER_ON)
+
+    def test_power_off_not_staggered(self):
+        self.assertEqual(states.POWER_OFF,
+                         self.control.power_off().result(5))
+        self.driver.send_power_off.assert_called_once_with()
+        self.assertFalse(self.driver.stagger.reserve.called)
+
+    @mock.patch.object(power.snmp, 'reboot_delay', 0.05)
+    def test_power_reset(self):
+        start = time.time()
+        self.assertEqual(states.POWER_ON,
+                         self.control.power_reset(2.0).result(5))
+        self.driver.send_power_off.assert_called_once_with()
+        self.driver.send_power_on.assert_called_once_with()
+        self.assertFalse(self.driver.send_power_reset.called)
+        # Switched on again reboot_delay seconds later, in a slot
+        interval, earliest = self.driver.stagger.reserve.call_args[0]
+        self.assertEqual(2.0, interval)
+        self.assertGreaterEqual(earliest, start + 0.05)
+
+    def test_power_reset_not_off(self):
+        self.driver.confirm_power_off.return_value = states.ERROR
+        self.assertEqual(states.ERROR,
+                         self.control.power_reset().result(5))
+        self.assertFalse(self.driver.send_power_on.called)
+
+    def test_native_reset_staggered(self):
+        self.driver.native_reboot = True
+        self.driver.confirm_power_reset.return_value = states.POWER_ON
+        self.assertEqual(states.POWER_ON,
+                         self.control.power_reset(2.0).result(5))
+        self.driver.send_power_reset.assert_called_once_with()
+        self.driver.confirm_power_reset.assert_called_once_with(2.0)
+        self.driver.stagger.reserve.assert_called_once_with(2.0, mock.ANY)
+
+    def test_in_flight(self):
+        confirmed = threading.Event()
+        self.driver.confirm_power_on.side_effect = (
+            lambda: confirmed.wait(5) and states.POWER_ON)
+        future = self.control.power_on()
+        self.assertEqual(power.POWERING_ON, self.control.in_flight)
+        self.assertRaises(exception.PoorBMCError, self.control.power_off)
+        confirmed.set()
+        future.result(5)
+        self._wait_idle()
+        self.assertFalse(self.driver.send_power_off.called)
+
+    def test_send_failure(self):
+        self.driver.send_power_on.side_effect = exception.SNMPFailure(
+            operation='SET', error='boom')
+        future = self.control.power_on()
+        self.assertRaises(exception.SNMPFailure, future.result, 5)
+        self._wait_idle()
+        self.on_result.assert_called_once_with(None)
+        self.assertFalse(self.driver.confirm_power_on.called)
+
+    def test_confirm_failure(self):
+        self.driver.confirm_power_on.side_effect = exception.SNMPFailure(
+            operation='GET', error='boom')
+        self.control.power_on()
+        _wait_for(lambda: self.on_result.called)
+        self.on_result.assert_called_once_with(None)
+
+    def test_not_sent_by_caller(self):
+        # Even when the slot is due, the SET is not sent by the caller
+        # (the IPMI loop)
+        callers = []
+        self.driver.send_power_off.side_effect = (
+            lambda: callers.append(threading.current_thread()))
+        self.control.power_off().result(5)
+        self.assertNotIn(threading.current_thread(), callers)
+
+    def test_staggered(self):
+        sent = threading.Event()
+        self.driver.stagger.reserve.side_effect = (
+            lambda interval, earliest: time.time() + 0.1)
+        self.driver.send_power_on.side_effect = lambda: sent.set()
+        future = self.control.power_on()
+        self.assertFalse(sent.is_set())
+        self.assertEqual(power.POWERING_ON, self.control.in_flight)
+        self.assertEqual(states.POWER_ON, future.result(5))
+        self.driver.send_power_on.assert_called_once_with()
+
+    @mock.patch.dict(power._executors, clear=True)
+    def test_staggered_not_behind_confirmations(self):
+        with mock.patch.dict(power.CONF['power'], {'workers': 1}):
+            # The only confirmation worker is busy with another outlet
+            release = threading.Event()
+            busy = self._driver()
+            busy.confirm_power_off.side_effect = (
+                lambda: release.wait(5) and states.POWER_OFF)
+            busy_control = power.OutletPowerControl(busy)
+            busy_future = busy_control.power_off()
+            _wait_for(lambda: busy.confirm_power_off.called)
+
+            sent = threading.Event()
+            self.driver.stagger.reserve.side_effect = (
+                lambda interval, earliest: time.time() + 0.05)
+            self.driver.send_power_on.side_effect = lambda: sent.set()
+            future = self.control.power_on()
+            try:
+                # Sent in its slot all the same
+                self.assertTrue(sent.wait(5))
+                self.assertFalse(future.done())
+            finally:
+                release.set()
+            self.assertEqual(states.POWER_OFF, busy_future.result(5))
+            self.assertEqual(states.POWER_ON, future.result(5))
+
+
+class TimerTestCase(base.TestCase):
+
+    def test_order(self):
+        timer = power._Timer()
+        called = []
+        done = threading.Event()
+        now = time.time()
+        timer.call_at(now + 0.06, lambda: (called.append(3), done.set()))
+        timer.call_at(now + 0.02, called.append, 1)
+        timer.call_at(now + 0.04, called.append, 2)
+        self.assertTrue(done.wait(5))
+        self.assertEqual([1, 2, 3], called)
+
+    def test_error(self):
+        timer = power._Timer()
+        done = threading.Event()
+        timer.call_at(time.time(), mock.Mock(side_effect=Exception('boom')))
+        timer.call_at(time.time(), done.set)
+        self.assertTrue(done.wait(5))
+
+
+class DrainTestCase(base.TestCase):
+
+    def test_drain(self):
+        release = threading.Event()
+        driver = mock.Mock(snmp_info={'address': '192.0.2.1', 'outlet': 1})
+        driver.confirm_power_off.side_effect = (
+            lambda: release.wait(5) and states.POWER_OFF)
+        power.OutletPowerControl(driver).power_off()
+        self.assertEqual(1, power.drain(0.01))
+        release.set()
+        self.assertEqual(0, power.drain(5))
@@ -0,0 +1,110 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from poorbmc import exception
+from poorbmc import scheduler
+from poorbmc import snmp
+from poorbmc.tests.unit import base
+
+states = snmp.states
+
+
+class PowerSchedulerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PowerSchedulerTestCase, self).setUp()
+        for patcher in (
+                mock.patch.dict(snmp._simulated_pdus, clear=True),
+                mock.patch.dict(snmp._staggers, clear=True),
+                mock.patch.dict(snmp.CONF['simulated'], {
+                    'latency': 0, 'switch_delay': 0, 'reboot_time': 0,
+                    'failure_rate': 0, 'stuck_outlets': set(),
+                    'initial_state': 'off'}),
+                mock.patch.object(snmp.SNMPDriverBase,
+                                  'poll_initial_interval', 0.01),
+                mock.patch.object(snmp, 'power_timeout', 0.3),
+                mock.patch.object(snmp, 'reboot_start_timeout', 0.05)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _drivers(self, pdus=1, outlets=3):
+        drivers = {}
+        for pdu in range(pdus):
+            for outlet in range(1, outlets + 1):
+                drivers['node%d-%d' % (pdu, outlet)] = (
+                    snmp.SNMPDriverSimulated({
+                        'address': '192.0.2.%d' % (pdu + 1),
+                        'port': snmp.SNMP_PORT,
+                        'outlet': outlet}))
+        return drivers
+
+    def test_power_on(self):
+        drivers = self._drivers(pdus=2)
+        results = scheduler.PowerScheduler(0).run(scheduler.POWER_ON,
+                                                  drivers)
+        self.assertEqual(dict((name, states.POWER_ON) for name in drivers),
+                         results)
+
+    def test_power_off(self):
+        drivers = self._drivers()
+        scheduler.PowerScheduler(0).run(scheduler.POWER_ON, drivers)
+        results = scheduler.PowerScheduler(0).run(scheduler.POWER_OFF,
+                                                  drivers)
+        self.assertEqual(dict((name, states.POWER_OFF) for name in drivers),
+                         results)
+
+    def test_power_reset(self):
+        drivers = self._drivers()
+        results = scheduler.PowerScheduler(0).run(scheduler.POWER_RESET,
+                                                  drivers)
+        self.assertEqual(dict((name, states.POWER_ON) for name in drivers),
+                         results)
+
+    def test_stuck_outlet(self):
+        snmp.CONF['simulated']['stuck_outlets'] = set([2])
+        results = scheduler.PowerScheduler(0).run(scheduler.POWER_ON,
+                                                  self._drivers())
+        self.assertEqual(states.POWER_ON, results['node0-1'])
+        self.assertEqual(states.POWER_ON, results['node0-3'])
+        self.assertIsInstance(results['node0-2'], exception.PoorBMCError)
+        self.assertIn('was not confirmed', str(results['node0-2']))
+
+    def test_send_failure(self):
+        snmp.CONF['simulated']['failure_rate'] = 1
+        results = scheduler.PowerScheduler(0).run(scheduler.POWER_ON,
+                                                  self._drivers())
+        for result in results.values():
+            self.assertIsInstance(result, exception.SNMPFailure)
+
+    def test_unknown_action(self):
+        self.assertRaises(exception.PoorBMCError,
+                          scheduler.PowerScheduler(0).run, 'cycle',
+                          self._drivers())
+
+    def test_staggered_per_pdu(self):
+        drivers = self._drivers(pdus=2)
+        with mock.patch.object(snmp._Stagger, 'wait',
+                               autospec=True) as mock_wait:
+            scheduler.PowerScheduler(2.5).run(scheduler.POWER_ON, drivers)
+        self.assertEqual(6, mock_wait.call_count)
+        mock_wait.assert_called_with(mock.ANY, 2.5)
+        # One stagger per PDU
+        self.assertEqual(2, len(set(call[0][0]
+                                    for call in mock_wait.call_args_list)))
+
+    def test_power_off_not_staggered(self):
+        with mock.patch.object(snmp._Stagger, 'wait') as mock_wait:
+            scheduler.PowerScheduler(2.5).run(scheduler.POWER_OFF,
+                                              self._drivers())
+        self.assertFalse(mock_wait.called)
@@ -0,0 +1,276 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from concurrent import futures
+import socket
+import threading
+import time
+
+import fixtures
+import mock
+
+from poorbmc import exception
+from poorbmc import manager as pbmc_manager
+from poorbmc import server
+from poorbmc import snmp
+from poorbmc.tests.unit import base
+
+states = snmp.states
+
+
+def _future(result=None, error=None):
+    future = futures.Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+class PoorBMCServerControlTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PoorBMCServerControlTestCase, self).setUp()
+        self.manager = mock.Mock()
+        self.manager._bmc_names.return_value = ['node1', 'node2', 'node3']
+        self.server = server.PoorBMCServer(self.manager)
+        # Run the calls right away instead of on the IPMI loop
+        self.server._call = lambda func, *args: func(*args)
+        self.node1 = mock.Mock()
+        self.node2 = mock.Mock()
+        self.server.bmcs = {'node1': self.node1, 'node2': self.node2}
+
+    def test_status(self):
+        self.server._unanswered['node2'] = 3
+        self.server._failed['node3'] = (0, 'port taken', None)
+        self.server._restarts['node3'] = 2
+        status = self.server._handle_control({'command': 'status'})
+        self.assertEqual({
+            'node1': {'status': pbmc_manager.RUNNING, 'restarts': 0},
+            'node2': {'status': pbmc_manager.UNRESPONSIVE, 'restarts': 0},
+            'node3': {'status': pbmc_manager.DOWN, 'restarts': 2,
+                      'error': 'port taken', 'restart_in': 0},
+        }, status['bmcs'])
+
+    def test_start(self):
+        self.server.add = mock.Mock(return_value=None)
+        results = self.server._handle_control(
+            {'command': 'start', 'bmcs': ['node1', 'node3', 'node9']})
+        self.assertEqual(pbmc_manager.ALREADY_RUNNING, results['node1'])
+        self.assertEqual(pbmc_manager.STARTED, results['node3'])
+        self.assertIn('error', results['node9'])
+        self.server.add.assert_called_once_with('node3')
+
+    def test_stop(self):
+        self.server.remove = mock.Mock()
+        results = self.server._handle_control(
+            {'command': 'stop', 'bmcs': ['node1', 'node3']})
+        self.assertEqual({'node1': pbmc_manager.STOPPED,
+                          'node3': pbmc_manager.NOT_RUNNING}, results)
+        self.server.remove.assert_called_once_with('node1')
+        # Not started again by the rescans
+        self.assertEqual(set(['node1', 'node3']), self.server._stopped)
+
+    def test_power(self):
+        self.node1.power.power_on.return_value = _future(states.POWER_ON)
+        self.node2.power.power_on.return_value = _future(states.ERROR)
+        results = self.server._handle_control(
+            {'command': 'power', 'action': 'on', 'interval': 2.0,
+             'bmcs': ['node1', 'node2', 'node3']})
+        self.node1.power.power_on.assert_called_once_with(2.0)
+        self.assertEqual(states.POWER_ON, results['node1'])
+        self.assertIn('was not confirmed', results['node2']['error'])
+        # Left for the caller to switch
+        self.assertNotIn('node3', results)
+
+    def test_power_errors(self):
+        self.node1.power.power_reset.side_effect = exception.PoorBMCError(
+            'Can not start resetting, powering on is in progress')
+        self.node2.power.power_reset.return_value = _future(
+            error=exception.SNMPFailure(operation='GET', error='boom'))
+        results = self.server._handle_control(
+            {'command': 'power', 'action': 'reset',
+             'bmcs': ['node1', 'node2']})
+        self.assertIn('in progress', results['node1']['error'])
+        self.assertIn('boom', results['node2']['error'])
+
+    def test_power_unknown_action(self):
+        self.assertRaises(exception.PoorBMCError,
+                          self.server._handle_control,
+                          {'command': 'power', 'action': 'cycle',
+                           'bmcs': ['node1']})
+
+    def test_unknown_command(self):
+        self.assertRaises(exception.PoorBMCError,
+                          self.server._handle_control, {'command': 'foo'})
+
+
+class PoorBMCServerProbeTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PoorBMCServerProbeTestCase, self).setUp()
+        patcher = mock.patch.dict(server.CONF['serve'],
+                                  {'probe_failures': 2})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = server.PoorBMCServer(mock.Mock())
+        self.server._call = lambda func, *args: func(*args)
+        self.node1 = mock.Mock()
+        self.node2 = mock.Mock()
+        self.server.bmcs = {'node1': self.node1, 'node2': self.node2}
+        self.server._endpoints = {'node1': ('::', 6231),
+                                  'node2': ('::', 6232)}
+        self.server._fail = mock.Mock()
+
+    def test_probed(self):
+        bmcs = self.server.bmcs.copy()
+        self.server._probed(bmcs, set([('::', 6231)]))
+        self.assertEqual({'node2': 1}, self.server._unanswered)
+        self.server._probed(bmcs, set([('::', 6231)]))
+        self.server._fail.assert_called_once_with(
+            'node2', 'not answering IPMI requests')
+        self.node2.close.assert_called_once_with()
+        self.assertEqual(['node1'], list(self.server.bmcs))
+        self.assertFalse(self.node1.close.called)
+
+    def test_probed_answered(self):
+        bmcs = self.server.bmcs.copy()
+        self.server._probed(bmcs, set())
+        self.server._probed(bmcs, set([('::', 6231), ('::', 6232)]))
+        self.assertEqual({}, self.server._unanswered)
+        self.server._probed(bmcs, set())
+        self.assertFalse(self.server._fail.called)
+
+    def _probe_forever(self, answered, heartbeat):
+        self.server._probing = mock.Mock()
+        self.server._probing.wait.side_effect = [False, True]
+        self.server._heartbeat = heartbeat
+        self.server._probed = mock.Mock()
+        with mock.patch.object(server.supervisor, 'probe',
+                               return_value=answered) as mock_probe:
+            self.server._probe_forever()
+        mock_probe.assert_called_once_with(
+            mock.ANY, server.CONF['serve']['probe_timeout'])
+        self.assertEqual(set([('::', 6231), ('::', 6232)]),
+                         set(mock_probe.call_args[0][0]))
+
+    def test_probe_forever(self):
+        # The IPMI loop went on while the probe was out
+        self._probe_forever(set(), heartbeat=time.time() + 60)
+        self.server._probed.assert_called_once_with(
+            {'node1': self.node1, 'node2': self.node2}, set())
+
+    def test_probe_forever_answered(self):
+        # Some BMCs answered, so the loop is running
+        self._probe_forever(set([('::', 6231)]), heartbeat=0)
+        self.server._probed.assert_called_once_with(
+            mock.ANY, set([('::', 6231)]))
+
+    def test_probe_forever_loop_busy(self):
+        self._probe_forever(set(), heartbeat=time.time() - 60)
+        # Not held against the BMCs
+        self.assertFalse(self.server._probed.called)
+
+
+def _free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class PoorBMCServerServeTestCase(base.TestCase):
+    """Serve simulated BMCs behind a PDU that does not answer in time."""
+
+    SLOW_PDU = '192.0.2.1'
+
+    def setUp(self):
+        super(PoorBMCServerServeTestCase, self).setUp()
+        config_dir = self.useFixture(fixtures.TempDir()).path
+        conf = server.CONF
+        for patcher in (
+                mock.patch.dict(conf['default'], {'config_dir': config_dir}),
+                mock.patch.dict(conf['serve'], {
+                    'probe_interval': 0.1, 'probe_timeout': 0.2,
+                    'probe_failures': 2}),
+                mock.patch.dict(conf['simulated'], {
+                    'latency': 0, 'switch_delay': 0, 'reboot_time': 0,
+                    'failure_rate': 0, 'stuck_outlets': set(),
+                    'initial_state': 'off'}),
+                # Every request takes longer than the probes have to be
+                # answered
+                mock.patch.dict(conf._conf_dict, {
+                    'simulated:%s' % self.SLOW_PDU: {'latency': 0.5}}),
+                mock.patch.dict(snmp._simulated_pdus, clear=True),
+                mock.patch.dict(snmp._staggers, clear=True),
+                mock.patch.object(snmp.SNMPDriverBase,
+                                  'poll_initial_interval', 0.01),
+                mock.patch.object(server.signal, 'signal')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.manager = pbmc_manager.PoorBMCManager()
+        self.manager.add_many([
+            self._bmc('slow', self.SLOW_PDU, 1),
+            self._bmc('fast1', '192.0.2.2', 1),
+            self._bmc('fast2', '192.0.2.2', 2)])
+        self.server = server.PoorBMCServer(self.manager)
+
+    def _bmc(self, bmc_name, snmp_address, outlet):
+        return {'username': 'admin', 'password': 'password',
+                'port': _free_port(), 'address': '127.0.0.1',
+                'bmc_name': bmc_name, 'snmp_address': snmp_address,
+                'snmp_outlet': outlet, 'snmp_community': 'public',
+                'snmp_port': 161, 'snmp_driver': 'simulated'}
+
+    def _exercise(self, results):
+        try:
+            deadline = time.time() + 5
+            while len(self.server.bmcs) < 3 and time.time() < deadline:
+                time.sleep(0.05)
+            results['bmcs'] = self.server.bmcs.copy()
+            results['power'] = self.server._handle_control(
+                {'command': 'power', 'action': 'on',
+                 'bmcs': ['slow', 'fast1', 'fast2']})
+            # Read the power states as IPMI clients would, for long enough
+            # to send many probes
+            end = time.time() + 1.5
+            while time.time() < end:
+                for pbmc in results['bmcs'].values():
+                    self.server._call(pbmc.get_power_state)
+                time.sleep(0.05)
+            results['status'] = self.server._call(self.server.status)
+        except Exception as e:
+            results['error'] = e
+        finally:
+            self.server._running = False
+            self.server._wake()
+
+    def test_slow_pdu(self):
+        results = {}
+        thread = threading.Thread(target=self._exercise, args=(results,))
+        thread.start()
+        self.server.serve(timeout=0.1, rescan_interval=60)
+        thread.join()
+
+        self.assertNotIn('error', results)
+        self.assertEqual(dict((bmc_name, states.POWER_ON)
+                              for bmc_name in ('slow', 'fast1', 'fast2')),
+                         results['power'])
+        self.assertEqual(
+            dict((bmc_name, {'status': pbmc_manager.RUNNING,
+                             'restarts': 0})
+                 for bmc_name in ('slow', 'fast1', 'fast2')),
+            results['status']['bmcs'])
+        self.assertEqual({}, self.server._failed)
@@ -0,0 +1,1223 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import binascii
+import contextlib
+import threading
+import time
+
+import mock
+
+from poorbmc import snmp
+from poorbmc.tests.unit import base
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() >= deadline:
+            raise AssertionError('Timed out waiting for %r' % condition)
+        time.sleep(0.001)
+
+
+class RTTEstimatorTestCase(base.TestCase):
+
+    def setUp(self):
+        super(RTTEstimatorTestCase, self).setUp()
+        self.rtt = snmp.RTTEstimator()
+
+    def test_initial_timeout(self):
+        self.assertIsNone(self.rtt.srtt)
+        self.assertEqual(snmp.udp_transport_timeout, self.rtt.timeout)
+
+    def test_first_sample(self):
+        self.rtt.sample(0.1)
+        self.assertAlmostEqual(0.1, self.rtt.srtt)
+        self.assertAlmostEqual(0.05, self.rtt.rttvar)
+        # SRTT + 4 * RTTVAR
+        self.assertAlmostEqual(0.3, self.rtt.timeout)
+
+    def test_smoothed(self):
+        self.rtt.sample(0.1)
+        self.rtt.sample(0.5)
+        self.assertAlmostEqual(0.15, self.rtt.srtt)
+        self.assertAlmostEqual(0.1375, self.rtt.rttvar)
+        self.assertAlmostEqual(0.7, self.rtt.timeout)
+
+    def test_timeout_min(self):
+        self.rtt.sample(0.001)
+        self.assertEqual(snmp.udp_transport_timeout_min, self.rtt.timeout)
+
+    def test_backoff(self):
+        self.rtt.sample(0.1)
+        self.rtt.backoff()
+        self.assertAlmostEqual(0.6, self.rtt.timeout)
+        for _ in range(10):
+            self.rtt.backoff()
+        self.assertEqual(snmp.udp_transport_timeout_max, self.rtt.timeout)
+
+    def test_sample_after_backoff(self):
+        self.rtt.sample(0.1)
+        self.rtt.backoff()
+        self.rtt.sample(0.1)
+        self.assertLess(self.rtt.timeout, 0.6)
+
+
+def _answer(value=1):
+    return None, 0, 0, [('1.3.6.1', value)]
+
+
+def _timed_out():
+    return snmp.errind.RequestTimedOut(), 0, 0, []
+
+
+@mock.patch.object(snmp, 'udp_transport_retries', 2)
+class SNMPClientCommandTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SNMPClientCommandTestCase, self).setUp()
+        self.client = snmp.SNMPClient('192.0.2.1', 161, snmp.SNMP_V1,
+                                      community='public')
+        self.cmd_gen = mock.Mock()
+        self.created = False
+
+        @contextlib.contextmanager
+        def engine():
+            yield self.cmd_gen, self.created
+
+        self.client._engines.engine = engine
+        self.client._get_auth = mock.Mock()
+        # The transport stands for its timeout
+        self.client._get_transport = mock.Mock(
+            side_effect=lambda timeout: timeout)
+        self.client.rtt = mock.Mock(timeout=1.0)
+
+    def test_sampled(self):
+        self.cmd_gen.getCmd.return_value = _answer()
+        self.assertEqual(_answer(), self.client._command('GET', 'getCmd'))
+        self.assertEqual(1, self.client.rtt.sample.call_count)
+        self.assertFalse(self.client.rtt.backoff.called)
+
+    def test_retried_not_sampled(self):
+        # Karn's algorithm: the answer may be to either request
+        self.cmd_gen.getCmd.side_effect = [_timed_out(), _answer()]
+        self.assertEqual(_answer(), self.client._command('GET', 'getCmd'))
+        self.assertEqual(2, self.cmd_gen.getCmd.call_count)
+        self.assertEqual(1, self.client.rtt.backoff.call_count)
+        self.assertFalse(self.client.rtt.sample.called)
+
+    def test_metrics(self):
+        def value(metric):
+            return metric._values.get(('192.0.2.1', 'GET'), 0)
+
+        def answered():
+            # The count of the latency histogram
+            data = value(snmp.SNMP_REQUEST_SECONDS)
+            return sum(data[0]) if data else 0
+
+        timeouts = value(snmp.SNMP_TIMEOUTS)
+        retries = value(snmp.SNMP_RETRIES)
+        before = answered()
+        self.cmd_gen.getCmd.side_effect = [_timed_out(), _answer()]
+        self.client._command('GET', 'getCmd')
+        self.assertEqual(timeouts + 1, value(snmp.SNMP_TIMEOUTS))
+        self.assertEqual(retries + 1, value(snmp.SNMP_RETRIES))
+        self.assertEqual(before + 1, answered())
+
+    def test_new_engine_not_sampled(self):
+        # The first request of an engine includes its discovery
+        self.created = True
+        self.cmd_gen.getCmd.return_value = _answer()
+        self.client._command('GET', 'getCmd')
+        self.assertFalse(self.client.rtt.sample.called)
+
+    def test_not_sampled_if_asked(self):
+        self.cmd_gen.getCmd.return_value = _answer()
+        self.client._command('GET', 'getCmd', sample_rtt=False)
+        self.assertFalse(self.client.rtt.sample.called)
+
+    def test_all_timed_out(self):
+        self.cmd_gen.getCmd.return_value = _timed_out()
+        results = self.client._command('GET', 'getCmd')
+        self.assertIsInstance(results[0], snmp.errind.RequestTimedOut)
+        self.assertEqual(3, self.cmd_gen.getCmd.call_count)
+        self.assertEqual(3, self.client.rtt.backoff.call_count)
+        self.assertFalse(self.client.rtt.sample.called)
+
+    @mock.patch('poorbmc.snmp.time')
+    def test_deadline(self, mock_time):
+        # The worst case against a PDU that stopped answering, with the
+        # default settings: its timeout already backed off to the maximum
+        clock = [100.0]
+        mock_time.time.side_effect = lambda: clock[0]
+
+        def get_cmd(auth, timeout, *args):
+            clock[0] += timeout
+            return _timed_out()
+
+        self.cmd_gen.getCmd.side_effect = get_cmd
+        self.client.rtt = snmp.RTTEstimator()
+        self.client.rtt.timeout = snmp.udp_transport_timeout_max
+        self.assertEqual(6.0, self.client.request_timeout)
+        with mock.patch.object(snmp, 'udp_transport_retries', 5):
+            results = self.client._command('GET', 'getCmd')
+        self.assertIsInstance(results[0], snmp.errind.RequestTimedOut)
+        self.assertLessEqual(clock[0] - 100, 6.0)
+        # The first attempt waits for the whole budget
+        self.assertEqual(1, self.cmd_gen.getCmd.call_count)
+
+    @mock.patch.object(snmp, 'udp_transport_retries', 5)
+    @mock.patch.object(snmp, 'udp_transport_timeout', 0.1)
+    def test_deadline_wall_time(self):
+        def get_cmd(auth, timeout, *args):
+            time.sleep(timeout)
+            return _timed_out()
+
+        self.cmd_gen.getCmd.side_effect = get_cmd
+        self.client.rtt = snmp.RTTEstimator()
+        self.client.request_timeout = 0.5
+        start = time.time()
+        self.client._command('GET', 'getCmd')
+        # 0.1 + 0.2 + 0.2 (of 0.4) instead of 0.1 + 0.2 + ... + 3.2
+        self.assertLess(time.time() - start, 0.7)
+        self.assertEqual(3, self.cmd_gen.getCmd.call_count)
+
+    def test_deadline_from_config(self):
+        with mock.patch.dict(snmp.CONF['pdu'], {'request_timeout': 2.5}):
+            client = snmp.SNMPClient('192.0.2.1', 161, snmp.SNMP_V1,
+                                     community='public')
+        self.assertEqual(2.5, client.request_timeout)
+
+
+@mock.patch.object(snmp.cmdgen, 'CommandGenerator')
+class EnginePoolTestCase(base.TestCase):
+
+    def test_reused(self, mock_cmdgen):
+        pool = snmp._EnginePool(2)
+        with pool.engine() as (first, created):
+            self.assertTrue(created)
+        with pool.engine() as (second, created):
+            self.assertFalse(created)
+        self.assertIs(first, second)
+        self.assertEqual(1, mock_cmdgen.call_count)
+
+    def test_concurrent(self, mock_cmdgen):
+        mock_cmdgen.side_effect = lambda: mock.Mock()
+        pool = snmp._EnginePool(2)
+        with pool.engine() as (first, _):
+            with pool.engine() as (second, created):
+                self.assertTrue(created)
+        self.assertIsNot(first, second)
+
+    def test_bounded(self, mock_cmdgen):
+        pool = snmp._EnginePool(1)
+        checked_out = []
+
+        def request():
+            with pool.engine() as (cmd_gen, _):
+                checked_out.append(cmd_gen)
+
+        with pool.engine():
+            thread = threading.Thread(target=request)
+            thread.start()
+            time.sleep(0.05)
+            # Waiting for the only engine
+            self.assertEqual([], checked_out)
+        thread.join()
+        self.assertEqual(1, len(checked_out))
+        self.assertEqual(1, mock_cmdgen.call_count)
+
+
+@mock.patch.dict(snmp._clients, clear=True)
+class GetClientTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetClientTestCase, self).setUp()
+        self.info = {'address': '192.0.2.1', 'port': 161,
+                     'version': snmp.SNMP_V1, 'community': 'public'}
+
+    def test_shared_by_outlets(self):
+        client = snmp._get_client(dict(self.info, outlet=1))
+        self.assertIs(client, snmp._get_client(dict(self.info, outlet=2)))
+
+    def test_per_credentials(self):
+        client = snmp._get_client(self.info)
+        self.assertIsNot(client, snmp._get_client(
+            dict(self.info, community='private')))
+        self.assertIsNot(client, snmp._get_client(
+            dict(self.info, port=1161)))
+
+    def test_drivers_share_client(self):
+        first = snmp.SNMPDriverAPCMasterSwitch(dict(self.info, outlet=1))
+        second = snmp.SNMPDriverAPCRackPDU(dict(self.info, outlet=2))
+        self.assertIs(first.client, second.client)
+
+    @mock.patch.object(snmp.cmdgen, 'CommunityData')
+    def test_auth_built_once(self, mock_community):
+        client = snmp._get_client(self.info)
+        self.assertIs(client._get_auth(), client._get_auth())
+        mock_community.assert_called_once_with('public', mpModel=0)
+
+    @mock.patch.object(snmp.cmdgen, 'UdpTransportTarget')
+    def test_transport_per_timeout(self, mock_target):
+        mock_target.side_effect = lambda *args, **kwargs: mock.Mock()
+        client = snmp._get_client(self.info)
+        transport = client._get_transport(1.0)
+        self.assertIs(transport, client._get_transport(1.001))
+        self.assertIsNot(transport, client._get_transport(2.0))
+        mock_target.assert_called_with(('192.0.2.1', 161), timeout=2.0,
+                                       retries=0)
+
+
+@mock.patch.object(snmp, 'status_batch_window', 10)
+@mock.patch('poorbmc.snmp.time')
+class StatusCollectorTestCase(base.TestCase):
+
+    def setUp(self):
+        super(StatusCollectorTestCase, self).setUp()
+        self.client = mock.Mock(address='192.0.2.1')
+        self.client.get_many.side_effect = lambda oids: [
+            int(oid[-1]) for oid in oids]
+        self.collector = snmp._StatusCollector(self.client)
+        for outlet in range(1, 4):
+            self.collector.register((1, 3, outlet))
+
+    def test_batched(self, mock_time):
+        mock_time.time.return_value = 100
+        self.assertEqual(1, self.collector.get((1, 3, 1)))
+        self.assertEqual(2, self.collector.get((1, 3, 2)))
+        self.client.get_many.assert_called_once_with(
+            [(1, 3, 1), (1, 3, 2), (1, 3, 3)])
+        self.assertFalse(self.client.get.called)
+
+    @mock.patch.object(snmp, 'status_batch_size', 2)
+    def test_chunked(self, mock_time):
+        mock_time.time.return_value = 100
+        self.collector.get((1, 3, 1))
+        self.assertEqual([mock.call([(1, 3, 1), (1, 3, 2)]),
+                          mock.call([(1, 3, 3)])],
+                         self.client.get_many.call_args_list)
+
+    def test_expired(self, mock_time):
+        mock_time.time.return_value = 100
+        self.collector.get((1, 3, 1))
+        mock_time.time.return_value = 111
+        self.collector.get((1, 3, 1))
+        self.assertEqual(2, self.client.get_many.call_count)
+
+    def test_since(self, mock_time):
+        mock_time.time.return_value = 100
+        self.collector.get((1, 3, 1))
+        mock_time.time.return_value = 101
+        self.collector.get((1, 3, 1), since=100)
+        self.assertEqual(2, self.client.get_many.call_count)
+
+    def test_invalidate(self, mock_time):
+        mock_time.time.return_value = 100
+        self.collector.get((1, 3, 1))
+        self.collector.invalidate()
+        self.collector.get((1, 3, 1))
+        self.assertEqual(2, self.client.get_many.call_count)
+
+    def test_timeout_not_retried(self, mock_time):
+        mock_time.time.return_value = 100
+        self.client.get_many.side_effect = snmp.exception.SNMPTimeout(
+            operation='GET', error='timed out')
+        self.assertRaises(snmp.exception.SNMPTimeout,
+                          self.collector.get, (1, 3, 1))
+        # The other outlets fail right away, without a GET of their own
+        self.assertRaises(snmp.exception.SNMPTimeout,
+                          self.collector.get, (1, 3, 2))
+        self.assertEqual(1, self.client.get_many.call_count)
+        self.assertFalse(self.client.get.called)
+
+    def test_bad_oid(self, mock_time):
+        mock_time.time.return_value = 100
+        error = snmp.exception.SNMPFailure(operation='GET',
+                                           error='noSuchName')
+
+        def get_many(oids):
+            if (1, 3, 3) in oids:
+                raise error
+            return [int(oid[-1]) for oid in oids]
+
+        def get(oid):
+            if oid == (1, 3, 3):
+                raise error
+            return int(oid[-1])
+
+        self.client.get_many.side_effect = get_many
+        self.client.get.side_effect = get
+        # A good outlet falls back to a GET of its own
+        self.assertEqual(1, self.collector.get((1, 3, 1)))
+        self.client.get.assert_called_once_with((1, 3, 1))
+        # So does the bad one, which is then left out of the batches
+        self.assertRaises(snmp.exception.SNMPFailure,
+                          self.collector.get, (1, 3, 3))
+        self.assertEqual(2, self.collector.get((1, 3, 2)))
+        self.client.get_many.assert_called_with([(1, 3, 1), (1, 3, 2)])
+        self.assertEqual(2, self.client.get_many.call_count)
+        self.assertRaises(snmp.exception.SNMPFailure,
+                          self.collector.get, (1, 3, 3))
+        self.assertEqual(2, self.client.get_many.call_count)
+
+    def test_fallback_outside_lock(self, mock_time):
+        mock_time.time.return_value = 100
+        self.client.get_many.side_effect = snmp.exception.SNMPFailure(
+            operation='GET', error='noSuchName')
+        in_get = threading.Event()
+        release = threading.Event()
+
+        def get(oid):
+            in_get.set()
+            release.wait(5)
+            return 1
+
+        self.client.get.side_effect = get
+        thread = threading.Thread(target=self.collector.get,
+                                  args=((1, 3, 1),))
+        thread.start()
+        try:
+            self.assertTrue(in_get.wait(5))
+            # Not held while the first GET waits for the PDU
+            self.assertTrue(self.collector._lock.acquire(False))
+            self.collector._lock.release()
+        finally:
+            release.set()
+            thread.join()
+
+
+class SNMPClientGetTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SNMPClientGetTestCase, self).setUp()
+        self.client = snmp.SNMPClient('192.0.2.1', 161, snmp.SNMP_V1,
+                                      community='public')
+        self.client._command = mock.Mock()
+
+    def test_get_many(self):
+        self.client._command.return_value = (
+            None, 0, 0, [('1.3.1', 1), ('1.3.2', 2)])
+        self.assertEqual([1, 2], self.client.get_many(['1.3.1', '1.3.2']))
+        self.client._command.assert_called_once_with(
+            'GET', 'getCmd', '1.3.1', '1.3.2')
+
+    def test_timeout(self):
+        self.client._command.return_value = (
+            snmp.errind.RequestTimedOut(), 0, 0, [])
+        self.assertRaises(snmp.exception.SNMPTimeout,
+                          self.client.get_many, ['1.3.1'])
+        self.assertRaises(snmp.exception.SNMPTimeout,
+                          self.client.get, '1.3.1')
+
+    def test_error(self):
+        error_status = mock.Mock()
+        error_status.prettyPrint.return_value = 'noSuchName'
+        self.client._command.return_value = (None, error_status, 1, [])
+        error = self.assertRaises(snmp.exception.SNMPFailure,
+                                  self.client.get_many, ['1.3.1'])
+        self.assertNotIsInstance(error, snmp.exception.SNMPTimeout)
+        self.assertIn('noSuchName', str(error))
+
+
+class _CountingEvent(object):
+
+    def __init__(self, event):
+        self.event = event
+        self.waiters = 0
+
+    def set(self):
+        self.event.set()
+
+    def wait(self, timeout=None):
+        self.waiters += 1
+        return self.event.wait(timeout)
+
+
+def _count_waiters(flight, key):
+    call = flight._calls[key]
+    call.done = _CountingEvent(call.done)
+    return call.done
+
+
+class SingleFlightTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SingleFlightTestCase, self).setUp()
+        self.flight = snmp._SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+    def _func(self, value):
+        self.calls.append(value)
+        self.release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def _start(self, key, value, results):
+        def run():
+            try:
+                results.append(self.flight.do(key, self._func, value))
+            except Exception as e:
+                results.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_coalesce(self):
+        results = []
+        leader = self._start('key', 1, results)
+        _wait_for(lambda: self.calls)
+        done = _count_waiters(self.flight, 'key')
+        followers = [self._start('key', 2, results) for i in range(3)]
+        _wait_for(lambda: done.waiters == 3)
+        self.release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        self.assertEqual([1], self.calls)
+        self.assertEqual([1, 1, 1, 1], results)
+        self.assertEqual({}, self.flight._calls)
+
+    def test_shared_error(self):
+        error = ValueError('boom')
+        results = []
+        leader = self._start('key', error, results)
+        _wait_for(lambda: self.calls)
+        done = _count_waiters(self.flight, 'key')
+        follower = self._start('key', 2, results)
+        _wait_for(lambda: done.waiters == 1)
+        self.release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual([error], self.calls)
+        self.assertEqual([error, error], results)
+
+    def test_other_keys(self):
+        self.release.set()
+        self.assertEqual(1, self.flight.do('a', self._func, 1))
+        self.assertEqual(2, self.flight.do('b', self._func, 2))
+        # Calls are only shared while in flight
+        self.assertEqual(1, self.flight.do('a', self._func, 1))
+        self.assertEqual([1, 2, 1], self.calls)
+
+    def test_client_get(self):
+        client = snmp.SNMPClient('192.0.2.1', 161, snmp.SNMP_V1,
+                                 community='public')
+        started = threading.Event()
+
+        def command(*args):
+            started.set()
+            self.release.wait(5)
+            return None, 0, 0, [('1.3.1', 1)]
+
+        client._command = mock.Mock(side_effect=command)
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(client.get('1.3.1')))]
+        threads[0].start()
+        started.wait(5)
+        done = _count_waiters(client._in_flight, ('GET', '1.3.1'))
+        threads += [threading.Thread(
+            target=lambda: results.append(client.get('1.3.1')))
+            for i in range(3)]
+        for thread in threads[1:]:
+            thread.start()
+        _wait_for(lambda: done.waiters == 3)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([1, 1, 1, 1], results)
+        client._command.assert_called_once_with('GET', 'getCmd', '1.3.1')
+
+
+class PDULimiterTestCase(base.TestCase):
+
+    def _start(self, limiter, func):
+        def run():
+            with limiter.slot():
+                func()
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_fifo(self):
+        limiter = snmp._PDULimiter(1)
+        order = []
+        threads = []
+        with limiter.slot():
+            for i in range(5):
+                threads.append(self._start(limiter,
+                                           lambda i=i: order.append(i)))
+                # Queue them up in a known order
+                _wait_for(lambda: limiter.queue_depth == i + 1)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(list(range(5)), order)
+        self.assertEqual(0, limiter.queue_depth)
+
+    def test_max_concurrency(self):
+        limiter = snmp._PDULimiter(2)
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+
+        def request():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+        threads = [self._start(limiter, request) for _ in range(6)]
+        for thread in threads:
+            thread.join()
+        self.assertEqual(2, peak[0])
+
+    def test_rate(self):
+        limiter = snmp._PDULimiter(10, rate=20, burst=1)
+        start = time.time()
+        for _ in range(5):
+            with limiter.slot():
+                pass
+        # The first request takes the burst token, the others wait 50ms
+        self.assertGreaterEqual(time.time() - start, 0.18)
+
+    def test_take(self):
+        limiter = snmp._PDULimiter(1)
+        woken = []
+        first = limiter.enqueue()
+        second = limiter.enqueue(lambda: woken.append(True))
+        self.assertIsNone(limiter.take(second))
+        self.assertEqual(0, limiter.take(first))
+        # Taking the slot moved the queue
+        self.assertTrue(woken)
+        self.assertIsNone(limiter.take(second))
+        del woken[:]
+        limiter.release()
+        self.assertTrue(woken)
+        self.assertEqual(0, limiter.take(second))
+        self.assertEqual(0, limiter.queue_depth)
+        self.assertEqual({}, limiter._wakers)
+        limiter.release()
+
+    def test_take_token_delay(self):
+        limiter = snmp._PDULimiter(2, rate=10, burst=1)
+        self.assertEqual(0, limiter.take(limiter.enqueue()))
+        delay = limiter.take(limiter.enqueue())
+        self.assertGreater(delay, 0)
+        self.assertLessEqual(delay, 0.1)
+
+    def test_cancel(self):
+        limiter = snmp._PDULimiter(1)
+        woken = []
+        first = limiter.enqueue(lambda: None)
+        second = limiter.enqueue(lambda: woken.append(True))
+        limiter.cancel(first)
+        self.assertTrue(woken)
+        self.assertEqual(0, limiter.take(second))
+        self.assertEqual(0, limiter.queue_depth)
+        # Cancelling twice, or after the slot was taken, is harmless
+        limiter.cancel(first)
+        limiter.cancel(second)
+        limiter.release()
+
+
+class PDULimitsTestCase(base.TestCase):
+
+    def test_default(self):
+        with mock.patch.dict(snmp.CONF['pdu'], {'max_concurrency': 3}):
+            client = snmp.SNMPClient('192.0.2.1', 161, snmp.SNMP_V1,
+                                     community='public')
+        self.assertEqual(3, client.limiter.max_concurrency)
+        self.assertEqual(3, client._engines.size)
+
+    def test_per_pdu(self):
+        limits = {'max_concurrency': 1, 'rate': 5.0, 'burst': 2}
+        with mock.patch.dict(snmp.CONF._conf_dict,
+                             {'pdu:192.0.2.1': limits}):
+            client = snmp.SNMPClient('192.0.2.1', 161, snmp.SNMP_V1,
+                                     community='public')
+            other = snmp.SNMPClient('192.0.2.2', 161, snmp.SNMP_V1,
+                                    community='public')
+        self.assertEqual(1, client.limiter.max_concurrency)
+        self.assertEqual(5.0, client.limiter.rate)
+        self.assertEqual(2, client.limiter.burst)
+        self.assertEqual(snmp.CONF['pdu']['max_concurrency'],
+                         other.limiter.max_concurrency)
+
+
+@mock.patch('poorbmc.snmp.time')
+class StaggerTestCase(base.TestCase):
+
+    def test_spaced(self, mock_time):
+        mock_time.time.return_value = 100
+        stagger = snmp._Stagger()
+        self.assertEqual([100, 101.5, 103],
+                         [stagger.reserve(1.5) for _ in range(3)])
+
+    def test_idle(self, mock_time):
+        mock_time.time.return_value = 100
+        stagger = snmp._Stagger()
+        stagger.reserve(1)
+        mock_time.time.return_value = 200
+        self.assertEqual(200, stagger.reserve(1))
+
+    def test_default_interval(self, mock_time):
+        mock_time.time.return_value = 100
+        stagger = snmp._Stagger()
+        with mock.patch.dict(snmp.CONF['power'], {'stagger_interval': 2.0}):
+            stagger.reserve()
+            self.assertEqual(102, stagger.reserve())
+
+    def test_wait(self, mock_time):
+        mock_time.time.return_value = 100
+        stagger = snmp._Stagger()
+        stagger.wait(1)
+        self.assertFalse(mock_time.sleep.called)
+        stagger.wait(1)
+        mock_time.sleep.assert_called_once_with(1)
+
+    @mock.patch.dict(snmp._staggers, clear=True)
+    def test_shared_per_pdu(self, mock_time):
+        info = {'address': '192.0.2.1', 'port': 161}
+        stagger = snmp._get_stagger(info)
+        self.assertIs(stagger, snmp._get_stagger(dict(info)))
+        self.assertIsNot(stagger, snmp._get_stagger(dict(info, port=162)))
+
+
+class _Driver(snmp.SNMPDriverBase):
+
+    poll_initial_interval = 0.01
+    poll_max_interval = 0.04
+
+    def __init__(self, snmp_info):
+        super(_Driver, self).__init__(snmp_info)
+        self.polled = mock.Mock()
+
+    def _snmp_power_state(self):
+        return self.polled()
+
+    def _snmp_power_on(self):
+        pass
+
+    def _snmp_power_off(self):
+        pass
+
+
+@mock.patch.object(snmp.traps, 'is_listening', lambda: False)
+class WaitForStateTestCase(base.TestCase):
+
+    def setUp(self):
+        super(WaitForStateTestCase, self).setUp()
+        self.driver = _Driver({'address': '192.0.2.1', 'port': 161,
+                               'version': snmp.SNMP_V1,
+                               'community': 'public', 'outlet': 1})
+
+    def test_poll_intervals(self):
+        self.driver.poll_initial_interval = 0.2
+        self.driver.poll_max_interval = 5
+        intervals = self.driver._poll_intervals()
+        self.assertEqual([0.2, 0.4, 0.8, 1.6, 3.2, 5, 5],
+                         [next(intervals) for _ in range(7)])
+
+    def test_reached(self):
+        self.driver.polled.side_effect = [snmp.states.POWER_OFF,
+                                          snmp.states.POWER_OFF,
+                                          snmp.states.POWER_ON]
+        self.assertEqual(snmp.states.POWER_ON,
+                         self.driver._snmp_wait_for_state(
+                             snmp.states.POWER_ON))
+        self.assertEqual(3, self.driver.polled.call_count)
+
+    def test_until_left(self):
+        self.driver.polled.side_effect = [snmp.states.POWER_ON,
+                                          snmp.states.POWER_OFF]
+        self.assertEqual(snmp.states.POWER_OFF,
+                         self.driver._snmp_wait_for_state(
+                             snmp.states.POWER_ON, until_left=True))
+
+    def test_timeout(self):
+        self.driver.polled.return_value = snmp.states.POWER_OFF
+        start = time.time()
+        self.assertEqual(snmp.states.ERROR,
+                         self.driver._snmp_wait_for_state(
+                             snmp.states.POWER_ON, timeout=0.2))
+        self.assertLess(time.time() - start, 1)
+        # Polled with backoff rather than every poll_initial_interval
+        self.assertLess(self.driver.polled.call_count, 10)
+
+    @mock.patch.dict(snmp.traps._subscribers, clear=True)
+    def test_notification(self):
+        self.driver.poll_initial_interval = 30
+        self.driver.polled.return_value = snmp.states.POWER_ON
+
+        def notify():
+            _wait_for(lambda: snmp.traps._subscribers)
+            snmp.traps._notify('192.0.2.1')
+
+        thread = threading.Thread(target=notify)
+        start = time.time()
+        with mock.patch.object(snmp.traps, 'is_listening', lambda: True):
+            thread.start()
+            state = self.driver._snmp_wait_for_state(snmp.states.POWER_ON,
+                                                     timeout=10)
+        thread.join()
+        self.assertEqual(snmp.states.POWER_ON, state)
+        # Polled on the notification, not after poll_initial_interval
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual({}, snmp.traps._subscribers)
+
+
+def _get_driver(driver_class, outlet=3):
+    info = {'address': '192.0.2.1', 'port': 161, 'version': snmp.SNMP_V1,
+            'community': 'public', 'outlet': outlet}
+    with mock.patch.object(snmp, '_get_client', autospec=True):
+        driver = driver_class(info)
+    driver.stagger = mock.Mock(spec=snmp._Stagger)
+    return driver
+
+
+@mock.patch.object(snmp, 'reboot_delay', 0)
+class PowerRebootTestCase(base.TestCase):
+
+    def test_native(self):
+        driver = _get_driver(snmp.SNMPDriverAPCMasterSwitch)
+        self.assertTrue(driver.native_reboot)
+        driver._snmp_power_reboot()
+        driver.client.set.assert_called_once_with(
+            (1, 3, 6, 1, 4, 1, 318, 1, 1, 4, 4, 2, 1, 3, 3),
+            snmp.rfc1902.Integer(3))
+        driver.client.collector.invalidate.assert_called_once_with()
+
+    def test_native_split(self):
+        driver = _get_driver(snmp.SNMPDriverEatonPower)
+        self.assertTrue(driver.native_reboot)
+        driver._snmp_power_reboot()
+        driver.client.set.assert_called_once_with(
+            (1, 3, 6, 1, 4, 1, 534, 6, 6, 7, 6, 6, 1, 5, 0, 3),
+            snmp.rfc1902.Integer(0))
+
+    def test_off_on(self):
+        driver = _get_driver(snmp.SNMPDriverAPCMasterSwitchPlus)
+        self.assertFalse(driver.native_reboot)
+        oid = (1, 3, 6, 1, 4, 1, 318, 1, 1, 6, 5, 1, 1, 5, 3)
+        with mock.patch.object(driver, '_snmp_wait_for_state',
+                               return_value=snmp.states.POWER_OFF):
+            driver._snmp_power_reboot()
+        self.assertEqual([mock.call(oid, snmp.rfc1902.Integer(3)),
+                          mock.call(oid, snmp.rfc1902.Integer(1))],
+                         driver.client.set.call_args_list)
+        # Powering back on takes its slot in the stagger
+        driver.stagger.wait.assert_called_once_with()
+
+    def test_off_on_not_off(self):
+        driver = _get_driver(snmp.SNMPDriverAPCMasterSwitchPlus)
+        with mock.patch.object(driver, '_snmp_wait_for_state',
+                               return_value=snmp.states.ERROR):
+            self.assertRaises(snmp.exception.SNMPFailure,
+                              driver._snmp_power_reboot)
+        # Not switched back on
+        self.assertEqual(1, driver.client.set.call_count)
+        self.assertFalse(driver.stagger.wait.called)
+
+    def test_power_reset_native(self):
+        driver = _get_driver(snmp.SNMPDriverAPCRackPDU)
+        with mock.patch.object(driver, '_snmp_wait_for_state',
+                               return_value=snmp.states.POWER_ON) as wait:
+            self.assertEqual(snmp.states.POWER_ON, driver.power_reset())
+        driver.stagger.wait.assert_called_once_with()
+        driver.client.set.assert_called_once_with(
+            driver.oid, snmp.rfc1902.Integer(3))
+        self.assertEqual(
+            [mock.call(snmp.states.POWER_ON,
+                       timeout=snmp.reboot_start_timeout, until_left=True),
+             mock.call(snmp.states.POWER_ON)],
+            wait.call_args_list)
+
+    def test_power_reset_off_on(self):
+        driver = _get_driver(snmp.SNMPDriverBaytechMRP27)
+        with mock.patch.object(driver, '_snmp_wait_for_state',
+                               side_effect=[snmp.states.POWER_OFF,
+                                            snmp.states.POWER_ON]):
+            self.assertEqual(snmp.states.POWER_ON, driver.power_reset())
+        self.assertEqual([mock.call(driver.oid, snmp.rfc1902.Integer(0)),
+                          mock.call(driver.oid, snmp.rfc1902.Integer(1))],
+                         driver.client.set.call_args_list)
+        driver.stagger.wait.assert_called_once_with(None)
+
+
+class DriverTestCase(base.TestCase):
+    """The objects and values of each driver, for outlet 3."""
+
+    # Driver name: (status OID, {power state: status value},
+    #               {request: (OID, value)})
+    DRIVERS = {
+        'apc_masterswitch': (
+            (1, 3, 6, 1, 4, 1, 318, 1, 1, 4, 4, 2, 1, 3, 3),
+            {snmp.states.POWER_ON: 1, snmp.states.POWER_OFF: 2,
+             snmp.states.REBOOT: 3},
+            {snmp.states.POWER_ON: (None, 1),
+             snmp.states.POWER_OFF: (None, 2),
+             snmp.states.REBOOT: (None, 3)}),
+        'apc_masterswitchplus': (
+            (1, 3, 6, 1, 4, 1, 318, 1, 1, 6, 5, 1, 1, 5, 3),
+            {snmp.states.POWER_ON: 1, snmp.states.POWER_OFF: 3},
+            {snmp.states.POWER_ON: (None, 1),
+             snmp.states.POWER_OFF: (None, 3)}),
+        'apc_rackpdu': (
+            (1, 3, 6, 1, 4, 1, 318, 1, 1, 12, 3, 3, 1, 1, 4, 3),
+            {snmp.states.POWER_ON: 1, snmp.states.POWER_OFF: 2,
+             snmp.states.REBOOT: 3},
+            {snmp.states.POWER_ON: (None, 1),
+             snmp.states.POWER_OFF: (None, 2),
+             snmp.states.REBOOT: (None, 3)}),
+        'apc_rpdu2': (
+            (1, 3, 6, 1, 4, 1, 318, 1, 1, 26, 9, 2, 4, 1, 5, 3),
+            {snmp.states.POWER_ON: 1, snmp.states.POWER_OFF: 2,
+             snmp.states.REBOOT: 3},
+            {snmp.states.POWER_ON: (None, 1),
+             snmp.states.POWER_OFF: (None, 2),
+             snmp.states.REBOOT: (None, 3)}),
+        'cyberpower': (
+            (1, 3, 6, 1, 4, 1, 3808, 1, 1, 3, 3, 3, 1, 1, 4, 3),
+            {snmp.states.POWER_ON: 1, snmp.states.POWER_OFF: 2,
+             snmp.states.REBOOT: 3},
+            {snmp.states.POWER_ON: (None, 1),
+             snmp.states.POWER_OFF: (None, 2),
+             snmp.states.REBOOT: (None, 3)}),
+        'baytech_mrp27': (
+            (1, 3, 6, 1, 4, 1, 4779, 1, 3, 5, 3, 1, 3, 1, 3),
+            {snmp.states.POWER_ON: 1, snmp.states.POWER_OFF: 0},
+            {snmp.states.POWER_ON: (None, 1),
+             snmp.states.POWER_OFF: (None, 0)}),
+        'eatonpower': (
+            (1, 3, 6, 1, 4, 1, 534, 6, 6, 7, 6, 6, 1, 2, 0, 3),
+            {snmp.states.POWER_ON: 1, snmp.states.POWER_OFF: 0,
+             snmp.states.REBOOT: 2},
+            {snmp.states.POWER_ON:
+             ((1, 3, 6, 1, 4, 1, 534, 6, 6, 7, 6, 6, 1, 4, 0, 3), 0),
+             snmp.states.POWER_OFF:
+             ((1, 3, 6, 1, 4, 1, 534, 6, 6, 7, 6, 6, 1, 3, 0, 3), 0),
+             snmp.states.REBOOT:
+             ((1, 3, 6, 1, 4, 1, 534, 6, 6, 7, 6, 6, 1, 5, 0, 3), 0)}),
+        'raritan_pdu2': (
+            (1, 3, 6, 1, 4, 1, 13742, 6, 4, 1, 2, 1, 3, 1, 3),
+            {snmp.states.POWER_ON: 7, snmp.states.POWER_OFF: 8},
+            {snmp.states.POWER_ON:
+             ((1, 3, 6, 1, 4, 1, 13742, 6, 4, 1, 2, 1, 2, 1, 3), 1),
+             snmp.states.POWER_OFF:
+             ((1, 3, 6, 1, 4, 1, 13742, 6, 4, 1, 2, 1, 2, 1, 3), 0),
+             snmp.states.REBOOT:
+             ((1, 3, 6, 1, 4, 1, 13742, 6, 4, 1, 2, 1, 2, 1, 3), 2)}),
+        'servertech_sentry3': (
+            (1, 3, 6, 1, 4, 1, 1718, 3, 2, 3, 1, 5, 1, 1, 3),
+            {snmp.states.POWER_ON: 1, snmp.states.POWER_OFF: 0,
+             snmp.states.REBOOT: 2},
+            {snmp.states.POWER_ON:
+             ((1, 3, 6, 1, 4, 1, 1718, 3, 2, 3, 1, 11, 1, 1, 3), 1),
+             snmp.states.POWER_OFF:
+             ((1, 3, 6, 1, 4, 1, 1718, 3, 2, 3, 1, 11, 1, 1, 3), 2),
+             snmp.states.REBOOT:
+             ((1, 3, 6, 1, 4, 1, 1718, 3, 2, 3, 1, 11, 1, 1, 3), 3)}),
+    }
+
+    def test_registry(self):
+        self.assertEqual(set(self.DRIVERS) | set(['apc', 'simulated']),
+                         set(snmp.DRIVER_CLASSES))
+        self.assertIs(snmp.SNMPDriverAPCMasterSwitch,
+                      snmp.get_driver_class('apc'))
+        self.assertRaises(snmp.exception.SNMPDriverNotFound,
+                          snmp.get_driver_class, 'foo')
+
+    def test_status_oid(self):
+        for name, (oid, _, _) in self.DRIVERS.items():
+            driver = _get_driver(snmp.get_driver_class(name))
+            self.assertEqual(oid, driver.oid, name)
+            driver.client.collector.register.assert_called_once_with(oid)
+
+    def test_power_state(self):
+        for name, (oid, values, _) in self.DRIVERS.items():
+            driver = _get_driver(snmp.get_driver_class(name))
+            for state, value in values.items():
+                driver.client.collector.get.return_value = value
+                self.assertEqual(state, driver._snmp_power_state(),
+                                 '%s: %s' % (name, value))
+            driver.client.collector.get.return_value = 42
+            self.assertEqual(snmp.states.ERROR, driver._snmp_power_state(),
+                             name)
+
+    def test_pending(self):
+        driver = _get_driver(snmp.SNMPDriverServerTechSentry3)
+        for value in (2, 3):
+            driver.client.collector.get.return_value = value
+            self.assertEqual(snmp.states.REBOOT, driver._snmp_power_state())
+        # offError and onError are not switching
+        for value in (4, 5):
+            driver.client.collector.get.return_value = value
+            self.assertEqual(snmp.states.ERROR, driver._snmp_power_state())
+
+    def test_requests(self):
+        for name, (oid, _, requests) in self.DRIVERS.items():
+            driver = _get_driver(snmp.get_driver_class(name))
+            self.assertEqual(snmp.states.REBOOT in requests,
+                             driver.native_reboot, name)
+            for state, (set_oid, value) in requests.items():
+                self.assertEqual((set_oid or oid, snmp.rfc1902.Integer(value)),
+                                 driver._snmp_request(state),
+                                 '%s: %s' % (name, state))
+
+    def test_power_on_off(self):
+        for name, (oid, _, requests) in self.DRIVERS.items():
+            driver = _get_driver(snmp.get_driver_class(name))
+            driver._snmp_power_on()
+            driver._snmp_power_off()
+            expected = [mock.call(*driver._snmp_request(state))
+                        for state in (snmp.states.POWER_ON,
+                                      snmp.states.POWER_OFF)]
+            self.assertEqual(expected, driver.client.set.call_args_list,
+                             name)
+            self.assertEqual(2, driver.client.collector.invalidate.call_count)
+
+
+class ValidateSecurityTestCase(base.TestCase):
+
+    def test_valid(self):
+        snmp.validate_security(snmp.SNMP_V1)
+        snmp.validate_security(snmp.SNMP_V3, 'admin')
+        snmp.validate_security(snmp.SNMP_V3, 'admin', 'sha256', 'maplesyrup',
+                               'aes256', 'maplesyrup', '80001f8880')
+
+    def _check(self, error, *args):
+        exc = self.assertRaises(snmp.exception.InvalidSNMPSecurity,
+                                snmp.validate_security, *args)
+        self.assertIn(error, str(exc))
+
+    def test_invalid(self):
+        self._check('require SNMP version', snmp.SNMP_V2C, None, None,
+                    'maplesyrup')
+        self._check('no USM username', snmp.SNMP_V3)
+        self._check('privacy requires authentication', snmp.SNMP_V3,
+                    'admin', None, None, None, 'maplesyrup')
+        self._check('at least 8 characters', snmp.SNMP_V3, 'admin', None,
+                    'maple')
+        self._check('unknown authentication', snmp.SNMP_V3, 'admin', 'md4',
+                    'maplesyrup')
+        self._check('unknown privacy', snmp.SNMP_V3, 'admin', None,
+                    'maplesyrup', 'rot13', 'maplesyrup')
+        self._check('not hexadecimal', snmp.SNMP_V3, 'admin', None, None,
+                    None, None, 'engine')
+
+
+class USMUserDataTestCase(base.TestCase):
+
+    # RFC 3414, appendix A.3: the "maplesyrup" pass phrase, hashed and
+    # localized for ENGINE_ID
+    ENGINE_ID = '000000000000000000000002'
+    MD5_MASTER = binascii.unhexlify('9faf3283884e92834ebc9847d8edd963')
+    MD5_LOCALIZED = binascii.unhexlify('526f5eed9fcce26f8964c2930787d82b')
+    SHA_LOCALIZED = binascii.unhexlify(
+        '6695febc9288e36282235fc7151f128497b38f3f')
+
+    def _client(self, **kwargs):
+        return snmp.SNMPClient('192.0.2.1', 161, snmp.SNMP_V3,
+                               security='admin', **kwargs)
+
+    def test_localized(self):
+        client = self._client(auth_protocol='md5', auth_key='maplesyrup',
+                              priv_protocol='des', priv_key='maplesyrup',
+                              engine_id=self.ENGINE_ID)
+        user = client._get_auth()
+        self.assertEqual(self.MD5_LOCALIZED, user.authKey.asOctets())
+        self.assertEqual(self.MD5_LOCALIZED, user.privKey.asOctets())
+        self.assertEqual(snmp.snmp_config.usmKeyTypeLocalized,
+                         user.authKeyType)
+        self.assertEqual(snmp.snmp_config.usmKeyTypeLocalized,
+                         user.privKeyType)
+        self.assertEqual(binascii.unhexlify(self.ENGINE_ID),
+                         user.securityEngineId.asOctets())
+        # Built once for all the requests
+        self.assertIs(user, client._get_auth())
+
+    def test_localized_sha(self):
+        client = self._client(auth_key='maplesyrup',
+                              engine_id=self.ENGINE_ID)
+        user = client._get_auth()
+        self.assertEqual(snmp.cmdgen.usmHMACSHAAuthProtocol,
+                         user.authProtocol)
+        self.assertEqual(self.SHA_LOCALIZED, user.authKey.asOctets())
+        self.assertEqual(snmp.cmdgen.usmNoPrivProtocol, user.privProtocol)
+
+    def test_master(self):
+        client = self._client(auth_protocol='md5', auth_key='maplesyrup',
+                              priv_key='maplesyrup')
+        user = client._get_auth()
+        # Hashed, but left for the engines to localize
+        self.assertEqual(self.MD5_MASTER, user.authKey.asOctets())
+        self.assertEqual(snmp.snmp_config.usmKeyTypeMaster,
+                         user.authKeyType)
+        self.assertEqual(snmp.cmdgen.usmAesCfb128Protocol, user.privProtocol)
+        self.assertIsNone(user.securityEngineId)
+
+    def test_no_auth(self):
+        user = self._client()._get_auth()
+        self.assertEqual(snmp.cmdgen.usmNoAuthProtocol, user.authProtocol)
+        self.assertEqual(snmp.cmdgen.usmNoPrivProtocol, user.privProtocol)
+        self.assertIsNone(user.authKey)
+
+    def test_invalid(self):
+        self.assertRaises(snmp.exception.InvalidSNMPSecurity, self._client,
+                          priv_key='maplesyrup')
+
+
+class SimulatedPDUTestCase(base.TestCase):
+
+    SETTINGS = {'latency': 0, 'switch_delay': 1.0, 'reboot_time': 5.0,
+                'failure_rate': 0, 'stuck_outlets': set(),
+                'initial_state': 'off'}
+
+    def setUp(self):
+        super(SimulatedPDUTestCase, self).setUp()
+        for patcher in (
+                mock.patch.dict(snmp._simulated_pdus, clear=True),
+                mock.patch.dict(snmp._staggers, clear=True),
+                mock.patch.dict(snmp.CONF['simulated'], self.SETTINGS)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(snmp, 'time')
+        self.mock_time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_time.time.return_value = 1000.0
+
+    def _driver(self, outlet=1, address='192.0.2.1'):
+        return snmp.SNMPDriverSimulated({'address': address,
+                                         'port': snmp.SNMP_PORT,
+                                         'outlet': outlet})
+
+    def _advance(self, seconds):
+        self.mock_time.time.return_value += seconds
+
+    def test_shared(self):
+        self.assertIs(self._driver(1).client, self._driver(2).client)
+        self.assertIsNot(self._driver(1).client,
+                         self._driver(1, address='192.0.2.2').client)
+
+    def test_initial_state(self):
+        self.assertEqual(snmp.states.POWER_OFF,
+                         self._driver()._snmp_power_state())
+        snmp.CONF['simulated']['initial_state'] = 'on'
+        self.assertEqual(snmp.states.POWER_ON,
+                         self._driver(address='192.0.2.2')._snmp_power_state())
+
+    def test_switch_delay(self):
+        driver = self._driver()
+        driver._snmp_power_on()
+        self._advance(0.9)
+        self.assertEqual(snmp.states.POWER_OFF, driver._snmp_power_state())
+        self._advance(0.1)
+        self.assertEqual(snmp.states.POWER_ON, driver._snmp_power_state())
+        driver._snmp_power_off()
+        self._advance(1.0)
+        self.assertEqual(snmp.states.POWER_OFF, driver._snmp_power_state())
+        # Other outlets are untouched
+        self.assertEqual(snmp.states.POWER_OFF,
+                         self._driver(2)._snmp_power_state())
+
+    def test_reboot(self):
+        driver = self._driver()
+        driver._snmp_power_on()
+        self._advance(1.0)
+        driver._snmp_power_reboot()
+        self.assertEqual(snmp.states.POWER_ON, driver._snmp_power_state())
+        self._advance(1.0)
+        self.assertEqual(snmp.states.POWER_OFF, driver._snmp_power_state())
+        self._advance(4.9)
+        self.assertEqual(snmp.states.POWER_OFF, driver._snmp_power_state())
+        self._advance(0.1)
+        self.assertEqual(snmp.states.POWER_ON, driver._snmp_power_state())
+
+    def test_reboot_skipped_transitions(self):
+        driver = self._driver()
+        driver._snmp_power_reboot()
+        # Both transitions are applied in order by a single read
+        self._advance(10.0)
+        self.assertEqual(snmp.states.POWER_ON, driver._snmp_power_state())
+
+    def test_command_replaces_transitions(self):
+        driver = self._driver()
+        driver._snmp_power_reboot()
+        driver._snmp_power_off()
+        self._advance(10.0)
+        self.assertEqual(snmp.states.POWER_OFF, driver._snmp_power_state())
+
+    def test_stuck_outlets(self):
+        snmp.CONF['simulated']['stuck_outlets'] = set([2])
+        stuck = self._driver(2)
+        stuck._snmp_power_on()
+        self._driver(1)._snmp_power_on()
+        self._advance(1.0)
+        self.assertEqual(snmp.states.POWER_OFF, stuck._snmp_power_state())
+        self.assertEqual(snmp.states.POWER_ON,
+                         self._driver(1)._snmp_power_state())
+
+    @mock.patch.object(snmp.random, 'random')
+    def test_failure_rate(self, mock_random):
+        snmp.CONF['simulated']['failure_rate'] = 0.5
+        driver = self._driver()
+        mock_random.return_value = 0.4
+        self.assertRaises(snmp.exception.SNMPFailure,
+                          driver._snmp_power_state)
+        self.assertRaises(snmp.exception.SNMPFailure, driver._snmp_power_on)
+        self._advance(1.0)
+        mock_random.return_value = 0.5
+        # The failed command did not switch the outlet
+        self.assertEqual(snmp.states.POWER_OFF, driver._snmp_power_state())
+
+    def test_latency(self):
+        snmp.CONF['simulated']['latency'] = 0.2
+        driver = self._driver()
+        driver._snmp_power_state()
+        driver._snmp_power_on()
+        self.assertEqual([mock.call(0.2)] * 2,
+                         self.mock_time.sleep.call_args_list)
+
+    def test_no_latency(self):
+        self._driver()._snmp_power_state()
+        self.assertFalse(self.mock_time.sleep.called)
+
+    def test_per_address(self):
+        overrides = {'latency': 0.5, 'stuck_outlets': set([1])}
+        with mock.patch.dict(snmp.CONF._conf_dict,
+                             {'simulated:192.0.2.1': overrides}):
+            pdu = self._driver().client
+            other = self._driver(address='192.0.2.2').client
+        self.assertEqual(0.5, pdu.latency)
+        self.assertEqual(set([1]), pdu.stuck_outlets)
+        # Not overridden
+        self.assertEqual(1.0, pdu.switch_delay)
+        self.assertEqual(0, other.latency)
+        self.assertEqual(set(), other.stuck_outlets)
+
+    def test_pdu_name(self):
+        self.assertEqual('192.0.2.1', self._driver().client.pdu_name)
+        pdu = snmp.SimulatedPDU('192.0.2.1', 1161)
+        self.assertEqual('192.0.2.1:1161', pdu.pdu_name)
+
+    def test_command_after_due_transition(self):
+        driver = self._driver()
+        driver._snmp_power_on()
+        self._advance(1.0)
+        # Switched on, even though no read applied it before the command
+        driver._snmp_power_reboot()
+        self.assertEqual(snmp.states.POWER_ON, driver._snmp_power_state())
@@ -0,0 +1,230 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+import mock
+from pyasn1.codec.ber import decoder
+from pyasn1.codec.ber import encoder
+from pysnmp.proto import api
+import six
+
+from poorbmc import snmp
+from poorbmc.tests.unit import base
+
+if six.PY3:
+    import asyncio
+
+    from poorbmc import snmp_async
+
+states = snmp.states
+
+PROTO = api.protoModules[api.protoVersion1]
+
+# APC rack PDU outlet 1: 1=On, 2=Off, 3=PowerCycle
+OUTLET_OID = (1, 3, 6, 1, 4, 1, 318, 1, 1, 12, 3, 3, 1, 1, 4, 1)
+
+
+class _FakeAgent(object):
+    """An SNMPv1 agent answering GETs and SETs of integer objects."""
+
+    def __init__(self):
+        self.values = {}
+        self.requests = []
+        self.drop = 0
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        pass
+
+    def error_received(self, exc):
+        pass
+
+    def datagram_received(self, data, addr):
+        msg, _ = decoder.decode(data, asn1Spec=PROTO.Message())
+        request = PROTO.apiMessage.getPDU(msg)
+        self.requests.append(request)
+        if self.drop:
+            self.drop -= 1
+            return
+        response_msg = PROTO.apiMessage.getResponse(msg)
+        response = PROTO.apiMessage.getPDU(response_msg)
+        var_binds = []
+        for oid, value in PROTO.apiPDU.getVarBinds(request):
+            if request.isSameTypeWith(PROTO.SetRequestPDU()):
+                value = int(value)
+                # Power cycles complete right away
+                self.values[tuple(oid)] = 1 if value == 3 else value
+            var_binds.append((oid, PROTO.Integer(self.values[tuple(oid)])))
+        PROTO.apiPDU.setVarBinds(response, var_binds)
+        self.transport.sendto(encoder.encode(response_msg), addr)
+
+
+class AsyncDriverTestCase(base.TestCase):
+
+    def setUp(self):
+        super(AsyncDriverTestCase, self).setUp()
+        if six.PY2:
+            self.skipTest('The asyncio SNMP drivers require Python 3')
+        for patcher in (mock.patch.dict(snmp._clients, clear=True),
+                        mock.patch.dict(snmp._staggers, clear=True),
+                        mock.patch.dict(snmp_async._clients, clear=True),
+                        mock.patch.object(snmp.SNMPDriverBase,
+                                          'poll_initial_interval', 0.01),
+                        mock.patch.object(snmp, 'reboot_start_timeout',
+                                          0.05),
+                        mock.patch.object(snmp, 'reboot_delay', 0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+        transport, self.agent = self.loop.run_until_complete(
+            self.loop.create_datagram_endpoint(
+                _FakeAgent, local_addr=('127.0.0.1', 0)))
+        self.addCleanup(transport.close)
+        self.agent.values[OUTLET_OID] = 2
+
+        self.driver = snmp.get_async_driver_class('apc_rackpdu')({
+            'address': '127.0.0.1',
+            'port': transport.get_extra_info('sockname')[1],
+            'outlet': 1,
+            'community': 'public',
+            'version': snmp.SNMP_V1,
+        })
+        self.addCleanup(snmp_async.get_client(self.driver.client).close)
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_driver_class(self):
+        self.assertIsInstance(self.driver, snmp.SNMPDriverAPCRackPDU)
+        self.assertIsInstance(self.driver, snmp_async.AsyncDriverMixin)
+        self.assertIs(type(self.driver),
+                      snmp.get_async_driver_class('apc_rackpdu'))
+
+    def test_power_state(self):
+        self.assertEqual(states.POWER_OFF,
+                         self._run(self.driver.async_power_state()))
+        # Answered on first attempt: an RTT sample
+        self.assertIsNotNone(self.driver.client.rtt.srtt)
+
+    def test_power_on(self):
+        self.assertEqual(states.POWER_ON,
+                         self._run(self.driver.async_power_on()))
+        self.assertEqual(1, self.agent.values[OUTLET_OID])
+        self.assertTrue(self.agent.requests[0].isSameTypeWith(
+            PROTO.SetRequestPDU()))
+
+    def test_power_off(self):
+        self.agent.values[OUTLET_OID] = 1
+        self.assertEqual(states.POWER_OFF,
+                         self._run(self.driver.async_power_off()))
+
+    def test_power_reset_native(self):
+        self.agent.values[OUTLET_OID] = 1
+        self.assertEqual(states.POWER_ON,
+                         self._run(self.driver.async_power_reset()))
+        set_value = PROTO.apiPDU.getVarBinds(self.agent.requests[0])[0][1]
+        self.assertEqual(3, int(set_value))
+
+    def test_single_flight(self):
+        results = self._run(asyncio.gather(
+            self.driver.async_power_state(),
+            self.driver.async_power_state()))
+        self.assertEqual([states.POWER_OFF] * 2, results)
+        self.assertEqual(1, len(self.agent.requests))
+
+    def test_retried(self):
+        self.driver.client.rtt.timeout = 0.05
+        self.agent.drop = 1
+        self.assertEqual(states.POWER_OFF,
+                         self._run(self.driver.async_power_state()))
+        self.assertEqual(2, len(self.agent.requests))
+        # Karn's algorithm: the answer may be to either request
+        self.assertIsNone(self.driver.client.rtt.srtt)
+        self.assertEqual(snmp.udp_transport_timeout_min,
+                         self.driver.client.rtt.timeout)
+
+    @mock.patch.object(snmp, 'udp_transport_retries', 1)
+    def test_timeout(self):
+        self.driver.client.rtt.timeout = 0.02
+        self.agent.drop = 10
+        self.assertRaises(snmp.exception.SNMPTimeout, self._run,
+                          self.driver.async_power_state())
+        self.assertEqual(2, len(self.agent.requests))
+
+    def test_limiter_shared_with_threads(self):
+        limiter = self.driver.client.limiter
+        # Threads of the process hold every slot of the PDU
+        for _ in range(limiter.max_concurrency):
+            self.assertEqual(0, limiter.take(limiter.enqueue()))
+        task = self.loop.create_task(self.driver.async_power_state())
+        self._run(asyncio.sleep(0.05))
+        self.assertEqual([], self.agent.requests)
+        self.assertEqual(1, limiter.queue_depth)
+        # Woken up by a thread giving its slot back
+        threading.Timer(0.01, limiter.release).start()
+        self.assertEqual(states.POWER_OFF, self._run(task))
+        limiter.release()
+        self.assertEqual(0, limiter.queue_depth)
+
+    def test_cancelled_leaves_queue(self):
+        limiter = self.driver.client.limiter
+        for _ in range(limiter.max_concurrency):
+            limiter.take(limiter.enqueue())
+        task = self.loop.create_task(self.driver.async_power_state())
+        self._run(asyncio.sleep(0.01))
+        task.cancel()
+        self.assertRaises(asyncio.CancelledError, self._run, task)
+        self._run(asyncio.sleep(0.01))
+        self.assertEqual(0, limiter.queue_depth)
+        for _ in range(limiter.max_concurrency):
+            limiter.release()
+
+
+class AsyncDriverFallbackTestCase(base.TestCase):
+
+    def setUp(self):
+        super(AsyncDriverFallbackTestCase, self).setUp()
+        if six.PY2:
+            self.skipTest('The asyncio SNMP drivers require Python 3')
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    @mock.patch.dict(snmp._simulated_pdus, clear=True)
+    @mock.patch.object(snmp.SNMPDriverSimulated, 'power_state',
+                       return_value=states.POWER_ON)
+    def test_simulated(self, mock_state):
+        driver = snmp.get_async_driver_class('simulated')({
+            'address': '192.0.2.1', 'port': 161, 'outlet': 1,
+            'community': 'public', 'version': snmp.SNMP_V1})
+        self.assertEqual(states.POWER_ON, self.loop.run_until_complete(
+            driver.async_power_state()))
+        mock_state.assert_called_once_with()
+
+    @mock.patch.dict(snmp._clients, clear=True)
+    @mock.patch.object(snmp.SNMPDriverAPCRackPDU, 'power_state',
+                       return_value=states.POWER_ON)
+    def test_snmpv3(self, mock_state):
+        driver = snmp.get_async_driver_class('apc_rackpdu')({
+            'address': '192.0.2.1', 'port': 161, 'outlet': 1,
+            'version': snmp.SNMP_V3, 'security': 'pbmc',
+            'auth_key': 'authkey1', 'priv_key': 'privkey1'})
+        self.assertEqual(states.POWER_ON, self.loop.run_until_complete(
+            driver.async_power_state()))
+        mock_state.assert_called_once_with()
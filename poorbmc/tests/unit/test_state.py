@@ -0,0 +1,169 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+import mock
+
+from poorbmc import state
+from poorbmc.tests.unit import base
+
+
+class _Item(object):
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self.written = mock.Mock()
+
+    def render(self):
+        return self.data
+
+
+class WriteFilesTestCase(base.TestCase):
+
+    def setUp(self):
+        super(WriteFilesTestCase, self).setUp()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+
+    def test_write(self):
+        paths = [os.path.join(self.tmpdir, name) for name in ('a', 'b')]
+        self.assertEqual([], state.write_files({paths[0]: b'foo',
+                                                paths[1]: b'bar'}))
+        for path, data in zip(paths, (b'foo', b'bar')):
+            with open(path, 'rb') as f:
+                self.assertEqual(data, f.read())
+        self.assertEqual(['a', 'b'], sorted(os.listdir(self.tmpdir)))
+
+    def test_failed(self):
+        path = os.path.join(self.tmpdir, 'a')
+        missing = os.path.join(self.tmpdir, 'missing', 'b')
+        self.assertEqual([missing], state.write_files({path: b'foo',
+                                                       missing: b'bar'}))
+        with open(path, 'rb') as f:
+            self.assertEqual(b'foo', f.read())
+
+
+class WriteBehindTestCase(base.TestCase):
+
+    def setUp(self):
+        super(WriteBehindTestCase, self).setUp()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        # Flushed by the tests, not by the background thread
+        self.writer = state.WriteBehind(3600)
+
+    def test_flush(self):
+        item = _Item(os.path.join(self.tmpdir, 'a'), b'foo')
+        self.writer.schedule(item)
+        self.writer.flush()
+        item.written.assert_called_once_with(b'foo')
+        with open(item.path, 'rb') as f:
+            self.assertEqual(b'foo', f.read())
+
+    def test_unchanged(self):
+        item = _Item(os.path.join(self.tmpdir, 'a'), None)
+        self.writer.schedule(item)
+        self.writer.flush()
+        self.assertFalse(item.written.called)
+        self.assertFalse(os.path.exists(item.path))
+
+    def test_latest_only(self):
+        path = os.path.join(self.tmpdir, 'a')
+        first = _Item(path, b'foo')
+        second = _Item(path, b'bar')
+        self.writer.schedule(first)
+        self.writer.schedule(second)
+        self.writer.flush()
+        self.assertFalse(first.written.called)
+        second.written.assert_called_once_with(b'bar')
+
+    def test_retry(self):
+        directory = os.path.join(self.tmpdir, 'missing')
+        item = _Item(os.path.join(directory, 'a'), b'foo')
+        self.writer.schedule(item)
+        self.writer.flush()
+        self.assertFalse(item.written.called)
+
+        os.mkdir(directory)
+        self.writer.flush()
+        item.written.assert_called_once_with(b'foo')
+        with open(item.path, 'rb') as f:
+            self.assertEqual(b'foo', f.read())
+
+    def test_retry_keeps_newer(self):
+        directory = os.path.join(self.tmpdir, 'missing')
+        path = os.path.join(directory, 'a')
+        first = _Item(path, b'foo')
+        second = _Item(path, b'bar')
+        self.writer.schedule(first)
+
+        def write_files(files):
+            # Scheduled again while the batch is written
+            self.writer.schedule(second)
+            return list(files)
+
+        with mock.patch.object(state, 'write_files', write_files):
+            self.writer.flush()
+        os.mkdir(directory)
+        self.writer.flush()
+        self.assertFalse(first.written.called)
+        second.written.assert_called_once_with(b'bar')
+
+
+class StateStoreTestCase(base.TestCase):
+
+    def setUp(self):
+        super(StateStoreTestCase, self).setUp()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(self.tmpdir, 'state')
+        self.writer = state.WriteBehind(3600)
+        patcher = mock.patch.object(state, '_writer', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_set(self):
+        store = state.StateStore(self.path)
+        self.assertIsNone(store.get('boot_device'))
+        store.set('boot_device', 'network')
+        self.assertEqual('network', store.get('boot_device'))
+        self.writer.flush()
+        self.assertEqual('network',
+                         state.StateStore(self.path).get('boot_device'))
+
+    def test_unchanged(self):
+        store = state.StateStore(self.path)
+        store.set('boot_device', 'network')
+        self.writer.flush()
+        self.assertIsNone(store.render())
+
+    def test_changed_back(self):
+        store = state.StateStore(self.path)
+        store.set('boot_device', 'network')
+        self.writer.flush()
+        store.set('boot_device', 'hd')
+        store.set('boot_device', 'network')
+        self.assertIsNone(store.render())
+
+    def test_not_written_after_failure(self):
+        store = state.StateStore(self.path)
+        store.set('boot_device', 'network')
+        with mock.patch.object(state, 'write_files',
+                               side_effect=lambda files: list(files)):
+            self.writer.flush()
+        # Still to be written
+        self.assertIsNotNone(store.render())
+
+    def test_corrupt(self):
+        with open(self.path, 'w') as f:
+            f.write('{')
+        self.assertEqual({}, state.StateStore(self.path)._state)
@@ -0,0 +1,147 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import socket
+import threading
+import time
+
+import fixtures
+
+from poorbmc import exception
+from poorbmc import supervisor
+from poorbmc.tests.unit import base
+
+
+class _FakeBMC(object):
+    """A UDP listener answering the probes, or not."""
+
+    def __init__(self, answer=True):
+        self.answer = answer
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.port = self.socket.getsockname()[1]
+        self.received = []
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        data, source = self.socket.recvfrom(512)
+        self.received.append(data)
+        if self.answer:
+            # The session header echoed, then the response message
+            response = bytearray(data[:14]) + bytearray(7)
+            response[19] = data[19]
+            self.socket.sendto(bytes(response), source)
+
+    def close(self):
+        self._thread.join(1)
+        self.socket.close()
+
+
+class ProbeTestCase(base.TestCase):
+
+    def test_packet(self):
+        packet = bytearray(supervisor._PROBE)
+        self.assertEqual(bytearray(b'\x06\x00\xff\x07'), packet[:4])
+        # Message length, then two checksummed parts
+        self.assertEqual(len(packet) - 14, packet[13])
+        self.assertEqual(0, sum(packet[14:17]) & 0xff)
+        self.assertEqual(0, sum(packet[17:]) & 0xff)
+        self.assertEqual(supervisor._GET_CHANNEL_AUTH_CAPABILITIES,
+                         packet[19])
+
+    def test_probe(self):
+        answering = _FakeBMC()
+        silent = _FakeBMC(answer=False)
+        self.addCleanup(answering.close)
+        self.addCleanup(silent.close)
+        endpoints = [('127.0.0.1', answering.port),
+                     ('0.0.0.0', silent.port)]
+        start = time.time()
+        answered = supervisor.probe(endpoints, timeout=0.2)
+        self.assertEqual(set([('127.0.0.1', answering.port)]), answered)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        # The wildcard address is probed on the loopback
+        self.assertEqual([supervisor._PROBE], silent.received)
+
+    def test_probe_all_answered(self):
+        bmcs = [_FakeBMC() for _ in range(3)]
+        for bmc in bmcs:
+            self.addCleanup(bmc.close)
+        endpoints = set(('127.0.0.1', bmc.port) for bmc in bmcs)
+        start = time.time()
+        self.assertEqual(endpoints, supervisor.probe(endpoints, timeout=5))
+        # No need to wait for the timeout
+        self.assertLess(time.time() - start, 5)
+
+
+class ControlTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ControlTestCase, self).setUp()
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(tmpdir, 'serve.sock')
+        self.requests = []
+        self.server = supervisor.ControlServer(self.path, self._handler)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def _handler(self, request):
+        self.requests.append(request)
+        if request['command'] == 'fail':
+            raise exception.PoorBMCError('no luck')
+        if request['command'] == 'crash':
+            raise ValueError('oops')
+        if request['command'] == 'slow':
+            time.sleep(0.5)
+        return {'bmcs': request.get('bmcs')}
+
+    def test_control(self):
+        self.assertEqual({'bmcs': ['node1']},
+                         supervisor.control(self.path, 'start',
+                                            bmcs=['node1']))
+        self.assertEqual([{'command': 'start', 'bmcs': ['node1']}],
+                         self.requests)
+
+    def test_socket_mode(self):
+        self.assertEqual(0o600, os.stat(self.path).st_mode & 0o777)
+
+    def test_error(self):
+        error = self.assertRaises(exception.PoorBMCError,
+                                  supervisor.control, self.path, 'fail')
+        self.assertEqual('no luck', str(error))
+
+    def test_internal_error(self):
+        error = self.assertRaises(exception.PoorBMCError,
+                                  supervisor.control, self.path, 'crash')
+        self.assertIn('Internal error: oops', str(error))
+
+    def test_not_running(self):
+        self.server.stop()
+        self.assertIsNone(supervisor.control(self.path, 'status'))
+
+    def test_concurrent(self):
+        slow = threading.Thread(target=supervisor.control,
+                                args=(self.path, 'slow'))
+        slow.start()
+        self.addCleanup(slow.join)
+        time.sleep(0.05)
+        start = time.time()
+        supervisor.control(self.path, 'status')
+        # Not held up by the slow request
+        self.assertLess(time.time() - start, 0.4)
+
+    def test_timeout(self):
+        self.assertRaises(exception.PoorBMCError, supervisor.control,
+                          self.path, 'slow', timeout=0.1)
@@ -0,0 +1,137 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+import json
+import os
+import threading
+
+import fixtures
+import mock
+
+from poorbmc import exception
+from poorbmc import trace
+from poorbmc.tests.unit import base
+
+
+class NoopTraceTestCase(base.TestCase):
+
+    @mock.patch.object(trace, '_tracer', None)
+    def test_noop(self):
+        with trace.span('ipmi.power', bmc='node1') as span:
+            span.set_attribute('state', 'on')
+            self.assertIsNone(trace.current_span())
+        self.assertIs(trace._NOOP_SPAN, span)
+
+
+class FileTracerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(FileTracerTestCase, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'trace.jsonl')
+        self.tracer = trace.FileTracer(self.path, 1.0)
+        patcher = mock.patch.object(trace, '_tracer', self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._close)
+
+    def _close(self):
+        if self.tracer._fd is not None:
+            os.close(self.tracer._fd)
+
+    def _spans(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_nested(self):
+        with trace.span('ipmi.power', bmc='node1') as root:
+            with trace.span('snmp.SET', pdu='pdu1') as child:
+                child.set_attribute('attempts', 1)
+                self.assertIs(child, trace.current_span())
+            # Written once the outermost span ends
+            self.assertEqual([], self._spans())
+        self.assertIsNone(trace.current_span())
+
+        child, root = self._spans()
+        self.assertEqual('snmp.SET', child['name'])
+        self.assertEqual({'pdu': 'pdu1', 'attempts': 1},
+                         child['attributes'])
+        self.assertEqual(root['span_id'], child['parent_id'])
+        self.assertEqual(root['trace_id'], child['trace_id'])
+        self.assertIsNone(root['parent_id'])
+        self.assertEqual(32, len(root['trace_id']))
+        self.assertGreaterEqual(root['duration'], child['duration'])
+
+    def test_error(self):
+        def fail():
+            with trace.span('snmp.GET'):
+                raise ValueError('boom')
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual('ValueError: boom', self._spans()[0]['error'])
+
+    def test_explicit_parent(self):
+        with trace.span('power.command') as root:
+            parent = trace.current_span()
+
+            def confirm():
+                with trace.span('power.confirm', parent=parent):
+                    pass
+
+            thread = threading.Thread(target=confirm)
+            thread.start()
+            thread.join()
+        # The span of the other thread is written on its own
+        confirm = self._spans()[0]
+        self.assertEqual('power.confirm', confirm['name'])
+        self.assertEqual(root.span_id, confirm['parent_id'])
+        self.assertEqual(root.trace_id, confirm['trace_id'])
+
+    def test_not_sampled(self):
+        self.tracer.sample_rate = 0
+        with trace.span('ipmi.power') as span:
+            self.assertIs(trace._NOOP_SPAN, span)
+            self.assertIsNone(trace.current_span())
+            self.tracer.sample_rate = 1.0
+            # Children of unsampled traces are not recorded either
+            with trace.span('snmp.SET') as child:
+                self.assertIs(trace._NOOP_SPAN, child)
+        self.assertEqual([], self._spans())
+
+
+class CreateTracerTestCase(base.TestCase):
+
+    def _create(self, **settings):
+        with mock.patch.dict(trace.CONF['trace'], settings):
+            return trace._create_tracer()
+
+    def test_none(self):
+        self.assertIsNone(self._create(exporter=trace.EXPORTER_NONE))
+
+    def test_file(self):
+        tracer = self._create(exporter=trace.EXPORTER_FILE,
+                              file='/tmp/trace.jsonl', sample_rate=0.5)
+        self.assertIsInstance(tracer, trace.FileTracer)
+        self.assertEqual(0.5, tracer.sample_rate)
+
+    def test_unknown(self):
+        self.assertRaises(exception.PoorBMCError, self._create,
+                          exporter='zipkin')
+
+    @mock.patch.object(trace.importutils, 'try_import', return_value=None)
+    def test_otlp_missing(self, mock_import):
+        error = self.assertRaises(exception.PoorBMCError, self._create,
+                                  exporter=trace.EXPORTER_OTLP)
+        self.assertIn('opentelemetry-sdk', str(error))
@@ -0,0 +1,102 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+import threading
+
+import mock
+
+from poorbmc import traps
+from poorbmc.tests.unit import base
+
+
+def _message(version, pdu_type):
+    p = traps.api.protoModules[version]
+    pdu = getattr(p, pdu_type)()
+    if pdu_type == 'TrapPDU':
+        p.apiTrapPDU.setDefaults(pdu)
+    else:
+        p.apiPDU.setDefaults(pdu)
+    msg = p.Message()
+    p.apiMessage.setDefaults(msg)
+    p.apiMessage.setCommunity(msg, 'public')
+    p.apiMessage.setPDU(msg, pdu)
+    return traps.encoder.encode(msg)
+
+
+@mock.patch.dict(traps._subscribers, clear=True)
+class SubscribeTestCase(base.TestCase):
+
+    def test_notify(self):
+        event = threading.Event()
+        other = threading.Event()
+        handle = traps.subscribe('192.0.2.1', event)
+        traps.subscribe('192.0.2.2', other)
+        traps._notify('192.0.2.1')
+        self.assertTrue(event.is_set())
+        self.assertFalse(other.is_set())
+        traps.unsubscribe(handle)
+        self.assertNotIn('192.0.2.1', traps._subscribers)
+        # Unsubscribing twice is harmless
+        traps.unsubscribe(handle)
+
+    def test_notify_ipv4_mapped(self):
+        event = threading.Event()
+        traps.subscribe('192.0.2.1', event)
+        traps._notify('::ffff:192.0.2.1')
+        self.assertTrue(event.is_set())
+
+
+class TrapListenerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(TrapListenerTestCase, self).setUp()
+        patcher = mock.patch.dict(traps._subscribers, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.listener = traps.TrapListener('127.0.0.1', 0)
+        self.listener.start()
+        self.addCleanup(self.listener.stop)
+        self.address = self.listener._socket.getsockname()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(5)
+        self.addCleanup(self.sock.close)
+        self.event = threading.Event()
+        traps.subscribe('127.0.0.1', self.event)
+
+    def _send(self, version, pdu_type):
+        self.sock.sendto(_message(version, pdu_type), self.address)
+
+    def test_trap_v1(self):
+        self._send(traps.api.protoVersion1, 'TrapPDU')
+        self.assertTrue(self.event.wait(5))
+
+    def test_trap_v2c(self):
+        self._send(traps.api.protoVersion2c, 'SNMPv2TrapPDU')
+        self.assertTrue(self.event.wait(5))
+
+    def test_inform(self):
+        self._send(traps.api.protoVersion2c, 'InformRequestPDU')
+        self.assertTrue(self.event.wait(5))
+        data, _ = self.sock.recvfrom(65535)
+        p = traps.api.protoModules[traps.api.protoVersion2c]
+        msg, _ = traps.decoder.decode(data, asn1Spec=p.Message())
+        self.assertTrue(p.apiMessage.getPDU(msg).isSameTypeWith(
+            p.ResponsePDU()))
+
+    def test_ignored(self):
+        self.sock.sendto(b'garbage', self.address)
+        self._send(traps.api.protoVersion2c, 'GetRequestPDU')
+        self.assertFalse(self.event.wait(0.2))
+        # Still listening
+        self._send(traps.api.protoVersion2c, 'SNMPv2TrapPDU')
+        self.assertTrue(self.event.wait(5))
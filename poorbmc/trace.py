@@ -0,0 +1,296 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tracing.
+
+The IPMI request handling, the SNMP requests and the polls made while an
+outlet switches are wrapped in spans, which time them and record how they
+nest, so the time a slow power command spent in each can be told apart.
+The ``[trace]`` section selects where spans go:
+
+* ``none``: spans are not recorded. :func:`span` then returns a shared
+  no-op context manager, so tracing costs a function call.
+* ``file``: spans are appended to a file as JSON lines, written once per
+  trace. The IDs are compatible with OpenTelemetry.
+* ``otlp``: spans are handed to the OpenTelemetry SDK and exported to a
+  collector with OTLP over HTTP (requires the ``opentelemetry-sdk`` and
+  ``opentelemetry-exporter-otlp-proto-http`` packages).
+
+Only a ``sample_rate`` fraction of the traces is recorded.
+"""
+
+import atexit
+import json
+import os
+import random
+import threading
+import time
+
+from oslo_utils import importutils
+
+from poorbmc import config as pbmc_config
+from poorbmc import exception
+from poorbmc import log
+
+LOG = log.get_logger()
+
+CONF = pbmc_config.get_config()
+
+EXPORTER_NONE = 'none'
+EXPORTER_FILE = 'file'
+EXPORTER_OTLP = 'otlp'
+EXPORTERS = (EXPORTER_NONE, EXPORTER_FILE, EXPORTER_OTLP)
+
+
+class _NoopSpan(object):
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+# Pushed instead of a span by the traces that are not sampled, so their
+# children are not recorded either
+_UNSAMPLED = _NoopSpan()
+
+
+class Span(object):
+    """A timed operation, recorded by the file exporter."""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start',
+                 'duration', 'attributes', 'error')
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def as_dict(self):
+        return {'name': self.name,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'start': self.start,
+                'duration': self.duration,
+                'attributes': self.attributes,
+                'error': self.error}
+
+
+class _SpanContext(object):
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        parent = self.parent
+        if parent is None and stack:
+            parent = stack[-1]
+
+        if parent is _UNSAMPLED or (
+                parent is None and
+                random.random() >= self.tracer.sample_rate):
+            self.span = _UNSAMPLED
+            stack.append(_UNSAMPLED)
+            return _NOOP_SPAN
+
+        if parent is None:
+            trace_id, parent_id = '%032x' % random.getrandbits(128), None
+        else:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        self.span = Span(self.name, trace_id, parent_id, self.attributes)
+        stack.append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack = self.tracer.stack()
+        stack.pop()
+        span = self.span
+        if span is not _UNSAMPLED:
+            span.duration = time.time() - span.start
+            if exc_value is not None:
+                span.error = '%s: %s' % (exc_type.__name__, exc_value)
+            self.tracer.finish(span, root=not stack)
+        return False
+
+
+class FileTracer(object):
+    """Record spans to a file, as JSON lines.
+
+    The spans of a thread are buffered until its outermost span ends, then
+    appended to the file with a single write, so the BMC daemons of a host
+    can share the file.
+
+    :param path: The path of the file.
+    :param sample_rate: The fraction of the traces recorded.
+    """
+
+    def __init__(self, path, sample_rate):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._local = threading.local()
+        self._fd = None
+        self._fd_pid = None
+        self._lock = threading.Lock()
+
+    def stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            self._local.finished = []
+            return self._local.stack
+
+    def current_span(self):
+        stack = self.stack()
+        if stack and stack[-1] is not _UNSAMPLED:
+            return stack[-1]
+        return None
+
+    def span(self, name, parent, attributes):
+        return _SpanContext(self, name, parent, attributes)
+
+    def finish(self, span, root):
+        finished = self._local.finished
+        finished.append(span)
+        if root:
+            self._local.finished = []
+            self._write(finished)
+
+    def _write(self, spans):
+        data = ''.join(json.dumps(span.as_dict(), default=str,
+                                  sort_keys=True) + '\n'
+                       for span in spans).encode('utf-8')
+        with self._lock:
+            try:
+                # File descriptors must not be shared with forked children
+                if self._fd is None or self._fd_pid != os.getpid():
+                    self._fd = os.open(
+                        self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                        0o644)
+                    self._fd_pid = os.getpid()
+                os.write(self._fd, data)
+            except OSError as e:
+                LOG.warning('Error writing spans to %(path)s. '
+                            'Error: %(error)s',
+                            {'path': self.path, 'error': e})
+
+
+class OTLPTracer(object):
+    """Hand spans to the OpenTelemetry SDK, exported over OTLP/HTTP.
+
+    :param endpoint: The URL of the collector's traces endpoint.
+    :param sample_rate: The fraction of the traces recorded.
+    """
+
+    def __init__(self, endpoint, sample_rate):
+        otel_trace = importutils.try_import('opentelemetry.trace')
+        sdk_trace = importutils.try_import('opentelemetry.sdk.trace')
+        sdk_export = importutils.try_import(
+            'opentelemetry.sdk.trace.export')
+        sdk_sampling = importutils.try_import(
+            'opentelemetry.sdk.trace.sampling')
+        sdk_resources = importutils.try_import(
+            'opentelemetry.sdk.resources')
+        otlp = importutils.try_import(
+            'opentelemetry.exporter.otlp.proto.http.trace_exporter')
+        if None in (otel_trace, sdk_trace, sdk_export, sdk_sampling,
+                    sdk_resources, otlp):
+            raise exception.PoorBMCError(
+                'The otlp trace exporter requires the opentelemetry-sdk '
+                'and opentelemetry-exporter-otlp-proto-http packages')
+
+        self._otel_trace = otel_trace
+        provider = sdk_trace.TracerProvider(
+            resource=sdk_resources.Resource.create(
+                {'service.name': 'poorbmc'}),
+            sampler=sdk_sampling.ParentBased(
+                sdk_sampling.TraceIdRatioBased(sample_rate)))
+        provider.add_span_processor(sdk_export.BatchSpanProcessor(
+            otlp.OTLPSpanExporter(endpoint=endpoint)))
+        atexit.register(provider.shutdown)
+        self._tracer = provider.get_tracer(__name__)
+
+    def current_span(self):
+        span = self._otel_trace.get_current_span()
+        return span if span.get_span_context().is_valid else None
+
+    def span(self, name, parent, attributes):
+        context = None
+        if parent is not None:
+            context = self._otel_trace.set_span_in_context(parent)
+        return self._tracer.start_as_current_span(
+            name, context=context, attributes=attributes)
+
+
+def _create_tracer():
+    conf = CONF['trace']
+    exporter = conf['exporter']
+    if exporter == EXPORTER_NONE:
+        return None
+    if exporter == EXPORTER_FILE:
+        return FileTracer(conf['file'], conf['sample_rate'])
+    if exporter == EXPORTER_OTLP:
+        return OTLPTracer(conf['otlp_endpoint'], conf['sample_rate'])
+    raise exception.PoorBMCError(
+        'Unknown trace exporter %(exporter)s, expected one of '
+        '%(exporters)s' % {'exporter': exporter,
+                           'exporters': ', '.join(EXPORTERS)})
+
+
+_tracer = _create_tracer()
+
+
+def span(name, parent=None, **attributes):
+    """Return a context manager timing an operation.
+
+    The span is a child of the span the current thread is in, if any.
+    The context manager returns the span, whose ``set_attribute(key,
+    value)`` records more details about the operation.
+
+    :param name: The name of the operation, e.g. ``snmp.GET``.
+    :param parent: The parent span, when the operation is run by another
+        thread than the one that started it (see :func:`current_span`).
+    :param attributes: Details about the operation.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NOOP_SPAN
+    return tracer.span(name, parent, attributes)
+
+
+def current_span():
+    """Return the span the current thread is in, or ``None``."""
+    tracer = _tracer
+    if tracer is None:
+        return None
+    return tracer.current_span()
@@ -0,0 +1,171 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+SNMP trap listener.
+
+PDUs can be configured to send a trap (or inform) whenever an outlet
+switches, e.g. the APC outletOn/outletOff traps. The listener wakes up the
+power commands waiting on any outlet of the PDU a notification came from,
+so they confirm the new state right away instead of at their next poll.
+Notifications are only used as a hint: the state is always confirmed by
+reading it from the PDU.
+"""
+
+import socket
+import threading
+
+from oslo_log import log as logging
+from oslo_utils import importutils
+
+pysnmp = importutils.try_import('pysnmp')
+if pysnmp:
+    from pyasn1.codec.ber import decoder
+    from pyasn1.codec.ber import encoder
+    from pysnmp.proto import api
+else:
+    decoder = None
+    encoder = None
+    api = None
+
+LOG = logging.getLogger(__name__)
+
+# Events to set when a notification comes from a PDU, by PDU IP address
+_subscribers = {}
+_subscribers_lock = threading.Lock()
+
+_listener = None
+
+
+def _resolve(address):
+    try:
+        return socket.gethostbyname(address)
+    except socket.error:
+        return address
+
+
+def subscribe(pdu_address, event):
+    """Set ``event`` whenever a notification comes from ``pdu_address``.
+
+    :returns: A handle to pass to :func:`unsubscribe`.
+    """
+    key = _resolve(pdu_address)
+    with _subscribers_lock:
+        _subscribers.setdefault(key, set()).add(event)
+    return key, event
+
+
+def unsubscribe(handle):
+    key, event = handle
+    with _subscribers_lock:
+        events = _subscribers.get(key)
+        if events is not None:
+            events.discard(event)
+            if not events:
+                del _subscribers[key]
+
+
+def is_listening():
+    return _listener is not None
+
+
+def _notify(pdu_address):
+    if pdu_address.startswith('::ffff:'):
+        # IPv4 sender seen through a dual-stack socket
+        pdu_address = pdu_address[len('::ffff:'):]
+    with _subscribers_lock:
+        events = list(_subscribers.get(pdu_address, ()))
+    for event in events:
+        event.set()
+
+
+class TrapListener(object):
+    """Receive SNMPv1/v2c traps and informs on a UDP socket."""
+
+    def __init__(self, address, port):
+        self.address = address
+        self.port = port
+        self._socket = None
+        self._thread = None
+
+    def start(self):
+        family = socket.AF_INET6 if ':' in self.address else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        self._socket.bind((self.address, self.port))
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        LOG.info('Listening for SNMP traps on %(address)s:%(port)s',
+                 {'address': self.address, 'port': self.port})
+
+    def stop(self):
+        if self._socket is not None:
+            sock, self._socket = self._socket, None
+            try:
+                # Wake up the thread blocked in recvfrom()
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+
+    def _handle(self, data, sockaddr):
+        version = int(api.decodeMessageVersion(data))
+        p = api.protoModules[version]
+        msg, _ = decoder.decode(data, asn1Spec=p.Message())
+        pdu = p.apiMessage.getPDU(msg)
+
+        if version == api.protoVersion1:
+            if not pdu.isSameTypeWith(p.TrapPDU()):
+                return
+        elif pdu.isSameTypeWith(p.InformRequestPDU()):
+            # Informs must be acknowledged or the PDU keeps resending them
+            rsp = p.apiMessage.getResponse(msg)
+            self._socket.sendto(encoder.encode(rsp), sockaddr)
+        elif not pdu.isSameTypeWith(p.SNMPv2TrapPDU()):
+            return
+
+        LOG.debug('SNMP notification received from %s', sockaddr[0])
+        _notify(sockaddr[0])
+
+    def _run(self):
+        while self._socket is not None:
+            try:
+                data, sockaddr = self._socket.recvfrom(65535)
+            except (socket.error, AttributeError):
+                # The socket was closed by stop()
+                break
+            if self._socket is None:
+                # Woken up by the shutdown in stop()
+                break
+            try:
+                self._handle(data, sockaddr)
+            except Exception as e:
+                LOG.debug('Ignoring malformed SNMP notification from '
+                          '%(addr)s: %(error)s',
+                          {'addr': sockaddr[0], 'error': e})
+
+
+def start_listener(address, port):
+    """Start the trap listener of the process."""
+    global _listener
+    if _listener is None:
+        listener = TrapListener(address, port)
+        listener.start()
+        _listener = listener
+    return _listener
+
+
+def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
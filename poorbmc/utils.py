@@ -10,10 +10,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import errno
+import fcntl
 import os
+import re
 
 from poorbmc import exception
 
+# BMC names end up in file names and, unquoted or in double quotes, in the
+# scripts read by GRUB and iPXE: no white space, quotes, '$' or '/'
+BMC_NAME_RE = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.:@+-]*\Z')
+
 
 def is_pid_running(pid):
     try:
@@ -23,6 +30,52 @@ def is_pid_running(pid):
         return False
 
 
+def lock_pidfile(path, pid):
+    """Write a PID file and hold a lock on it until the process exits.
+
+    Unlike the PID it holds, the lock can not outlive the process: the
+    kernel releases it however the process exits, so a PID recycled by
+    another process is never mistaken for a running BMC (see
+    :func:`is_pidfile_locked`).
+
+    :raises: PoorBMCError if the process that wrote the PID file is still
+        running.
+    :returns: The file descriptor holding the lock, to be kept open.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EWOULDBLOCK, errno.EAGAIN,
+                               errno.EACCES):
+                raise
+            raise exception.PoorBMCError(
+                'Already running: the process of PID file %s still holds '
+                'it' % path)
+        os.ftruncate(fd, 0)
+        os.write(fd, str(pid).encode('ascii'))
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+
+def is_pidfile_locked(path):
+    """Whether the process that wrote a PID file is still running."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
 def str2bool(string):
     lower = string.lower()
     if lower not in ('true', 'false'):
@@ -32,10 +85,10 @@ def str2bool(string):
 
 
 def mask_dict_password(dictionary, secret='***'):
-    """Replace passwords with a secret in a dictionary."""
+    """Replace passwords and keys with a secret in a dictionary."""
     d = dictionary.copy()
     for k in d:
-        if 'password' in k:
+        if 'password' in k or (k.endswith('_key') and d[k]):
             d[k] = secret
     return d
 
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measure the startup time of the pbmc command.
+
+Runs a pbmc command (``pbmc list`` by default) in fresh interpreters and
+reports its wall clock time, then checks which of the slow to import
+dependencies it loaded: read-only commands should not load any of them.
+
+Example::
+
+  python tools/bench_startup.py --runs 20 show node01
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Dependencies only the IPMI and SNMP commands should import
+HEAVY_MODULES = ('pyghmi', 'pysnmp', 'pysmi', 'oslo_log', 'oslo_service',
+                 'oslo_utils', 'yaml')
+
+_PROBE = '''
+import sys
+from poorbmc.cmd import pbmc
+try:
+    pbmc.main(%(argv)r)
+except SystemExit:
+    pass
+loaded = set(name.split('.')[0] for name in sys.modules)
+sys.stderr.write('LOADED %%s\\n' %% ' '.join(sorted(loaded & set(%(heavy)r))))
+'''
+
+
+def _run(argv):
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        subprocess.check_call(
+            [sys.executable, '-m', 'poorbmc.cmd.pbmc'] + argv,
+            stdout=devnull)
+        return time.time() - start
+
+
+def _loaded_modules(argv):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(
+            [sys.executable, '-c',
+             _PROBE % {'argv': argv, 'heavy': HEAVY_MODULES}],
+            stdout=devnull, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        _, err = proc.communicate()
+    for line in err.splitlines():
+        if line.startswith('LOADED'):
+            return line.split()[1:]
+    raise RuntimeError('pbmc %s failed:\n%s' % (' '.join(argv), err))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Number of runs; defaults to 10')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='The pbmc command; defaults to "list"')
+    args = parser.parse_args()
+    argv = args.command or ['list']
+
+    # Warm up the file system cache
+    _run(argv)
+    times = sorted(_run(argv) for _ in range(args.runs))
+
+    print('pbmc %s: %d runs, min %.1f ms, median %.1f ms, max %.1f ms' %
+          (' '.join(argv), args.runs, times[0] * 1000,
+           times[len(times) // 2] * 1000, times[-1] * 1000))
+
+    loaded = _loaded_modules(argv)
+    print('Heavy modules loaded: %s' % (', '.join(loaded) or 'none'))
+    return 1 if loaded and argv[0] in ('list', 'show') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
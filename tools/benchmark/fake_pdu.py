@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+A fake APC MasterSwitch PDU.
+
+Answers the SNMPv1 and SNMPv2c GET, GETNEXT and SET requests on the
+sPDUOutletCtl objects (1.3.6.1.4.1.318.1.1.4.4.2.1.3.<outlet>) of a
+simulated PDU, with a configurable response latency, request loss and
+outlet switching delay, so the SNMP side of poorbmc can be exercised
+without hardware. The benchmark runs it in a thread; it can also be run on
+its own, for the ``apc`` driver (any community is accepted)::
+
+  python tools/benchmark/fake_pdu.py --port 16161 --latency 0.005
+"""
+
+import argparse
+import heapq
+import random
+import select
+import socket
+import threading
+import time
+
+from pyasn1.codec.ber import decoder
+from pyasn1.codec.ber import encoder
+from pysnmp.proto import api
+
+# sPDUOutletCtl
+OID_OUTLET_CTL = (1, 3, 6, 1, 4, 1, 318, 1, 1, 4, 4, 2, 1, 3)
+
+# sPDUOutletCtl values
+ON = 1
+OFF = 2
+REBOOT = 3
+
+# SNMP error statuses
+_NO_SUCH_NAME = 2
+_BAD_VALUE = 3
+
+
+class FakePDU(object):
+    """A simulated APC MasterSwitch PDU.
+
+    :param address: The address to listen on.
+    :param port: The UDP port to listen on; 0 picks a free one.
+    :param outlets: The number of outlets, all initially on.
+    :param latency: Time (in seconds) taken to answer a request.
+    :param jitter: Maximum random time (in seconds) added to ``latency``.
+    :param loss: Fraction of the requests silently dropped.
+    :param switch_delay: Time (in seconds) an outlet takes to switch after
+        a SET.
+    :param reboot_time: Time (in seconds) an outlet stays off when power
+        cycled.
+    :param seed: Seed of the random loss and jitter, for reproducible runs.
+    """
+
+    def __init__(self, address='127.0.0.1', port=16161, outlets=48,
+                 latency=0.0, jitter=0.0, loss=0.0, switch_delay=0.0,
+                 reboot_time=1.0, seed=None):
+        self.outlets = outlets
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.switch_delay = switch_delay
+        self.reboot_time = reboot_time
+        self.requests = 0
+        self.dropped = 0
+        self._random = random.Random(seed)
+        self._states = dict((outlet, ON)
+                            for outlet in range(1, outlets + 1))
+        # Scheduled outlet state changes: outlet -> [(time, value), ...]
+        self._transitions = {}
+        # Responses waiting for their latency: [(due, n, data, addr), ...]
+        self._pending = []
+        self._sent = 0
+        self._running = False
+        self._thread = None
+
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        self._socket.bind((address, port))
+
+    @property
+    def port(self):
+        return self._socket.getsockname()[1]
+
+    def state(self, outlet, now=None):
+        """Return the current sPDUOutletCtl value of an outlet."""
+        if now is None:
+            now = time.time()
+        transitions = self._transitions.get(outlet)
+        while transitions and transitions[0][0] <= now:
+            self._states[outlet] = transitions.pop(0)[1]
+        return self._states[outlet]
+
+    def _switch(self, outlet, value, now):
+        start = now + self.switch_delay
+        if value == REBOOT:
+            self._transitions[outlet] = [(start, OFF),
+                                         (start + self.reboot_time, ON)]
+        else:
+            self._transitions[outlet] = [(start, value)]
+
+    def _outlet(self, oid):
+        if (len(oid) == len(OID_OUTLET_CTL) + 1 and
+                oid[:-1] == OID_OUTLET_CTL and oid[-1] in self._states):
+            return oid[-1]
+        return None
+
+    def _next_outlet(self, oid):
+        if oid < OID_OUTLET_CTL + (1,):
+            outlet = 1
+        elif oid[:len(OID_OUTLET_CTL)] == OID_OUTLET_CTL:
+            outlet = oid[len(OID_OUTLET_CTL)] + 1
+        else:
+            return None
+        return outlet if outlet in self._states else None
+
+    def handle(self, message):
+        """Return the response to an SNMP request message.
+
+        :param message: The BER encoded request.
+        :returns: The BER encoded response, or ``None`` if the request is
+            not understood.
+        """
+        version = int(api.decodeMessageVersion(message))
+        proto = api.protoModules[version]
+        request, _ = decoder.decode(message, asn1Spec=proto.Message())
+        request_pdu = proto.apiMessage.getPDU(request)
+        response = proto.apiMessage.getResponse(request)
+        response_pdu = proto.apiMessage.getPDU(response)
+        is_set = request_pdu.isSameTypeWith(proto.SetRequestPDU())
+        is_next = request_pdu.isSameTypeWith(proto.GetNextRequestPDU())
+
+        now = time.time()
+        var_binds = []
+        for index, (oid, value) in enumerate(
+                proto.apiPDU.getVarBinds(request_pdu), 1):
+            oid = tuple(oid)
+            if is_next:
+                outlet = self._next_outlet(oid)
+                if outlet is None:
+                    var_binds.append((oid, value))
+                    proto.apiPDU.setEndOfMibError(response_pdu, index)
+                    continue
+                oid = OID_OUTLET_CTL + (outlet,)
+            else:
+                outlet = self._outlet(oid)
+                if outlet is None:
+                    var_binds.append((oid, value))
+                    if is_set:
+                        proto.apiPDU.setErrorStatus(response_pdu,
+                                                    _NO_SUCH_NAME)
+                        proto.apiPDU.setErrorIndex(response_pdu, index)
+                    else:
+                        proto.apiPDU.setNoSuchInstanceError(response_pdu,
+                                                            index)
+                    continue
+
+            if is_set:
+                if int(value) not in (ON, OFF, REBOOT):
+                    var_binds.append((oid, value))
+                    proto.apiPDU.setErrorStatus(response_pdu, _BAD_VALUE)
+                    proto.apiPDU.setErrorIndex(response_pdu, index)
+                    continue
+                self._switch(outlet, int(value), now)
+                var_binds.append((oid, value))
+            else:
+                var_binds.append(
+                    (oid, proto.Integer(self.state(outlet, now))))
+
+        proto.apiPDU.setVarBinds(response_pdu, var_binds)
+        return encoder.encode(response)
+
+    def _receive(self):
+        message, addr = self._socket.recvfrom(65535)
+        self.requests += 1
+        if self.loss and self._random.random() < self.loss:
+            self.dropped += 1
+            return
+        try:
+            response = self.handle(message)
+        except Exception:
+            # Not an SNMP request we understand
+            return
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        self._sent += 1
+        heapq.heappush(self._pending,
+                       (time.time() + delay, self._sent, response, addr))
+
+    def serve_forever(self):
+        """Answer requests until :meth:`stop` is called."""
+        self._running = True
+        while self._running:
+            timeout = 0.1
+            if self._pending:
+                timeout = max(0, min(timeout,
+                                     self._pending[0][0] - time.time()))
+            readable, _, _ = select.select([self._socket], [], [], timeout)
+            if readable:
+                self._receive()
+            now = time.time()
+            while self._pending and self._pending[0][0] <= now:
+                _, _, response, addr = heapq.heappop(self._pending)
+                self._socket.sendto(response, addr)
+
+    def start(self):
+        """Answer requests from a thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--address', default='127.0.0.1',
+                        help='Address to listen on; defaults to 127.0.0.1')
+    parser.add_argument('--port', type=int, default=16161,
+                        help='UDP port to listen on; defaults to 16161')
+    parser.add_argument('--outlets', type=int, default=48,
+                        help='Number of outlets; defaults to 48')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds taken to answer a request')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Maximum random seconds added to the latency')
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help='Fraction of the requests dropped')
+    parser.add_argument('--switch_delay', type=float, default=0.0,
+                        help='Seconds an outlet takes to switch')
+    parser.add_argument('--reboot_time', type=float, default=1.0,
+                        help='Seconds an outlet stays off when power '
+                             'cycled; defaults to 1')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed of the random loss and jitter')
+    args = parser.parse_args()
+
+    pdu = FakePDU(args.address, args.port, args.outlets, args.latency,
+                  args.jitter, args.loss, args.switch_delay,
+                  args.reboot_time, args.seed)
+    print('Fake PDU with %d outlets listening on %s:%d' %
+          (args.outlets, args.address, pdu.port))
+    try:
+        pdu.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+A minimal IPMI 2.0 (RMCP+) client.
+
+Just enough of the protocol to load a BMC like ``ipmitool -I lanplus``
+does: a session is opened with cipher suite 3 (RAKP-HMAC-SHA1,
+HMAC-SHA1-96 integrity, AES-CBC-128 confidentiality, the only one pyghmi
+serves), then requests are sent one at a time and retried when their
+response does not arrive in time. Unlike pyghmi's client, a session owns
+its socket and does not need an IO thread, so many of them can be driven
+from as many threads.
+"""
+
+import hashlib
+import hmac
+import os
+import socket
+import struct
+import time
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import algorithms
+from cryptography.hazmat.primitives.ciphers import Cipher
+from cryptography.hazmat.primitives.ciphers import modes
+
+_RMCP_HEADER = b'\x06\x00\xff\x07'
+
+# Payload types
+_IPMI = 0x00
+_OPEN_SESSION_REQUEST = 0x10
+_OPEN_SESSION_RESPONSE = 0x11
+_RAKP1 = 0x12
+_RAKP2 = 0x13
+_RAKP3 = 0x14
+_RAKP4 = 0x15
+
+_ENCRYPTED = 0x80
+_AUTHENTICATED = 0x40
+
+_BMC_ADDRESS = 0x20
+_SOFTWARE_ID = 0x81
+
+# Requested maximum privilege level
+_ADMINISTRATOR = 4
+
+# netfn, command
+GET_CHASSIS_STATUS = (0x00, 0x01)
+CHASSIS_CONTROL = (0x00, 0x02)
+GET_CHANNEL_AUTH_CAPABILITIES = (0x06, 0x38)
+CLOSE_SESSION = (0x06, 0x3c)
+
+# Chassis control directives
+POWER_OFF = 0
+POWER_ON = 1
+POWER_RESET = 3
+
+# Completion code of a command that failed and can be retried
+NODE_BUSY = 0xc0
+
+
+class IPMIError(Exception):
+    pass
+
+
+class IPMITimeout(IPMIError):
+    pass
+
+
+def _checksum(data):
+    return -sum(bytearray(data)) & 0xff
+
+
+def _ipmi_message(netfn, command, seq, data):
+    header = bytearray((_BMC_ADDRESS, netfn << 2))
+    body = bytearray((_SOFTWARE_ID, seq << 2, command)) + bytearray(data)
+    return (header + bytearray((_checksum(header),)) + body +
+            bytearray((_checksum(body),)))
+
+
+def _hmac_sha1(key, data):
+    return hmac.new(key, bytes(data), hashlib.sha1).digest()
+
+
+class Session(object):
+    """An RMCP+ session with a BMC.
+
+    :param address: The address of the BMC.
+    :param port: The UDP port of the BMC.
+    :param username: The user to log in as.
+    :param password: Its password.
+    :param timeout: Time (in seconds) to wait for a response before
+        sending the request again.
+    :param retries: Number of times a request is sent again.
+    """
+
+    def __init__(self, address, port, username, password, timeout=1.0,
+                 retries=3):
+        self.address = address
+        self.port = port
+        self.username = username.encode('utf-8')
+        self.password = password.encode('utf-8')
+        self.timeout = timeout
+        self.retries = retries
+        self.retransmits = 0
+        self._seq = 0
+        self._session_seq = 0
+        self._console_id = None
+        self._bmc_id = None
+        self._k1 = None
+        self._aes_key = None
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        self._socket.connect((address, port))
+
+    def _exchange(self, packet, accept):
+        """Send a packet until ``accept`` returns a value for a response."""
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retransmits += 1
+            self._socket.send(packet)
+            deadline = time.time() + self.timeout
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._socket.settimeout(remaining)
+                try:
+                    data = bytearray(self._socket.recv(65535))
+                except socket.timeout:
+                    break
+                except socket.error:
+                    # ICMP port unreachable: nothing listens (yet)
+                    time.sleep(remaining)
+                    break
+                result = accept(data)
+                if result is not None:
+                    return result
+        raise IPMITimeout('No response from %s:%d' %
+                          (self.address, self.port))
+
+    def _sessionless_payload(self, payload_type, payload):
+        return (_RMCP_HEADER + bytearray((6, payload_type)) +
+                b'\x00' * 8 + struct.pack('<H', len(payload)) + payload)
+
+    def _accept_sessionless(self, payload_type, tag):
+        def accept(data):
+            if (len(data) < 18 or data[:4] != _RMCP_HEADER or
+                    data[4] != 6 or data[5] & 0x3f != payload_type):
+                return None
+            length = struct.unpack('<H', bytes(data[14:16]))[0]
+            payload = data[16:16 + length]
+            if payload[0] != tag:
+                return None
+            if payload[1] != 0:
+                raise IPMIError('Session establishment failed with status '
+                                '0x%02x' % payload[1])
+            return payload
+        return accept
+
+    def ping(self):
+        """Send a Get Channel Authentication Capabilities request.
+
+        It does not need a session, which makes it a cheap liveness check.
+
+        :raises: IPMITimeout if the BMC does not answer.
+        """
+        self._seq = (self._seq + 1) & 0x3f
+        message = _ipmi_message(0x06, 0x38, self._seq,
+                                (0x8e, _ADMINISTRATOR))
+        packet = (_RMCP_HEADER + b'\x00' + b'\x00' * 8 +
+                  bytearray((len(message),)) + message)
+
+        def accept(data):
+            if len(data) > 20 and data[4] == 0 and data[19] == 0x38:
+                return data[20]
+            return None
+        code = self._exchange(bytes(packet), accept)
+        if code:
+            raise IPMIError('Get Channel Authentication Capabilities failed '
+                            'with completion code 0x%02x' % code)
+
+    def open(self):
+        """Open the session.
+
+        :raises: IPMIError if the BMC rejects the credentials.
+        :raises: IPMITimeout if the BMC does not answer.
+        """
+        self._console_id = os.urandom(4)
+
+        # Open Session Request, proposing cipher suite 3
+        tag = 1
+        request = (bytearray((tag, _ADMINISTRATOR, 0, 0)) +
+                   self._console_id +
+                   bytearray((0, 0, 0, 8, 1, 0, 0, 0,
+                              1, 0, 0, 8, 1, 0, 0, 0,
+                              2, 0, 0, 8, 1, 0, 0, 0)))
+        response = self._exchange(
+            bytes(self._sessionless_payload(_OPEN_SESSION_REQUEST, request)),
+            self._accept_sessionless(_OPEN_SESSION_RESPONSE, tag))
+        self._bmc_id = bytes(response[8:12])
+
+        # RAKP Message 1
+        tag = 2
+        rm = os.urandom(16)
+        role = bytearray((_ADMINISTRATOR, len(self.username)))
+        request = (bytearray((tag, 0, 0, 0)) + self._bmc_id + rm +
+                   bytearray((_ADMINISTRATOR, 0, 0, len(self.username))) +
+                   self.username)
+        response = self._exchange(
+            bytes(self._sessionless_payload(_RAKP1, request)),
+            self._accept_sessionless(_RAKP2, tag))
+        rc = bytes(response[8:24])
+        guid = bytes(response[24:40])
+        expected = _hmac_sha1(self.password,
+                              self._console_id + self._bmc_id + rm + rc +
+                              guid + role + self.username)
+        if bytes(response[40:60]) != expected:
+            raise IPMIError('Invalid password for user %s' %
+                            self.username.decode('utf-8'))
+
+        # RAKP Message 3
+        tag = 3
+        sik = _hmac_sha1(self.password, rm + rc + role + self.username)
+        self._k1 = _hmac_sha1(sik, b'\x01' * 20)
+        self._aes_key = _hmac_sha1(sik, b'\x02' * 20)[:16]
+        request = (bytearray((tag, 0, 0, 0)) + self._bmc_id +
+                   _hmac_sha1(self.password,
+                              rc + self._console_id + role + self.username))
+        response = self._exchange(
+            bytes(self._sessionless_payload(_RAKP3, request)),
+            self._accept_sessionless(_RAKP4, tag))
+        if bytes(response[8:20]) != _hmac_sha1(
+                sik, rm + self._bmc_id + guid)[:12]:
+            raise IPMIError('Invalid RAKP4 integrity check value')
+        self._session_seq = 1
+        return self
+
+    def _session_packet(self, message):
+        pad = 16 - (len(message) + 1) % 16
+        if pad == 16:
+            pad = 0
+        plain = bytes(message + bytearray(range(1, pad + 1)) +
+                      bytearray((pad,)))
+        iv = os.urandom(16)
+        encryptor = Cipher(algorithms.AES(self._aes_key), modes.CBC(iv),
+                           backend=default_backend()).encryptor()
+        payload = iv + encryptor.update(plain) + encryptor.finalize()
+
+        self._session_seq += 1
+        packet = (_RMCP_HEADER +
+                  bytearray((6, _IPMI | _ENCRYPTED | _AUTHENTICATED)) +
+                  self._bmc_id + struct.pack('<I', self._session_seq) +
+                  struct.pack('<H', len(payload)) + payload)
+        pad = (len(packet) - 2) % 4
+        if pad:
+            pad = 4 - pad
+        packet += b'\xff' * pad + bytearray((pad, 7))
+        packet += _hmac_sha1(self._k1, packet[4:])[:12]
+        return bytes(packet)
+
+    def _accept_response(self, netfn, command, seq):
+        def accept(data):
+            if (len(data) < 32 or data[:4] != _RMCP_HEADER or
+                    data[4] != 6 or data[5] & 0x3f != _IPMI or
+                    bytes(data[6:10]) != self._console_id):
+                return None
+            if _hmac_sha1(self._k1, data[4:-12])[:12] != bytes(data[-12:]):
+                return None
+            length = struct.unpack('<H', bytes(data[14:16]))[0]
+            payload = bytes(data[16:16 + length])
+            decryptor = Cipher(algorithms.AES(self._aes_key),
+                               modes.CBC(payload[:16]),
+                               backend=default_backend()).decryptor()
+            message = bytearray(decryptor.update(payload[16:]) +
+                                decryptor.finalize())
+            message = message[:-(message[-1] + 1)]
+            if (message[1] >> 2 != netfn + 1 or message[4] >> 2 != seq or
+                    message[5] != command):
+                return None
+            return message[6], bytes(message[7:-1])
+        return accept
+
+    def request(self, netfn, command, data=()):
+        """Send an IPMI request over the session.
+
+        :returns: A ``(completion code, response data)`` tuple.
+        :raises: IPMITimeout if the BMC does not answer.
+        """
+        self._seq = (self._seq + 1) & 0x3f
+        message = _ipmi_message(netfn, command, self._seq, data)
+        return self._exchange(self._session_packet(message),
+                              self._accept_response(netfn, command,
+                                                    self._seq))
+
+    def get_power_state(self):
+        """Return the power state of the chassis, ``on`` or ``off``.
+
+        :raises: IPMIError if the command fails.
+        """
+        code, data = self.request(*GET_CHASSIS_STATUS)
+        if code:
+            raise IPMIError('Get Chassis Status failed with completion '
+                            'code 0x%02x' % code)
+        return 'on' if bytearray(data)[0] & 1 else 'off'
+
+    def close(self):
+        """Close the session, if open, and the socket."""
+        if self._bmc_id is not None:
+            try:
+                self.request(CLOSE_SESSION[0], CLOSE_SESSION[1],
+                             bytearray(self._bmc_id))
+            except IPMIError:
+                pass
+            self._bmc_id = None
+        self._socket.close()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark the IPMI power commands of pbmc serve.
+
+Configures N BMCs in a throwaway config directory, with their outlets on
+fake APC MasterSwitch PDUs (see fake_pdu.py) run in this process, serves
+them with ``pbmc serve`` and loads them over RMCP+ (see ipmi_client.py),
+one session per BMC and thread. Every operation (chassis status, power
+on, off and reset) is run for ``--duration`` seconds in a closed loop, then
+its throughput and latency percentiles are reported. Commands answered
+with "node busy" (while the previous command of the BMC is confirmed) are
+retried after ``--busy_wait`` seconds and counted apart.
+
+With ``--simulated``, the BMCs use the ``simulated`` PDU driver instead,
+which keeps the outlets in the memory of ``pbmc serve`` with the same
+latency, loss and switching delay: no SNMP is involved, which isolates the
+IPMI side and scales to thousands of BMCs.
+
+Nothing but the loopback interface is used, so it can run in CI: save the
+results of a reference run with ``--json`` and pass them to ``--baseline``
+to fail when an operation gets slower than ``--tolerance`` allows::
+
+  python tools/benchmark/run.py --bmcs 50 --json base.json
+  python tools/benchmark/run.py --bmcs 50 --baseline base.json
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from six.moves import configparser
+
+import fake_pdu
+import ipmi_client
+
+OPERATIONS = {
+    'status': (ipmi_client.GET_CHASSIS_STATUS, ()),
+    'on': (ipmi_client.CHASSIS_CONTROL, (ipmi_client.POWER_ON,)),
+    'off': (ipmi_client.CHASSIS_CONTROL, (ipmi_client.POWER_OFF,)),
+    'reset': (ipmi_client.CHASSIS_CONTROL, (ipmi_client.POWER_RESET,)),
+}
+
+USERNAME = 'admin'
+PASSWORD = 'password'
+
+# Creates the BMCs in the config directory of $HOME, like "pbmc import"
+_ADD_BMCS = '''
+import json, sys
+from poorbmc import manager
+manager.PoorBMCManager().add_many(json.load(sys.stdin))
+'''
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(fraction * len(values))) - 1)]
+
+
+def _ms(value):
+    return None if value is None else round(value * 1000, 3)
+
+
+class Worker(threading.Thread):
+    """Send an operation to a BMC in a loop, recording the latencies."""
+
+    def __init__(self, session, operation, start, deadline, busy_wait):
+        super(Worker, self).__init__()
+        self.daemon = True
+        self.session = session
+        (self.netfn, self.command), self.data = OPERATIONS[operation]
+        self.start_event = start
+        self.deadline = deadline
+        self.busy_wait = busy_wait
+        self.latencies = []
+        self.busy = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def run(self):
+        self.start_event.wait()
+        while time.time() < self.deadline[0]:
+            started = time.time()
+            try:
+                code, _ = self.session.request(self.netfn, self.command,
+                                               self.data)
+            except ipmi_client.IPMITimeout:
+                self.timeouts += 1
+                continue
+            latency = time.time() - started
+            if code == ipmi_client.NODE_BUSY:
+                self.busy += 1
+                time.sleep(self.busy_wait)
+            elif code:
+                self.errors += 1
+            else:
+                self.latencies.append(latency)
+
+
+def run_operation(sessions, operation, duration, busy_wait):
+    start = threading.Event()
+    # Set once every worker is ready, so thread startup is not measured
+    deadline = [None]
+    workers = [Worker(session, operation, start, deadline, busy_wait)
+               for session in sessions]
+    for worker in workers:
+        worker.start()
+    retransmits = sum(session.retransmits for session in sessions)
+    deadline[0] = time.time() + duration
+    began = time.time()
+    start.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - began
+
+    latencies = sorted(latency for worker in workers
+                       for latency in worker.latencies)
+    return {
+        'ok': len(latencies),
+        'busy': sum(worker.busy for worker in workers),
+        'errors': sum(worker.errors for worker in workers),
+        'timeouts': sum(worker.timeouts for worker in workers),
+        'retransmits': sum(session.retransmits
+                           for session in sessions) - retransmits,
+        'throughput': round(len(latencies) / elapsed, 1),
+        'p50_ms': _ms(percentile(latencies, 0.5)),
+        'p99_ms': _ms(percentile(latencies, 0.99)),
+        'max_ms': _ms(latencies[-1] if latencies else None),
+    }
+
+
+def write_config(home, overrides):
+    config_dir = os.path.join(home, '.pbmc')
+    os.makedirs(config_dir)
+    config = configparser.ConfigParser()
+    config.add_section('default')
+    config.set('default', 'config_dir', config_dir)
+    config.add_section('serve')
+    # The BMCs are all created before the server starts
+    config.set('serve', 'rescan_interval', '3600')
+    for override in overrides:
+        key, value = override.split('=', 1)
+        section, key = key.rsplit('.', 1)
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, key, value)
+    with open(os.path.join(config_dir, 'poorbmc.conf'), 'w') as f:
+        config.write(f)
+
+
+def add_bmcs(env, bmcs):
+    proc = subprocess.Popen([sys.executable, '-c', _ADD_BMCS], env=env,
+                            stdin=subprocess.PIPE,
+                            universal_newlines=True)
+    proc.communicate(json.dumps(bmcs))
+    if proc.returncode:
+        raise RuntimeError('Creating the BMCs failed')
+
+
+def wait_listening(bmcs, server, timeout):
+    deadline = time.time() + timeout
+    for bmc in bmcs:
+        session = ipmi_client.Session('127.0.0.1', int(bmc['port']),
+                                      USERNAME, PASSWORD, timeout=0.2,
+                                      retries=0)
+        try:
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError('pbmc serve exited with status %d' %
+                                       server.returncode)
+                try:
+                    session.ping()
+                    break
+                except ipmi_client.IPMITimeout:
+                    if time.time() > deadline:
+                        raise RuntimeError('bmc %s is not answering' %
+                                           bmc['bmc_name'])
+        finally:
+            session.close()
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of the results over a baseline."""
+    regressions = []
+    for operation, result in sorted(results.items()):
+        base = baseline.get(operation)
+        if not base:
+            continue
+        if result['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(
+                '%s: throughput %.1f/s, baseline %.1f/s' %
+                (operation, result['throughput'], base['throughput']))
+        if (base['p99_ms'] is not None and result['p99_ms'] is not None and
+                result['p99_ms'] > base['p99_ms'] * (1 + tolerance)):
+            regressions.append(
+                '%s: p99 %.1f ms, baseline %.1f ms' %
+                (operation, result['p99_ms'], base['p99_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--bmcs', type=int, default=20,
+                        help='Number of BMCs; defaults to 20')
+    parser.add_argument('--pdus', type=int, default=1,
+                        help='Number of fake PDUs the outlets are spread '
+                             'over; defaults to 1')
+    parser.add_argument('--operations', default='status,on,off,reset',
+                        help='Comma separated operations to run, among %s' %
+                             ', '.join(sorted(OPERATIONS)))
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds each operation is run; defaults to 10')
+    parser.add_argument('--busy_wait', type=float, default=0.05,
+                        help='Seconds to wait before retrying a command '
+                             'answered with "node busy"; defaults to 0.05')
+    parser.add_argument('--base_port', type=int, default=16230,
+                        help='IPMI port of the first BMC, the others '
+                             'follow; defaults to 16230')
+    parser.add_argument('--pdu_port', type=int, default=16161,
+                        help='SNMP port of the first fake PDU, the others '
+                             'follow; defaults to 16161')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='Seconds a fake PDU takes to answer a '
+                             'request; defaults to 0.002')
+    parser.add_argument('--jitter', type=float, default=0.001,
+                        help='Maximum random seconds added to the PDU '
+                             'latency; defaults to 0.001')
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help='Fraction of the SNMP requests dropped')
+    parser.add_argument('--switch_delay', type=float, default=0.1,
+                        help='Seconds an outlet takes to switch; '
+                             'defaults to 0.1')
+    parser.add_argument('--reboot_time', type=float, default=0.2,
+                        help='Seconds an outlet stays off when power '
+                             'cycled; defaults to 0.2')
+    parser.add_argument('--simulated', action='store_true', default=False,
+                        help='Use the simulated PDU driver instead of fake '
+                             'SNMP PDUs')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the PDU loss and jitter')
+    parser.add_argument('--set', dest='overrides', action='append',
+                        default=[], metavar='SECTION.KEY=VALUE',
+                        help='Set an option of poorbmc.conf, e.g. '
+                             'power.cache_ttl=0; may be repeated')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--baseline',
+                        help='Compare the results to those of a previous '
+                             'run written with --json, and exit with '
+                             'status 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Fraction by which throughput may drop and '
+                             'p99 latency grow over the baseline; '
+                             'defaults to 0.25')
+    args = parser.parse_args()
+
+    operations = args.operations.split(',')
+    for operation in operations:
+        if operation not in OPERATIONS:
+            parser.error('unknown operation %s' % operation)
+
+    outlets = (args.bmcs + args.pdus - 1) // args.pdus
+    home = tempfile.mkdtemp(prefix='pbmc-benchmark-')
+    env = dict(os.environ, HOME=home)
+    pdus = []
+    server = None
+    sessions = []
+    try:
+        overrides = list(args.overrides)
+        if args.simulated:
+            overrides = ['simulated.latency=%s' % args.latency,
+                         'simulated.failure_rate=%s' % args.loss,
+                         'simulated.switch_delay=%s' % args.switch_delay,
+                         'simulated.reboot_time=%s' % args.reboot_time,
+                         'simulated.initial_state=on'] + overrides
+        write_config(home, overrides)
+        for i in range(0 if args.simulated else args.pdus):
+            pdus.append(fake_pdu.FakePDU(
+                port=args.pdu_port + i, outlets=outlets,
+                latency=args.latency, jitter=args.jitter, loss=args.loss,
+                switch_delay=args.switch_delay,
+                reboot_time=args.reboot_time,
+                seed=args.seed + i).start())
+
+        bmcs = [{'bmc_name': 'bench-%05d' % i,
+                 'username': USERNAME,
+                 'password': PASSWORD,
+                 'address': '127.0.0.1',
+                 'port': str(args.base_port + i),
+                 'snmp_address': '127.0.0.1',
+                 'snmp_port': str(args.pdu_port + i % args.pdus),
+                 'snmp_outlet': str(i // args.pdus + 1),
+                 'snmp_community': 'private',
+                 'snmp_driver': ('simulated' if args.simulated
+                                 else 'apc_masterswitch')}
+                for i in range(args.bmcs)]
+        add_bmcs(env, bmcs)
+
+        with open(os.path.join(home, 'serve.log'), 'w') as log:
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'poorbmc.cmd.pbmc', 'serve',
+                 '--foreground'], env=env, stdout=log, stderr=log)
+        try:
+            wait_listening(bmcs, server, timeout=60)
+        except RuntimeError:
+            with open(os.path.join(home, 'serve.log')) as log:
+                sys.stderr.write(log.read())
+            raise
+
+        for bmc in bmcs:
+            sessions.append(ipmi_client.Session(
+                '127.0.0.1', int(bmc['port']), USERNAME, PASSWORD).open())
+
+        print('%d BMCs on %d %s PDUs (latency %.1f ms, loss %.1f%%, '
+              'switch delay %.1f s), %.0f s per operation' %
+              (args.bmcs, args.pdus,
+               'simulated' if args.simulated else 'fake',
+               args.latency * 1000, args.loss * 100, args.switch_delay,
+               args.duration))
+        print('%-8s %8s %8s %8s %8s %10s %9s %9s %9s' %
+              ('op', 'ok', 'busy', 'errors', 'timeouts', 'ok/s',
+               'p50 ms', 'p99 ms', 'max ms'))
+        results = {}
+        for operation in operations:
+            result = results[operation] = run_operation(
+                sessions, operation, args.duration, args.busy_wait)
+            print('%-8s %8d %8d %8d %8d %10.1f %9s %9s %9s' %
+                  (operation, result['ok'], result['busy'],
+                   result['errors'], result['timeouts'],
+                   result['throughput'], result['p50_ms'],
+                   result['p99_ms'], result['max_ms']))
+            if operation != 'status':
+                # Let the outlets switch before the next operation
+                time.sleep(2 * args.switch_delay + args.reboot_time + 1)
+    finally:
+        for session in sessions:
+            session.close()
+        if server is not None and server.poll() is None:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+        for pdu in pdus:
+            pdu.stop()
+        shutil.rmtree(home, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())